@@ -0,0 +1,234 @@
+"""Rolling backtest: how well did the forecast predict what sold?
+
+The forecast is replayed as if it had been run at each past cut-off week,
+with a historical horizon of the same length as the planner's ending at the
+cut-off. Its step #15 projections for the next 8, 13 and 26 weeks are then
+compared with the 'Actual Sales Units' of the weeks that followed, giving
+MAE, bias and WAPE by SKU and by category.
+
+Running the whole pipeline once per cut-off is far too slow, so every
+cut-off is evaluated together on the ``week_cube.WeekCube`` of the history:
+
+* the #5.1 averages, the #10.4 horizon counts and the actual sales after
+  each cut-off are rolling-window totals read from prefix sums along the
+  per-SKU week axis, as ``[n_skus, n_cutoffs]`` arrays, and
+* the OPP test (#7) depends on each cut-off's average, so the in-stock
+  sums (#10.1-#10.3) compare a strided ``[SKU, cut-off, week]`` view of
+  the window cells against it, a block of cut-offs at a time.
+
+Usage::
+
+    python backtest.py extract.xlsx backtest.xlsx [--step 4] [--window-weeks 52] [--param name=value ...]
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import forecast_engine as fe
+import week_cube
+
+
+# Step #15 projections checked: weeks covered and the diminishing-return parameter used
+HORIZONS = {
+    'Total_9wks_Sales_once_off_repeat': (8, 'medium_horizon_diminishing_return'),
+    'Total_Qtr_Sales': (13, 'medium_horizon_diminishing_return'),
+    'Total_Season_Sales': (26, 'long_horizon_diminishing_return'),
+}
+# SKU x cut-off x week cells compared at a time for the OPP mask
+BLOCK_CELLS = 4_000_000
+ACCURACY_COLUMNS = ['horizon_weeks', 'n', 'forecast', 'actual', 'MAE', 'bias', 'WAPE']
+
+
+def window_length(cube, params):
+    """Weeks in the planner's historical horizon, on the cube's calendar."""
+    start = cube.calendar.start_ordinal(params.historical_horizon_period_start)
+    return cube.calendar.end_ordinal(params.historical_horizon_period_end) - start + 1
+
+
+def data_weeks(cube):
+    """First and last week ordinals holding any sales data (the calendar pads whole years)."""
+    has_data = np.flatnonzero(~np.isnan(cube.cells['sales']).all(axis=0))
+    if len(has_data) == 0:
+        return 0, -1
+    return int(has_data[0]), int(has_data[-1])
+
+
+def default_cutoffs(cube, window_weeks, step=1):
+    """Every ``step``-th week ordinal with a full window of data before it and at least 8 weeks after.
+
+    Counted back from the latest such week, so it is always included.
+    """
+    first, last = data_weeks(cube)
+    shortest = min(weeks for weeks, _ in HORIZONS.values())
+    return np.arange(last - shortest, first + window_weeks - 2, -step)[::-1]
+
+
+def base_sales(cube, params, cutoffs, window_weeks):
+    """Steps #5-#11 at each cut-off ordinal: ``(Use_this_ave_sales_u, no_of_weeks_reviewed)``.
+
+    Both are ``[n_skus, n_cutoffs]``; the window of cut-off ``c`` is the
+    ``window_weeks`` weeks ending with ``c``.
+    """
+    starts = cutoffs - window_weeks + 1
+    ends = cutoffs + 1
+
+    def rolling(prefix):
+        return prefix[:, ends] - prefix[:, starts]
+
+    #5.1 average sales in each window
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average_sales = rolling(cube.prefix['sales']) / rolling(cube.prefix['sales_count'])
+
+    #6, #8, #10.4 the horizon and GP tests don't depend on the cut-off
+    sales = cube.cells['sales']
+    opening_stock = cube.cells['eow_stock'] + sales
+    horizon = opening_stock >= 2
+    horizon_prefix = np.zeros((cube.n_skus, cube.calendar.n_weeks + 1))
+    np.cumsum(horizon, axis=1, out=horizon_prefix[:, 1:])
+    horizon_count = rolling(horizon_prefix)
+    eligible = horizon & (cube.cells['margin'] >= params.min_acceptable_margin * 0.9)
+
+    #7, #9, #10.1-#10.3 the OPP test uses each window's own average
+    opening_windows = sliding_window_view(opening_stock, window_weeks, axis=1)
+    eligible_windows = sliding_window_view(eligible, window_weeks, axis=1)
+    sales_windows = sliding_window_view(sales, window_weeks, axis=1)
+    in_stock_sales = np.empty(average_sales.shape)
+    reviewed = np.empty(average_sales.shape)
+    block = max(1, BLOCK_CELLS // max(1, cube.n_skus * window_weeks))
+    for i in range(0, len(cutoffs), block):
+        part = slice(i, i + block)
+        threshold = average_sales[:, part, None] * params.stock_threshold
+        in_stock = (opening_windows[:, starts[part]] >= threshold) & eligible_windows[:, starts[part]]
+        in_stock_sales[:, part] = np.where(in_stock, sales_windows[:, starts[part]], 0.0).sum(axis=2)
+        reviewed[:, part] = in_stock.sum(axis=2)
+
+    #11 as in forecast_engine.forecast_intakes
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average = in_stock_sales / reviewed
+        low_data = (reviewed <= params.Min_no_of_data_points) | ((reviewed / horizon_count) <= params.data_reduction_threshold)
+    ave_sales = np.where(low_data, average * params.low_data_confidence, average * params.confidence)
+    return ave_sales, reviewed
+
+
+def backtest_errors(cube, params, cutoffs=None, window_weeks=None, step=1):
+    """Forecast and actual sales per cut-off, SKU and horizon as a tidy frame.
+
+    ``cutoffs`` are FINYWW values (default: every ``step``-th week that has
+    a full window before it). A SKU counts at a cut-off when it has weeks
+    meeting all three policies in that window, as in the forecast itself,
+    and a horizon only when the history covers all of its weeks.
+    """
+    if not cube.exact:
+        raise fe.ForecastError("The backtest needs one row per SKU and week; some SKU-weeks have several rows.")
+    if window_weeks is None:
+        window_weeks = window_length(cube, params)
+    if window_weeks < 1:
+        raise fe.ForecastError("The historical horizon must cover at least one week.")
+    first, last = data_weeks(cube)
+    if cutoffs is None:
+        ordinals = default_cutoffs(cube, window_weeks, step)
+    else:
+        ordinals = cube.calendar.ordinal(np.asarray(cutoffs, dtype='int64'))
+        outside = (ordinals < first + window_weeks - 1) | (ordinals >= last)
+        if outside.any():
+            raise fe.ForecastError(
+                "Cut-offs need a full historical horizon of data before them and some weeks after: "
+                + ", ".join(str(c) for c in np.asarray(cutoffs)[outside])
+            )
+    if len(ordinals) == 0:
+        raise fe.ForecastError("The history is too short for any cut-off with a full horizon before it.")
+
+    ave_sales, reviewed = base_sales(cube, params, ordinals, window_weeks)
+    year_weeks = cube.calendar.year_weeks()
+    sales_prefix = cube.prefix['sales']
+
+    frames = []
+    for column, (weeks, diminishing_return) in HORIZONS.items():
+        #15 projection, against the sales of the ``weeks`` weeks after the cut-off
+        complete = ordinals + weeks <= last
+        cut = ordinals[complete]
+        forecast = np.round(ave_sales[:, complete] * weeks * getattr(params, diminishing_return))
+        actual = sales_prefix[:, cut + 1 + weeks] - sales_prefix[:, cut + 1]
+        sku, i = np.nonzero(reviewed[:, complete] > 0)
+        frames.append(pd.DataFrame({
+            'cutoff': year_weeks[cut[i]],
+            'SKU ID': cube.skus[sku],
+            'horizon': column,
+            'horizon_weeks': weeks,
+            'forecast': forecast[sku, i],
+            'actual': actual[sku, i],
+        }))
+    errors = pd.concat(frames, ignore_index=True)
+    errors['error'] = errors['forecast'] - errors['actual']
+    return errors
+
+
+def accuracy(errors, by):
+    """MAE, bias (mean forecast minus actual) and WAPE of ``errors`` per ``by`` and horizon."""
+    keys = list(by) + ['horizon']
+    grouped = errors.assign(abs_error=errors['error'].abs()).groupby(keys, observed=True, sort=False)
+    table = grouped.agg(
+        horizon_weeks=('horizon_weeks', 'first'),
+        n=('error', 'size'),
+        forecast=('forecast', 'sum'),
+        actual=('actual', 'sum'),
+        error=('error', 'sum'),
+        abs_error=('abs_error', 'sum'),
+    ).reset_index()
+    table['MAE'] = table['abs_error'] / table['n']
+    table['bias'] = table['error'] / table['n']
+    table['WAPE'] = table['abs_error'] / table['actual'].where(table['actual'] != 0)
+    return table.sort_values(list(by) + ['horizon_weeks'], kind='stable', ignore_index=True)[keys + ACCURACY_COLUMNS]
+
+
+def run_backtest(df, params=None, cutoffs=None, window_weeks=None, step=1, category='Category Level 1'):
+    """Backtest the forecast on the sales history ``df``.
+
+    Returns ``(errors, by_sku, by_category)``: the tidy per-cut-off table of
+    ``backtest_errors`` and its ``accuracy`` per SKU and per ``category``
+    (any attribute column, e.g. a ``HIERARCHY_LEVELS`` level).
+    """
+    if params is None:
+        params = fe.ForecastParams()
+    fe.validate_schema(df)
+    cube = week_cube.build_cube(df)
+    errors = backtest_errors(cube, params, cutoffs, window_weeks, step)
+
+    attributes = fe.first_rows(df, 'SKU ID', ['SKU ID', category])
+    by_category = accuracy(errors.merge(attributes, on='SKU ID', how='left'), [category])
+    return errors, accuracy(errors, ['SKU ID']), by_category
+
+
+def main(argv=None):
+    from batch_forecast import make_params
+    from export import write_xlsx
+    from ingest import read_upload
+
+    parser = argparse.ArgumentParser(description="Backtest the forecast over past cut-off weeks.")
+    parser.add_argument('input', help="sales history extract")
+    parser.add_argument('output', help=".xlsx workbook to write the accuracy tables to")
+    parser.add_argument('--step', type=int, default=1, help="weeks between cut-offs (default: every week)")
+    parser.add_argument('--window-weeks', type=int, default=None,
+                        help="historical horizon length (default: the length of the configured horizon)")
+    parser.add_argument('--category', default='Category Level 1', help="attribute column for the category table")
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help="ForecastParams override (repeatable)")
+    args = parser.parse_args(argv)
+
+    with open(args.input, 'rb') as f:
+        df = read_upload(f.read(), args.input)
+    params = make_params(dict(item.split('=', 1) for item in args.param))
+    errors, by_sku, by_category = run_backtest(df, params, window_weeks=args.window_weeks,
+                                               step=args.step, category=args.category)
+    overall = accuracy(errors, [])
+    write_xlsx({'Overall': overall, 'By Category': by_category, 'By SKU': by_sku}, args.output)
+    print(f"{errors['cutoff'].nunique()} cut-offs, {errors['SKU ID'].nunique()} SKUs")
+    print(overall.to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""Run forecasts for many files and parameter sets from the command line.
+
+Usage::
+
+    python batch_forecast.py manifest.json [--workers N] [--partitions N] [--chunk-rows N] [--format xlsx|parquet|csv]
+
+The manifest is either JSON::
+
+    {
+      "defaults": {"min_acceptable_margin": 0.35},
+      "jobs": [
+        {"input": "brand_a.xlsx"},
+        {"input": "brand_b.csv", "name": "tight", "params": {"min_acceptable_margin": 0.4}}
+      ]
+    }
+
+or a CSV with an ``input`` column, optional ``name``/``output`` columns and
+one column per ``ForecastParams`` field to override. Relative paths are
+resolved against the manifest's folder. Each result is written next to its
+input as ``<input>[_<name>]_forecast.<format>`` and a JSON summary of
+per-job timings and failures is written next to the manifest.
+
+Jobs run on a process pool sized to the machine. ``--chunk-rows`` reads each
+input in chunks of that many rows (see ``out_of_core``) for extracts that
+don't fit in memory. Nothing here imports
+Streamlit, so it runs headless on the scheduler boxes.
+"""
+import argparse
+import csv
+import dataclasses
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import forecast_engine as fe
+
+
+FORMATS = ('xlsx', 'parquet', 'csv')
+PARAM_FIELDS = {f.name: f.type for f in dataclasses.fields(fe.ForecastParams)}
+
+
+class ManifestError(ValueError):
+    """Raised when the batch manifest can't be used."""
+
+
+def _param_value(name, value):
+    if name not in PARAM_FIELDS:
+        raise ManifestError(f"unknown forecast parameter {name!r}")
+    kind = int if PARAM_FIELDS[name] in (int, 'int') else float
+    return kind(value)
+
+
+def make_params(*overrides):
+    values = {}
+    for override in overrides:
+        for name, value in (override or {}).items():
+            if value not in (None, ''):
+                values[name] = _param_value(name, value)
+    return fe.ForecastParams(**values)
+
+
+def _output_path(input_path, name, fmt):
+    stem, _ = os.path.splitext(input_path)
+    suffix = f'_{name}' if name else ''
+    return f'{stem}{suffix}_forecast.{fmt}'
+
+
+def read_manifest(path, fmt='xlsx'):
+    """Return the list of jobs (dicts with input, output, name and params) in a manifest."""
+    base = os.path.dirname(os.path.abspath(path))
+    if path.lower().endswith('.csv'):
+        with open(path, newline='') as f:
+            entries = []
+            for row in csv.DictReader(f):
+                extra = {k: v for k, v in row.items() if k not in ('input', 'name', 'output')}
+                entries.append({'input': row.get('input'), 'name': row.get('name'),
+                                'output': row.get('output'), 'params': extra})
+        defaults = {}
+    else:
+        with open(path) as f:
+            manifest = json.load(f)
+        if isinstance(manifest, list):
+            manifest = {'jobs': manifest}
+        entries = manifest.get('jobs', [])
+        defaults = manifest.get('defaults', {})
+
+    jobs = []
+    for i, entry in enumerate(entries):
+        if not entry.get('input'):
+            raise ManifestError(f"job {i + 1} has no input file")
+        input_path = os.path.join(base, entry['input'])
+        name = entry.get('name') or ''
+        output = entry.get('output')
+        output = os.path.join(base, output) if output else _output_path(input_path, name, fmt)
+        jobs.append({
+            'job': i + 1,
+            'input': input_path,
+            'name': name,
+            'output': output,
+            'params': make_params(defaults, entry.get('params')),
+        })
+
+    outputs = [job['output'] for job in jobs]
+    duplicates = sorted({o for o in outputs if outputs.count(o) > 1})
+    if duplicates:
+        raise ManifestError("several jobs write to " + ", ".join(duplicates) + "; give them distinct names")
+    return jobs
+
+
+def write_results(sku_df, product_df, path):
+    """Write both result levels; xlsx gets one sheet each, other formats a second file."""
+    from export import arrow_safe, write_xlsx
+
+    fmt = os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt == 'xlsx':
+        write_xlsx({'SKU Forecast': sku_df, 'Product Forecast': product_df}, path)
+        return [path]
+    product_path = path[:-len(fmt) - 1] + '_products.' + fmt
+    for df, target in ((sku_df, path), (product_df, product_path)):
+        if fmt == 'parquet':
+            arrow_safe(df).to_parquet(target, index=False)
+        else:
+            df.to_csv(target, index=False)
+    return [path, product_path]
+
+
+def run_job(job, partitions=None, chunk_rows=None):
+    """Run one manifest job; never raises, failures are reported in the result.
+
+    ``partitions`` > 1 splits the job's SKUs across that many processes; jobs
+    are otherwise aggregated serially, as they already share the batch pool.
+    ``chunk_rows`` reads the input that many rows at a time instead of whole.
+    """
+    from upload_cache import UploadCache
+    from ingest import read_upload
+
+    result = {'job': job['job'], 'input': job['input'], 'name': job['name'], 'status': 'ok'}
+    started = time.perf_counter()
+    try:
+        if chunk_rows:
+            import out_of_core
+
+            loaded = started
+            sku_df, product_df = out_of_core.run_forecast_file(job['input'], job['params'], chunk_rows)
+            rows = None
+        else:
+            with open(job['input'], 'rb') as f:
+                data = f.read()
+            df = UploadCache().load(data, lambda d: read_upload(d, job['input']))
+            loaded = time.perf_counter()
+            sku_df, product_df = fe.run_forecast(df, job['params'], workers=partitions or 1)
+            rows = len(df)
+        forecast_done = time.perf_counter()
+        result['outputs'] = write_results(sku_df, product_df, job['output'])
+        result.update(
+            rows=rows,
+            skus=len(sku_df),
+            products=len(product_df),
+            read_seconds=round(loaded - started, 3),
+            forecast_seconds=round(forecast_done - loaded, 3),
+            write_seconds=round(time.perf_counter() - forecast_done, 3),
+        )
+    except Exception as exc:
+        result.update(status='failed', error=f'{type(exc).__name__}: {exc}', traceback=traceback.format_exc())
+    finally:
+        if partitions and partitions > 1:
+            import parallel_engine
+
+            # A partition pool left running keeps a batch worker process from exiting
+            parallel_engine.shutdown_pools()
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run_batch(jobs, workers=None, partitions=None, chunk_rows=None):
+    """Run ``jobs`` on a process pool and return their results in job order.
+
+    A summary line is printed as each job finishes.
+    """
+    workers = workers or os.cpu_count() or 1
+    results = []
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            results.append(run_job(job, partitions, chunk_rows))
+            print(_summary_line(results[-1]), flush=True)
+        return results
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        futures = [pool.submit(run_job, job, partitions, chunk_rows) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            print(_summary_line(result), flush=True)
+            results.append(result)
+    return sorted(results, key=lambda r: r['job'])
+
+
+def _summary_line(result):
+    label = os.path.basename(result['input']) + (f" [{result['name']}]" if result['name'] else '')
+    if result['status'] == 'ok':
+        return f"  ok      {label}: {result['skus']} SKUs in {result['seconds']}s"
+    return f"  FAILED  {label}: {result['error']}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Toolkie forecasts for every job in a manifest.")
+    parser.add_argument('manifest', help="JSON or CSV manifest of input files and parameter sets")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--partitions', type=int, default=None,
+                        help="split each job's SKUs across this many processes (for very large single files)")
+    parser.add_argument('--chunk-rows', type=int, default=None,
+                        help="read each input this many rows at a time (for extracts larger than memory)")
+    parser.add_argument('--format', choices=FORMATS, default='xlsx', help="output format (default: xlsx)")
+    parser.add_argument('--summary', default=None, help="where to write the JSON summary")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = read_manifest(args.manifest, args.format)
+    except (OSError, ValueError) as exc:
+        parser.error(str(exc))
+
+    started = time.perf_counter()
+    print(f"Running {len(jobs)} job(s)...", flush=True)
+    results = run_batch(jobs, args.workers, args.partitions, args.chunk_rows)
+
+    failed = [r for r in results if r['status'] != 'ok']
+    summary = {
+        'manifest': os.path.abspath(args.manifest),
+        'jobs': len(results),
+        'failed': len(failed),
+        'seconds': round(time.perf_counter() - started, 3),
+        'results': results,
+    }
+    summary_path = args.summary or os.path.splitext(args.manifest)[0] + '_summary.json'
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f"{len(results) - len(failed)} succeeded, {len(failed)} failed in {summary['seconds']}s; summary: {summary_path}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
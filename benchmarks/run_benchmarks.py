@@ -0,0 +1,191 @@
+"""Time and memory-profile every stage of the forecast on synthetic data.
+
+Usage (from the repository root)::
+
+    python -m benchmarks.run_benchmarks                    # 1k, 10k, 100k rows vs the baseline
+    python -m benchmarks.run_benchmarks --sizes 1000000    # the 1M-row extract
+    python -m benchmarks.run_benchmarks --update-baseline  # record new baseline numbers
+
+Each stage is timed on its own (best of ``--repeat`` runs), then run once
+more under tracemalloc for its peak Python memory. Results are compared
+with ``benchmarks/baseline.json`` and the exit code is 1 if any stage got
+slower or hungrier than the baseline by more than ``--tolerance``.
+Baselines are machine specific; record them on the box that runs the check.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+
+import forecast_engine as fe
+import ingest
+from export import to_bytes, write_xlsx
+from benchmarks.synthetic import make_sales_frame
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+# Writing and parsing workbooks above this many rows takes minutes
+MAX_EXCEL_ROWS = 100_000
+# Absolute slack so tiny stages don't fail on timer noise
+SLACK_SECONDS = 0.05
+SLACK_MB = 1.0
+
+
+def pipeline_stages(xlsx_bytes, params):
+    """The forecast as ``[(stage name, function of the previous stage's output)]``."""
+    def aggregate(df):
+        year_weeks = fe.year_week(df)
+        max_yearweek = fe.latest_completed_week(df, year_weeks)
+        arrays = fe.sales_arrays(df, year_weeks)
+        return df, arrays.skus, fe.sku_sums(arrays, params, max_yearweek)
+
+    def merge(state):
+        df, skus, sums = state
+        return df, fe.sku_frame(skus, sums)
+
+    def intake_maths(state):
+        df, merged_df = state
+        return df, fe.forecast_intakes(merged_df, params)
+
+    def attributes(state):
+        df, merged_df = state
+        return df, fe.attach_attributes(df, merged_df)
+
+    def product_rollup(state):
+        df, sku_df = state
+        return sku_df, fe.product_rollup(df, sku_df)
+
+    def export_xlsx(state):
+        sku_df, product_df = state
+        return to_bytes({'SKU Forecast': sku_df, 'Product Forecast': product_df}, 'xlsx')
+
+    stages = []
+    if xlsx_bytes is not None:
+        stages.append(('read_excel', lambda _: ingest.read_upload(xlsx_bytes)))
+    stages += [
+        ('aggregate #5-#10', aggregate),
+        ('merge #10.7/#14', merge),
+        ('intake_maths #11/#15', intake_maths),
+        ('attributes #16-#18', attributes),
+        ('product_rollup', product_rollup),
+        ('export_xlsx', export_xlsx),
+    ]
+    return stages
+
+
+def _timed(func, value, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        result = func(value)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def _peak_mb(func, value):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(value)
+        return tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_size(n_rows, repeat=3, memory=True, params=None, max_excel_rows=MAX_EXCEL_ROWS):
+    """``{stage: {'seconds': ..., 'peak_mb': ...}}`` for one synthetic extract size."""
+    params = params or fe.ForecastParams()
+    df = make_sales_frame(n_rows)
+    xlsx_bytes = None
+    if n_rows <= max_excel_rows:
+        from io import BytesIO
+
+        buffer = BytesIO()
+        write_xlsx({'Sheet1': df}, buffer)
+        xlsx_bytes = buffer.getvalue()
+    else:
+        df = ingest.finalize_dtypes(df)
+
+    results = {}
+    value = df
+    for name, func in pipeline_stages(xlsx_bytes, params):
+        output, seconds = _timed(func, value, repeat)
+        results[name] = {'seconds': round(seconds, 4)}
+        if memory:
+            results[name]['peak_mb'] = round(_peak_mb(func, value), 2)
+        value = output
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Regression messages for every stage worse than ``baseline`` by more than ``tolerance``."""
+    regressions = []
+    for size, stages in results.items():
+        for stage, measured in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if not base:
+                continue
+            if measured['seconds'] > base['seconds'] * (1 + tolerance) + SLACK_SECONDS:
+                regressions.append(f"{size} rows, {stage}: {measured['seconds']}s vs baseline {base['seconds']}s")
+            if 'peak_mb' in measured and 'peak_mb' in base:
+                if measured['peak_mb'] > base['peak_mb'] * (1 + tolerance) + SLACK_MB:
+                    regressions.append(f"{size} rows, {stage}: {measured['peak_mb']} MB vs baseline {base['peak_mb']} MB")
+    return regressions
+
+
+def _print_table(size, stages):
+    print(f"\n{size:,} rows")
+    for stage, measured in stages.items():
+        memory = f"{measured['peak_mb']:>9.1f} MB" if 'peak_mb' in measured else ''
+        print(f"  {stage:<22} {measured['seconds']:>9.4f} s {memory}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the forecast stages on synthetic extracts.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="rows (SKU-weeks) per extract")
+    parser.add_argument('--repeat', type=int, default=3, help="timing runs per stage; the best is kept")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+    parser.add_argument('--max-excel-rows', type=int, default=MAX_EXCEL_ROWS,
+                        help="skip the Excel read stage above this many rows")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.5, help="allowed relative slowdown (0.5 = 50%%)")
+    parser.add_argument('--update-baseline', action='store_true', help="write these results as the new baseline")
+    args = parser.parse_args(argv)
+
+    warnings.simplefilter('ignore', FutureWarning)
+    results = {}
+    for n_rows in args.sizes:
+        results[str(n_rows)] = benchmark_size(n_rows, args.repeat, not args.no_memory, max_excel_rows=args.max_excel_rows)
+        _print_table(n_rows, results[str(n_rows)])
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions against the baseline:")
+        for message in regressions:
+            print("  " + message)
+        return 1
+    print("\nNo regressions against the baseline." if baseline else "\nNo baseline to compare against yet.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Synthetic sales extracts with the column schema the Toolkie expects.
+
+``make_sales_frame(n_rows)`` returns about ``n_rows`` SKU-week rows spread
+over 52 fiscal weeks that cross a financial year (202440 to 202539), with
+a few SKUs per product, realistic gaps, missing sales and "-" margins.
+"""
+import numpy as np
+import pandas as pd
+
+
+WEEKS = [(2024, w) for w in range(40, 53)] + [(2025, w) for w in range(1, 40)]
+BRANDS = ['Aster', 'Birch', 'Cedar', 'Dune', 'Elm', 'Fern']
+DEPARTMENTS = ['Ladies', 'Mens', 'Kids', 'Home']
+CATEGORIES_1 = ['Tops', 'Bottoms', 'Dresses', 'Outerwear', 'Footwear', 'Accessories', 'Bedding', 'Kitchen']
+CATEGORIES_2 = ['Core', 'Fashion', 'Basics', 'Premium', 'Value']
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+SKUS_PER_PRODUCT = 4
+
+
+def make_sales_frame(n_rows, seed=0):
+    """About ``n_rows`` SKU-week rows in random order."""
+    rng = np.random.default_rng(seed)
+    n_weeks = len(WEEKS)
+    n_skus = max(1, -(-n_rows // n_weeks))
+
+    sku = np.repeat(np.arange(n_skus), n_weeks)[:n_rows]
+    week_index = np.tile(np.arange(n_weeks), n_skus)[:n_rows]
+    n = len(sku)
+    product = sku // SKUS_PER_PRODUCT
+    fin_year = np.array([y for y, _ in WEEKS])[week_index]
+    week = np.array([w for _, w in WEEKS])[week_index]
+
+    rate = rng.gamma(1.5, 2.0, n_skus)[sku]
+    sales = rng.poisson(rate).astype('float64')
+    sales[rng.random(n) < 0.01] = np.nan
+    margin = np.round(rng.normal(0.42, 0.1, n), 4).astype(object)
+    margin[rng.random(n) < 0.01] = '-'
+
+    df = pd.DataFrame({
+        'SKU ID': 10_000_000 + sku,
+        'Product ID': 500_000 + product,
+        'Fin Year': fin_year,
+        'Week': week,
+        'Actual Sales Units': sales,
+        'Actual EOW Stock Units': rng.poisson(rate * 3).astype('float64'),
+        'Actual Current Stock Units': rng.poisson(rate * 2.5).astype('float64'),
+        'Actual Intake Units': rng.poisson(rate * 0.8).astype('float64'),
+        'Expected Intake Units': rng.poisson(rate * 0.8).astype('float64'),
+        'Actual Sales Margin %': margin,
+        'Current RSP (incl VAT)': np.round(rng.uniform(49, 999, n_skus // SKUS_PER_PRODUCT + 1), 2)[product],
+        'Image 1 URL': [f'https://images.example.com/{p}.jpg' for p in 500_000 + product],
+        'product_url': [f'https://shop.example.com/p/{p}' for p in 500_000 + product],
+        'Brand': np.array(BRANDS)[product % len(BRANDS)],
+        'Department': np.array(DEPARTMENTS)[product % len(DEPARTMENTS)],
+        'Category Level 1': np.array(CATEGORIES_1)[product % len(CATEGORIES_1)],
+        'Category Level 2': np.array(CATEGORIES_2)[product % len(CATEGORIES_2)],
+        'Product': [f'Product {p}' for p in product],
+        'Size': np.array(SIZES)[sku % len(SIZES)],
+    })
+    # Some SKUs only launched part way through the year
+    late = rng.random(n_skus)[sku] < 0.1
+    df = df[~(late & (week_index < n_weeks // 2))]
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def write_workbook(df, path):
+    """Write ``df`` as an .xlsx workbook like the BI export."""
+    from export import write_xlsx
+
+    write_xlsx({'Sheet1': df}, path)
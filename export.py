@@ -0,0 +1,126 @@
+"""Result downloads: streaming Excel, Parquet and CSV.
+
+Workbooks are written with openpyxl's write-only mode, which streams rows
+to the file instead of building the whole cell model in memory. Each
+download is produced only when its format is asked for, and kept in a
+small process-wide LRU keyed by (input hash, parameters, level, format), so
+re-rendering the page doesn't rebuild it.
+"""
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import pandas as pd
+
+
+EXPORT_FORMATS = {
+    'xlsx': ("Excel", "forecast_results.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    'parquet': ("Parquet", "forecast_results.parquet", "application/vnd.apache.parquet"),
+    'csv': ("CSV", "forecast_results.csv", "text/csv"),
+}
+MAX_EXPORT_CACHE_BYTES = 512 * 1024 ** 2
+# Rows converted to cell values at a time while streaming a sheet
+CHUNK_ROWS = 5_000
+
+
+def _mixed(values):
+    return pd.api.types.infer_dtype(values, skipna=True) in ('mixed', 'mixed-integer', 'mixed-integer-float')
+
+
+def arrow_safe(df):
+    """Make mixed-type text columns storable in Parquet and Arrow.
+
+    Object columns mixing text and numbers (e.g. a margin column containing
+    "-") and categoricals whose categories do (e.g. a Size of 10 and "M")
+    are stored as text, categoricals staying categorical; the forecast
+    coerces the numeric ones again. Every Parquet or Arrow writer goes
+    through this.
+    """
+    df = df.copy(deep=False)
+    for column in df.columns:
+        values = df[column]
+        if values.dtype == object:
+            if _mixed(values):
+                df[column] = values.where(values.isna(), values.astype(str))
+        elif isinstance(values.dtype, pd.CategoricalDtype) and values.cat.categories.dtype == object:
+            if _mixed(values.cat.categories):
+                df[column] = values.astype(str).where(values.notna()).astype('category')
+    return df
+
+
+def _cell_rows(df):
+    """Rows of ``df`` as tuples of cell values, NaN as empty cells, a chunk at a time."""
+    for start in range(0, len(df), CHUNK_ROWS):
+        chunk = df.iloc[start:start + CHUNK_ROWS]
+        columns = []
+        for name in chunk.columns:
+            values = chunk[name].to_numpy(dtype=object)
+            missing = pd.isna(values)
+            if missing.any():
+                values[missing] = None
+            columns.append(values)
+        yield from zip(*columns)
+
+
+def write_xlsx(sheets, target):
+    """Stream ``{sheet name: frame}`` into an .xlsx workbook at ``target`` (path or file)."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for name, df in sheets.items():
+        sheet = workbook.create_sheet(title=name[:31])
+        sheet.append([str(c) for c in df.columns])
+        for row in _cell_rows(df):
+            sheet.append(row)
+    workbook.save(target)
+
+
+def to_bytes(sheets, fmt):
+    """Serialise results to ``fmt``. Parquet and CSV take a single frame."""
+    buffer = BytesIO()
+    if fmt == 'xlsx':
+        write_xlsx(sheets, buffer)
+    else:
+        (df,) = sheets.values()
+        if fmt == 'parquet':
+            arrow_safe(df).to_parquet(buffer, index=False, compression='zstd')
+        elif fmt == 'csv':
+            df.to_csv(buffer, index=False)
+        else:
+            raise ValueError(f"unknown export format {fmt!r}")
+    return buffer.getvalue()
+
+
+class ExportCache:
+    """Thread-safe LRU of serialised downloads bounded by total bytes."""
+
+    def __init__(self, max_bytes=MAX_EXPORT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+        # Build outside the lock; two sessions may race to build the same file, which is harmless
+        data = build()
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = data
+                self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return data
+
+
+_cache = ExportCache()
+
+
+def export_results(key, sheets, fmt):
+    """Bytes of ``sheets`` in ``fmt``, built on first request for ``key`` and cached after."""
+    return _cache.get_or_build((key, fmt, tuple(sheets)), lambda: to_bytes(sheets, fmt))
@@ -0,0 +1,219 @@
+"""HTTP API for the forecast, for the replenishment system and nightly jobs.
+
+Usage::
+
+    python forecast_api.py [--host 127.0.0.1] [--port 8502] [--workers N] [--max-queue N]
+
+Endpoints:
+
+``POST /forecast``
+    The body is the sales extract as Parquet, Arrow IPC (file or stream) or
+    CSV. ``ForecastParams`` fields go in the query string, e.g.
+    ``?historical_horizon_period_start=202440&min_acceptable_margin=0.35``.
+    ``level=sku`` (default) or ``level=product`` picks the result table and
+    ``format=parquet`` (default) or ``format=arrow`` its encoding. Both
+    levels are computed together and kept in the shared result cache, so
+    asking for the other level of the same forecast afterwards is instant.
+
+``GET /health``
+    Queue depth, running jobs, request counts and latency percentiles.
+
+Forecasts run on a bounded worker pool (see ``jobs``). When more than
+``--max-queue`` requests are already waiting the API answers 503 with a
+``Retry-After`` header instead of queueing without limit.
+"""
+import argparse
+import dataclasses
+import threading
+import time
+from collections import deque
+from io import BytesIO
+
+import numpy as np
+from flask import Flask, Response, jsonify, request
+
+import forecast_engine as fe
+from export import arrow_safe
+from jobs import CANCELLED, DONE, JobManager, MAX_JOB_WORKERS, QueueFull
+from result_cache import cache_stats, cached_forecast
+from upload_cache import content_hash, load_upload
+
+
+MAX_QUEUE = 8
+# Seconds a request waits for its forecast before giving up with a 504
+FORECAST_TIMEOUT = 600
+# Latencies kept for the percentiles on /health
+LATENCY_WINDOW = 1000
+PARAM_FIELDS = {f.name: f.type for f in dataclasses.fields(fe.ForecastParams)}
+LEVELS = ('sku', 'product')
+PAYLOAD_FORMATS = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+class RequestError(ValueError):
+    """A request the API can't serve; carries its HTTP status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ExtractError(ValueError):
+    """The request body couldn't be parsed as a sales extract."""
+
+
+def request_params(args):
+    """``ForecastParams`` from query arguments, ignoring the non-parameter ones."""
+    values = {}
+    for name, value in args.items():
+        if name not in PARAM_FIELDS or value == '':
+            continue
+        kind = int if PARAM_FIELDS[name] in (int, 'int') else float
+        try:
+            values[name] = kind(value)
+        except ValueError:
+            raise RequestError(f"parameter {name!r} must be a number, got {value!r}")
+    return fe.ForecastParams(**values)
+
+
+def encode(df, fmt):
+    """Serialise a result table as Parquet or an Arrow IPC stream."""
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(arrow_safe(df), preserve_index=False)
+    buffer = BytesIO()
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, buffer, compression='zstd')
+    else:
+        with pa.ipc.new_stream(buffer, table.schema) as writer:
+            writer.write_table(table)
+    return buffer.getvalue()
+
+
+class Metrics:
+    """Request counters and a window of recent forecast latencies."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.counts = {'ok': 0, 'client_error': 0, 'server_error': 0, 'rejected': 0}
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, outcome, seconds=None):
+        with self._lock:
+            self.counts[outcome] += 1
+            if seconds is not None:
+                self.latencies.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = np.array(self.latencies)
+            counts = dict(self.counts)
+        percentiles = {}
+        if len(latencies):
+            for q in (50, 90, 99):
+                percentiles[f'p{q}_ms'] = round(float(np.percentile(latencies, q)) * 1000, 1)
+        return {'requests': counts, 'latency': percentiles}
+
+
+def create_app(workers=MAX_JOB_WORKERS, max_queue=MAX_QUEUE, timeout=FORECAST_TIMEOUT):
+    app = Flask(__name__)
+    jobs = JobManager(max_workers=workers)
+    metrics = Metrics()
+
+    def run(data, params, tracer):
+        upload_key = content_hash(data)
+
+        def compute():
+            with tracer.stage('upload parse') as event:
+                try:
+                    df = load_upload(data, key=upload_key)
+                except fe.ForecastError:
+                    raise
+                except (ValueError, KeyError) as exc:
+                    raise ExtractError(str(exc)) from exc
+                event['rows_out'] = len(df)
+            # The tracer checks for cancellation as each stage starts
+            return fe.run_forecast(df, params, tracer=tracer)
+
+        return cached_forecast(upload_key, params, compute)
+
+    @app.errorhandler(RequestError)
+    def request_error(exc):
+        metrics.record('rejected' if exc.status == 503 else 'client_error')
+        response = jsonify(error=str(exc))
+        response.status_code = exc.status
+        if exc.status == 503:
+            response.headers['Retry-After'] = '5'
+        return response
+
+    @app.post('/forecast')
+    def forecast():
+        started = time.perf_counter()
+        level = request.args.get('level', 'sku')
+        fmt = request.args.get('format', 'parquet')
+        if level not in LEVELS:
+            raise RequestError(f"level must be one of {', '.join(LEVELS)}")
+        if fmt not in PAYLOAD_FORMATS:
+            raise RequestError(f"format must be one of {', '.join(PAYLOAD_FORMATS)}")
+        params = request_params(request.args)
+        data = request.get_data()
+        if not data:
+            raise RequestError("the request body must be the sales extract (Parquet, Arrow or CSV)")
+        try:
+            job = jobs.submit(lambda tracer: run(data, params, tracer), max_queued=max_queue)
+        except QueueFull:
+            raise RequestError("too many forecasts queued, retry shortly", 503)
+        if not job.wait(timeout):
+            job.cancel()
+            metrics.record('server_error')
+            return jsonify(error=f"forecast did not finish within {timeout}s"), 504
+        if job.status != DONE:
+            if isinstance(job.error, fe.ForecastError):
+                raise RequestError(str(job.error), 422)
+            if isinstance(job.error, ExtractError):
+                raise RequestError(f"could not read the sales extract: {job.error}")
+            metrics.record('server_error')
+            message = 'cancelled' if job.status == CANCELLED else repr(job.error)
+            return jsonify(error=message), 500
+
+        sku_df, product_df = job.result
+        payload = encode(sku_df if level == 'sku' else product_df, fmt)
+        metrics.record('ok', time.perf_counter() - started)
+        return Response(payload, mimetype=PAYLOAD_FORMATS[fmt], headers={
+            'X-Forecast-Rows': str(len(sku_df if level == 'sku' else product_df)),
+            'X-Forecast-Seconds': f'{time.perf_counter() - started:.3f}',
+        })
+
+    @app.get('/health')
+    def health():
+        return jsonify(
+            status='ok',
+            workers=workers,
+            queue_depth=jobs.queue_depth(),
+            max_queue=max_queue,
+            running=jobs.running(),
+            result_cache=cache_stats(),
+            **metrics.snapshot(),
+        )
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the forecast over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--workers', type=int, default=MAX_JOB_WORKERS, help="forecasts run at the same time")
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE, help="waiting forecasts before answering 503")
+    args = parser.parse_args(argv)
+
+    app = create_app(args.workers, args.max_queue)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,472 @@
+"""Headless forecast engine for the Toolkie.
+
+This is the logic that used to live inline under the "Generate Forecast"
+button in ``toolkie.py``. It has no Streamlit dependency so it can be
+imported from batch jobs, services and notebooks. Step numbers in the
+comments (#5.1, #10.4, ...) match the original page script.
+"""
+import os
+from dataclasses import asdict, dataclass
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import NULL_TRACER
+
+
+# Columns the forecast reads from the upload
+SALES_COLUMNS = [
+    'SKU ID', 'Fin Year', 'Week',
+    'Actual Sales Units', 'Actual EOW Stock Units', 'Actual Current Stock Units',
+    'Actual Intake Units', 'Expected Intake Units', 'Actual Sales Margin %',
+]
+ATTRIBUTE_COLUMNS = [
+    'SKU ID', 'Product ID', 'Current RSP (incl VAT)', 'Image 1 URL', 'product_url',
+    'Brand', 'Department', 'Category Level 1', 'Category Level 2', 'Product', 'Size',
+]
+REQUIRED_COLUMNS = SALES_COLUMNS + [c for c in ATTRIBUTE_COLUMNS if c not in SALES_COLUMNS]
+
+# Uploads with at least this many rows aggregate on ``parallel_engine.default_workers()`` processes
+# unless the caller passes ``workers``; below it process start-up and copying outweigh the gain
+PARALLEL_MIN_ROWS = int(os.environ.get('TOOLKIE_PARALLEL_MIN_ROWS', 2_000_000))
+
+# Column order of the SKU-level (#18) and product-level results
+SKU_RESULT_COLUMNS = [
+    'Brand', 'Department', 'Category Level 1', 'Category Level 2', 'SKU ID', 'Product ID', 'Product', 'Size',
+    'Current RSP (incl VAT)', 'Actual Intake Units', 'Actual Current Stock Units', 'Expected Intake Units',
+    'Tot Ave Sales U in horizon', 'count of horizon data point', 'Tot Sales U when in stock',
+    'Av Sales U when in stock', 'no_of_weeks_reviewed', 'Use_this_ave_sales_u',
+    'Total_Season_Sales', 'Total_Season_ideal_intakes', 'Total_Qtr_Sales', 'Total_Qtr_ideal_intakes',
+    'Total_9wks_Sales_once_off_repeat', 'Total_9wks_Sales_once_off_repeat_ideal_intakes',
+    'Image 1 URL', 'product_url',
+]
+PRODUCT_RESULT_COLUMNS = [
+    'Image 1 URL', 'Brand', 'Department', 'Category Level 1', 'Category Level 2', 'Product ID', 'Product',
+    'Current RSP (incl VAT)', 'Actual Intake Units', 'Actual Current Stock Units', 'Expected Intake Units',
+    'Tot Ave Sales U in horizon', 'count of horizon data point', 'Tot Sales U when in stock',
+    'Av Sales U when in stock', 'no_of_weeks_reviewed', 'Use_this_ave_sales_u',
+    'Total_Season_Sales', 'Total_Season_ideal_intakes', 'Total_Qtr_Sales', 'Total_Qtr_ideal_intakes',
+    'Total_9wks_Sales_once_off_repeat', 'Total_9wks_Sales_once_off_repeat_ideal_intakes',
+    'product_url',
+]
+PRODUCT_ATTRIBUTE_COLUMNS = [
+    'Product ID', 'Image 1 URL', 'product_url', 'Brand', 'Department',
+    'Category Level 1', 'Category Level 2', 'Product',
+]
+PRODUCT_AGGREGATIONS = {
+    'Current RSP (incl VAT)': 'mean',
+    'Actual Intake Units': 'sum',
+    'Actual Current Stock Units': 'sum',
+    'Expected Intake Units': 'sum',
+    'Tot Ave Sales U in horizon': 'sum',
+    'count of horizon data point': 'max',
+    'Tot Sales U when in stock': 'sum',
+    'Av Sales U when in stock': 'sum',
+    'no_of_weeks_reviewed': 'max',
+    'Use_this_ave_sales_u': 'sum',
+    'Total_Season_Sales': 'sum',
+    'Total_Season_ideal_intakes': 'sum',
+    'Total_Qtr_Sales': 'sum',
+    'Total_Qtr_ideal_intakes': 'sum',
+    'Total_9wks_Sales_once_off_repeat': 'sum',
+    'Total_9wks_Sales_once_off_repeat_ideal_intakes': 'sum',
+}
+
+# Merchandise hierarchy above Product, finest level first. Each level's
+# rollup is grouped by that level and every level above it.
+HIERARCHY_LEVELS = ['Category Level 2', 'Category Level 1', 'Department', 'Brand']
+HIERARCHY_MEASURES = [c for c in PRODUCT_RESULT_COLUMNS if c in PRODUCT_AGGREGATIONS]
+
+# Measures summed per SKU in the fused #10/#12/#13 pass, in column order
+SKU_MEASURES = [
+    'Tot Sales U when in stock', 'no_of_weeks_reviewed',
+    'Tot Sales U in horizon', 'count of horizon data point',
+    'Actual Intake Units', 'Expected Intake Units', 'Actual Current Stock Units',
+]
+
+
+class ForecastError(ValueError):
+    """Raised when the uploaded data can't be forecast (e.g. missing columns)."""
+
+
+@dataclass(frozen=True)
+class ForecastParams:
+    """Planner inputs plus the global thresholds of the forecast.
+
+    Names follow the variables of the original page script.
+    """
+    historical_horizon_period_start: int = 202440
+    historical_horizon_period_end: int = 202533
+    min_acceptable_margin: float = 0.35
+    expected_period_start: int = 202529
+    expected_period_end: int = 202552
+    fin_year: int = 2025
+
+    # Global thresholds
+    required_seaonal_clr_percent: float = 0.9
+    required_quartery_clr_percent: float = 0.8
+    required_8wks_clr_percent: float = 0.7
+    long_horizon_diminishing_return: float = 0.95
+    medium_horizon_diminishing_return: float = 0.98
+    min_availability: int = 40
+    stock_threshold: float = 1
+    confidence: float = 0.85
+    low_data_confidence: float = 0.7
+    Min_no_of_data_points: int = 4
+    data_reduction_threshold: float = 0.5
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def validate_schema(df):
+    """Raise ForecastError if any column the forecast needs is missing."""
+    check_columns(df.columns)
+
+
+def check_columns(columns):
+    """Raise ForecastError unless every column in REQUIRED_COLUMNS is present."""
+    columns = set(columns)
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise ForecastError(
+            "The uploaded data must contain the column(s): " + ", ".join(f"'{c}'" for c in missing)
+        )
+
+
+def numeric_column(df, column):
+    """Return ``df[column]`` as a float64 array, with anything non-numeric as NaN."""
+    return pd.to_numeric(df[column], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+
+def year_week(df):
+    """FINYWW for every row (e.g. 2025 / 33 -> 202533), NaN where unparseable."""
+    return numeric_column(df, 'Fin Year') * 100 + numeric_column(df, 'Week')
+
+
+def latest_completed_week(df, year_weeks=None):
+    """The YearWeek with the most 'Actual Current Stock Units' across all SKUs."""
+    if year_weeks is None:
+        year_weeks = year_week(df)
+    weeksumsales = pd.Series(numeric_column(df, 'Actual Current Stock Units')).groupby(year_weeks).sum()
+    return weeksumsales.idxmax()
+
+
+def grouped_sums(codes, n_groups, weights):
+    """Sum every column of ``weights`` per group code as an ``[n_groups, k]`` array.
+
+    ``weights`` is a rows x k array or a list of k row-length columns (which
+    saves stacking them into one more copy of the data). Rows are accumulated
+    in their original order, so a group's result does not depend on which
+    other groups are present.
+    """
+    if isinstance(weights, np.ndarray):
+        weights = weights.T
+    sums = np.empty((n_groups, len(weights)))
+    for j, column in enumerate(weights):
+        sums[:, j] = np.bincount(codes, weights=column, minlength=n_groups)
+    return sums
+
+
+def fillna_zero(df):
+    """``df.fillna(0)`` that also works on categorical attribute columns.
+
+    Text categoricals are filled with the string '0', so their categories
+    stay all text and the results can still be written to Parquet.
+    """
+    categorical = set(df.select_dtypes('category').columns)
+    df = df.fillna({c: 0 for c in df.columns if c not in categorical})
+    for column in categorical:
+        values = df[column]
+        if values.isna().any():
+            zero = 0 if pd.api.types.is_numeric_dtype(values.cat.categories) else '0'
+            if zero not in values.cat.categories:
+                values = values.cat.add_categories([zero])
+            df[column] = values.fillna(zero)
+    return df
+
+
+def masked_values(mask, values):
+    """``values`` where ``mask`` holds and 0 elsewhere, NaN counted as 0 (as groupby sums do)."""
+    return np.where(mask, np.nan_to_num(values), 0.0)
+
+
+@dataclass(eq=False)
+class SalesArrays:
+    """The per-row numbers the aggregation works on, rows without a SKU ID dropped."""
+    skus: np.ndarray  # unique SKU IDs in order of first appearance
+    codes: np.ndarray  # position of each row's SKU in ``skus``
+    year_weeks: np.ndarray
+    sales: np.ndarray
+    eow_stock: np.ndarray
+    margin: np.ndarray
+    actual_intake: np.ndarray
+    expected_intake: np.ndarray
+    current_stock: np.ndarray
+
+    @property
+    def n_skus(self):
+        return len(self.skus)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+def sales_arrays(df, year_weeks=None):
+    """Extract the numeric columns of ``df`` once as float64 arrays."""
+    if year_weeks is None:
+        year_weeks = year_week(df)
+    codes, skus = pd.factorize(df['SKU ID'])
+    valid = codes >= 0
+    # Only copy the rows out when some lack a SKU ID
+    rows = slice(None) if valid.all() else valid
+    return SalesArrays(
+        skus=np.asarray(skus),
+        codes=codes[rows],
+        year_weeks=year_weeks[rows],
+        sales=numeric_column(df, 'Actual Sales Units')[rows],
+        eow_stock=numeric_column(df, 'Actual EOW Stock Units')[rows],
+        margin=numeric_column(df, 'Actual Sales Margin %')[rows],
+        actual_intake=numeric_column(df, 'Actual Intake Units')[rows],
+        expected_intake=numeric_column(df, 'Expected Intake Units')[rows],
+        current_stock=numeric_column(df, 'Actual Current Stock Units')[rows],
+    )
+
+
+def hrn_mask(arrays, params):
+    """Step #5: rows inside the historical horizon."""
+    yw = arrays.year_weeks
+    return (yw >= params.historical_horizon_period_start) & (yw <= params.historical_horizon_period_end)
+
+
+def horizon_masks(arrays, params, average_sales=None):
+    """Steps #5 to #7: the HRN, horizon (#10.4) and OPP row masks.
+
+    ``average_sales`` (per SKU) is taken from ``arrays`` unless given, e.g.
+    when the rows are processed in chunks.
+    """
+    sales = arrays.sales
+    hrn = hrn_mask(arrays, params)
+
+    #5.1 average sales per SKU over the historical horizon ("enough" stock threshold)
+    if average_sales is None:
+        has_sales = hrn & ~np.isnan(sales)
+        hrn_sums = grouped_sums(arrays.codes, arrays.n_skus, [masked_values(has_sales, sales), has_sales])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            average_sales = hrn_sums[:, 0] / hrn_sums[:, 1]
+
+    #6, #7 weeks in the horizon with enough opening stock
+    opening_stock = arrays.eow_stock + sales
+    horizon = hrn & (opening_stock >= 2)
+    opp = horizon & (opening_stock >= average_sales[arrays.codes] * params.stock_threshold)
+    return hrn, horizon, opp
+
+
+def in_stock_mask(arrays, opp, params):
+    """Steps #8 and #9: weeks meeting the OPP, GP and HRN policies together.
+
+    Margin is numeric by now, so the original `margin == ""` branch of GP
+    never matched and is left out.
+    """
+    gp = arrays.margin >= (params.min_acceptable_margin * 0.9)
+    return opp & gp
+
+
+def expected_mask(arrays, params):
+    """Step #12.1: weeks inside the expected intake window."""
+    yw = arrays.year_weeks
+    return (yw >= params.expected_period_start) & (yw <= params.expected_period_end)
+
+
+def resolve_workers(n_rows, workers=None):
+    """Processes to aggregate ``n_rows`` rows on: ``workers`` if given, else 1 below ``PARALLEL_MIN_ROWS``."""
+    if workers is not None:
+        return workers
+    if n_rows < PARALLEL_MIN_ROWS:
+        return 1
+    import parallel_engine
+
+    return parallel_engine.default_workers()
+
+
+def aggregate_skus(df, params, year_weeks=None, max_yearweek=None, workers=None):
+    """Steps #5 to #14: per-SKU sales, in-stock and intake measures as ``merged_df``.
+
+    All the per-SKU sums and counts for the "in-stock" (#10.1-#10.3) and
+    "horizon" (#10.4-#10.6) masks, the actual/expected intakes (#12) and the
+    current stock (#13) are taken in one grouped pass instead of filtering
+    and merging once per measure. With ``workers`` > 1 the SKUs are split
+    across worker processes (see ``parallel_engine``); the result is
+    bit-identical to the serial one.
+    """
+    if year_weeks is None:
+        year_weeks = year_week(df)
+    if max_yearweek is None:
+        max_yearweek = latest_completed_week(df, year_weeks)
+
+    arrays = sales_arrays(df, year_weeks)
+    if workers and workers > 1:
+        import parallel_engine
+
+        sums = parallel_engine.sku_sums(arrays, params, max_yearweek, workers)
+    else:
+        sums = sku_sums(arrays, params, max_yearweek)
+    return sku_frame(arrays.skus, sums)
+
+
+def sku_sums(arrays, params, max_yearweek):
+    """Per-SKU ``SKU_MEASURES`` sums for ``arrays`` as an ``[n_skus, 7]`` array."""
+    hrn, horizon, opp = horizon_masks(arrays, params)
+    in_stock = in_stock_mask(arrays, opp, params)
+    expected = expected_mask(arrays, params)
+    current = arrays.year_weeks == max_yearweek
+
+    #10, #12, #13 every per-SKU measure in one pass
+    weights = [
+        masked_values(in_stock, arrays.sales), in_stock,
+        masked_values(horizon, arrays.sales), horizon,
+        masked_values(hrn, arrays.actual_intake),
+        masked_values(expected, arrays.expected_intake),
+        masked_values(current, arrays.current_stock),
+    ]
+    return grouped_sums(arrays.codes, arrays.n_skus, weights)
+
+
+def sku_frame(skus, sums):
+    """Build ``merged_df`` from per-SKU ``SKU_MEASURES`` sums.
+
+    Only SKUs with at least one week meeting all three policies are kept, as
+    the inner merges of #10.7 did.
+    """
+    keep = sums[:, 1] > 0
+    sums = sums[keep]
+    reviewed = sums[:, 1].astype('int64')
+    horizon_count = sums[:, 3].astype('int64')
+    return pd.DataFrame({
+        'SKU ID': skus[keep],
+        'Tot Sales U in horizon': sums[:, 2],
+        'count of horizon data point': horizon_count,
+        'Tot Ave Sales U in horizon': sums[:, 2] / horizon_count,
+        'Tot Sales U when in stock': sums[:, 0],
+        'Av Sales U when in stock': sums[:, 0] / reviewed,
+        'no_of_weeks_reviewed': reviewed,
+        'Actual Intake Units': sums[:, 4],
+        'Expected Intake Units': sums[:, 5],
+        'Actual Current Stock Units': sums[:, 6],
+    })
+
+
+def forecast_intakes(merged_df, params):
+    """Steps #11 and #15: base weekly sales and the ideal intakes per horizon."""
+    merged_df = merged_df.copy()
+
+    #11 base average weekly sales, haircut harder when there is little clean data
+    merged_df['Use_this_ave_sales_u'] = np.where(
+        (merged_df['no_of_weeks_reviewed'] <= params.Min_no_of_data_points) |
+        ((merged_df['no_of_weeks_reviewed'] / merged_df['count of horizon data point']) <= params.data_reduction_threshold),
+        merged_df['Av Sales U when in stock'] * params.low_data_confidence,
+        merged_df['Av Sales U when in stock'] * params.confidence
+    )
+
+    #15
+    ave_sales = merged_df['Use_this_ave_sales_u']
+    current_stock = merged_df['Actual Current Stock Units']
+    merged_df['Total_Season_Sales'] = round(ave_sales * 26 * params.long_horizon_diminishing_return)
+    merged_df['Total_Season_ideal_intakes'] = round(merged_df['Total_Season_Sales'] / params.required_seaonal_clr_percent) - current_stock
+    merged_df['Total_Qtr_Sales'] = round(ave_sales * 13 * params.medium_horizon_diminishing_return)
+    merged_df['Total_Qtr_ideal_intakes'] = round(merged_df['Total_Qtr_Sales'] / params.required_quartery_clr_percent) - current_stock
+    merged_df['Total_9wks_Sales_once_off_repeat'] = round(ave_sales * 8 * params.medium_horizon_diminishing_return)
+    merged_df['Total_9wks_Sales_once_off_repeat_ideal_intakes'] = round(merged_df['Total_9wks_Sales_once_off_repeat'] / params.required_8wks_clr_percent) - current_stock
+    return merged_df
+
+
+def first_rows(df, key, columns):
+    """``df[columns].drop_duplicates(subset=key)`` without copying every row of ``columns`` first."""
+    return df.loc[~df[key].duplicated(), columns]
+
+
+def attach_attributes(df, merged_df):
+    """Steps #16 to #18: join product attributes onto the SKU results (``df_reordered``)."""
+    selected_columns_df = first_rows(df, 'SKU ID', ATTRIBUTE_COLUMNS)
+    selected_columns_df2 = fillna_zero(selected_columns_df.merge(merged_df, on='SKU ID'))
+    return selected_columns_df2[SKU_RESULT_COLUMNS]
+
+
+def product_rollup(df, df_reordered):
+    """Sum the SKU results up to 'Product ID' level (``df_reordered_2``)."""
+    df_summed = df_reordered.groupby('Product ID').agg(PRODUCT_AGGREGATIONS).reset_index()
+    selected_columns_df_3 = first_rows(df, 'Product ID', PRODUCT_ATTRIBUTE_COLUMNS)
+    selected_columns_df_3 = fillna_zero(selected_columns_df_3)
+    selected_columns_df_4 = fillna_zero(selected_columns_df_3.merge(df_summed, on='Product ID'))
+    return selected_columns_df_4[PRODUCT_RESULT_COLUMNS]
+
+
+def hierarchy_rollups(df_reordered):
+    """Totals of the SKU results at every ``HIERARCHY_LEVELS`` level as ``{level: frame}``.
+
+    Measures follow the ``PRODUCT_AGGREGATIONS`` rules over the SKUs of each
+    group. The SKU rows are grouped once, by the full Brand to Category
+    Level 2 path; every coarser level is regrouped from those partial sums,
+    maxima and mean numerators/counts, so the SKU table isn't read again per
+    level.
+    """
+    path = HIERARCHY_LEVELS[::-1]
+    leaf_spec, rollup_spec, means = {}, {}, []
+    for column, how in PRODUCT_AGGREGATIONS.items():
+        if how == 'mean':
+            means.append(column)
+            for part in ('sum', 'count'):
+                leaf_spec[f'{column} {part}'] = (column, part)
+                rollup_spec[f'{column} {part}'] = (f'{column} {part}', 'sum')
+        else:
+            leaf_spec[column] = (column, how)
+            rollup_spec[column] = (column, how)
+
+    partials = df_reordered.groupby(path, observed=True).agg(**leaf_spec).reset_index()
+    rollups = {}
+    for depth in range(len(path), 0, -1):
+        keys = path[:depth]
+        level = partials if depth == len(path) else partials.groupby(keys, observed=True).agg(**rollup_spec).reset_index()
+        for column in means:
+            level[column] = level[f'{column} sum'] / level[f'{column} count']
+        rollups[keys[-1]] = level[keys + HIERARCHY_MEASURES]
+    return rollups
+
+
+def run_forecast(df, params=None, cube=None, workers=None, tracer=NULL_TRACER):
+    """Run the whole forecast on a sales frame.
+
+    Returns ``(sku_df, product_df)``: the SKU-level results offered for
+    download and the product-level rollup shown on the results tab. The input
+    frame is not modified. Pass a ``week_cube.WeekCube`` built from ``df`` to
+    take the window totals from its prefix sums instead of scanning the rows.
+    Otherwise the SKUs are aggregated in partitions on ``workers`` processes;
+    by default (None) that is serial below ``PARALLEL_MIN_ROWS`` rows and
+    ``TOOLKIE_WORKERS`` (or the CPU count) above. Pass 1 to stay serial.
+    ``tracer`` (see ``instrumentation``) records each stage.
+    """
+    if params is None:
+        params = ForecastParams()
+    validate_schema(df)
+
+    with tracer.stage('#4 latest completed week', len(df)):
+        year_weeks = year_week(df)
+        max_yearweek = latest_completed_week(df, year_weeks)
+    with tracer.stage('#5-#14 per-SKU aggregation', len(df)) as event:
+        if cube is not None and cube.exact:
+            import week_cube
+
+            merged_df = week_cube.aggregate_skus(cube, params, max_yearweek)
+        else:
+            merged_df = aggregate_skus(df, params, year_weeks, max_yearweek, resolve_workers(len(df), workers))
+        event['rows_out'] = len(merged_df)
+    with tracer.stage('#11/#15 intake maths', len(merged_df)) as event:
+        merged_df = forecast_intakes(merged_df, params)
+        event['rows_out'] = len(merged_df)
+    with tracer.stage('#16-#18 attributes', len(df)) as event:
+        sku_df = attach_attributes(df, merged_df)
+        event['rows_out'] = len(sku_df)
+    with tracer.stage('product rollup', len(sku_df)) as event:
+        product_df = product_rollup(df, sku_df)
+        event['rows_out'] = len(product_df)
+    return sku_df, product_df
@@ -0,0 +1,254 @@
+"""Typed ingestion of sales extracts.
+
+Only the columns the forecast uses are loaded, the header is checked before
+any data rows are read, and every column is converted once to its final
+dtype. Excel workbooks are streamed through openpyxl's read-only mode; CSV,
+Parquet and Arrow IPC exports from the BI system are read directly.
+"""
+import os
+from io import BytesIO
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+from forecast_engine import REQUIRED_COLUMNS, ForecastError, check_columns
+
+
+NUMERIC_COLUMNS = [
+    'Fin Year', 'Week',
+    'Actual Sales Units', 'Actual EOW Stock Units', 'Actual Current Stock Units',
+    'Actual Intake Units', 'Expected Intake Units', 'Actual Sales Margin %',
+    'Current RSP (incl VAT)',
+]
+CATEGORICAL_COLUMNS = ['Brand', 'Department', 'Category Level 1', 'Category Level 2', 'Size']
+ID_COLUMNS = ['SKU ID', 'Product ID']
+
+# Memory-lean mode (on unless TOOLKIE_LEAN_MEMORY=0): the per-product text
+# repeated on every SKU-week row becomes categorical too, and the week and
+# unit columns are stored in the narrowest dtype that holds them exactly
+LEAN_MEMORY = os.environ.get('TOOLKIE_LEAN_MEMORY', '1') != '0'
+LEAN_CATEGORICAL_COLUMNS = ['Product', 'Image 1 URL', 'product_url']
+DOWNCAST_COLUMNS = [
+    'Fin Year', 'Week',
+    'Actual Sales Units', 'Actual EOW Stock Units', 'Actual Current Stock Units',
+    'Actual Intake Units', 'Expected Intake Units', 'Actual Sales Margin %',
+]
+
+# File signatures used to tell formats apart without trusting the file name
+_XLSX_MAGIC = b'PK\x03\x04'
+_XLS_MAGIC = b'\xd0\xcf\x11\xe0'
+_PARQUET_MAGIC = b'PAR1'
+_ARROW_FILE_MAGIC = b'ARROW1'
+_ARROW_STREAM_MAGIC = b'\xff\xff\xff\xff'
+
+
+def _id_column(values):
+    """Keep IDs numeric when they all are (as pd.read_excel would), text otherwise."""
+    values = pd.Series(values)
+    numeric = pd.to_numeric(values, errors='coerce')
+    if numeric.notna().sum() == values.notna().sum():
+        if numeric.notna().all() and (numeric % 1 == 0).all():
+            return numeric.astype('int64')
+        return numeric
+    return values.where(values.isna(), values.astype(str))
+
+
+def downcast(values):
+    """``values`` (float64) as int16/int32/float32 if that holds every value exactly, else unchanged.
+
+    The engine reads these columns back as float64, so the forecast is
+    bit-identical either way.
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return values
+    if not np.isnan(values).any():
+        for dtype in ('int16', 'int32'):
+            narrow = values.astype(dtype)
+            if np.array_equal(narrow, values):
+                return narrow
+    narrow = values.astype('float32')
+    if np.array_equal(narrow, values, equal_nan=True):
+        return narrow
+    return values
+
+
+def finalize_dtypes(df, lean=LEAN_MEMORY):
+    """Convert each forecast column to its final dtype in place and return ``df``."""
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            values = pd.to_numeric(df[column], errors='coerce').astype('float64')
+            if lean and column in DOWNCAST_COLUMNS:
+                values = pd.Series(downcast(values.to_numpy()), index=df.index)
+            df[column] = values
+    for column in categorical_columns(lean):
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    for column in ID_COLUMNS:
+        if column in df.columns and df[column].dtype == object:
+            df[column] = _id_column(df[column])
+    return df
+
+
+def _xlsx_records(source, columns):
+    """Yield the ``columns`` of every non-blank row of the first sheet of an .xlsx workbook."""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        check_columns(header)
+        header = list(header)
+        pick = itemgetter(*[header.index(c) for c in columns])
+        width = len(header)
+
+        for row in rows:
+            if len(row) < width:
+                row = row + (None,) * (width - len(row))
+            record = pick(row)
+            # read-only sheets can report trailing blank rows
+            if any(value is not None for value in record):
+                yield record
+    finally:
+        workbook.close()
+
+
+def read_xlsx(data, columns=REQUIRED_COLUMNS):
+    """Stream the first sheet of an .xlsx workbook, keeping only ``columns``."""
+    return pd.DataFrame.from_records(list(_xlsx_records(BytesIO(data), columns)), columns=columns)
+
+
+def read_xls(data, columns=REQUIRED_COLUMNS):
+    header = pd.read_excel(BytesIO(data), nrows=0).columns
+    check_columns(header)
+    return pd.read_excel(BytesIO(data), usecols=columns)
+
+
+def categorical_columns(lean=LEAN_MEMORY):
+    return CATEGORICAL_COLUMNS + (LEAN_CATEGORICAL_COLUMNS if lean else [])
+
+
+def read_csv(data, columns=REQUIRED_COLUMNS, lean=LEAN_MEMORY):
+    header = pd.read_csv(BytesIO(data), nrows=0).columns
+    check_columns(header)
+    categorical = categorical_columns(lean)
+    text = {c: 'category' if c in categorical else str for c in columns if c not in NUMERIC_COLUMNS}
+    return pd.read_csv(BytesIO(data), usecols=columns, dtype=text, low_memory=False)[columns]
+
+
+def read_parquet(data, columns=REQUIRED_COLUMNS, lean=LEAN_MEMORY):
+    import pyarrow.parquet as pq
+
+    # Text attributes are decoded straight into categoricals, never as one string per row
+    source = pq.ParquetFile(BytesIO(data), read_dictionary=categorical_columns(lean))
+    check_columns(source.schema_arrow.names)
+    table = source.read(columns=columns)
+    # Free each Arrow column as soon as it has been converted
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def read_arrow(data, columns=REQUIRED_COLUMNS, lean=LEAN_MEMORY):
+    """Read an Arrow IPC file or stream (e.g. ``pyarrow.ipc.new_stream`` output)."""
+    import pyarrow as pa
+
+    source = pa.BufferReader(data)
+    if data[:6] == _ARROW_FILE_MAGIC:
+        table = pa.ipc.open_file(source).read_all()
+    else:
+        table = pa.ipc.open_stream(source).read_all()
+    check_columns(table.schema.names)
+    table = table.select(columns)
+    categorical = [i for i, c in enumerate(columns) if c in categorical_columns(lean)]
+    for i in categorical:
+        if pa.types.is_string(table.schema.field(i).type) or pa.types.is_large_string(table.schema.field(i).type):
+            table = table.set_column(i, columns[i], table.column(i).dictionary_encode())
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def sniff_format(data, name=None):
+    """Return 'xlsx', 'xls', 'parquet', 'arrow' or 'csv' for the uploaded bytes."""
+    head = data[:4]
+    if head == _XLSX_MAGIC:
+        return 'xlsx'
+    if head == _XLS_MAGIC:
+        return 'xls'
+    if head == _PARQUET_MAGIC:
+        return 'parquet'
+    if data[:6] == _ARROW_FILE_MAGIC or head == _ARROW_STREAM_MAGIC:
+        return 'arrow'
+    if name and name.lower().endswith(('.parquet', '.pq')):
+        return 'parquet'
+    return 'csv'
+
+
+READERS = {'xlsx': read_xlsx, 'xls': read_xls, 'csv': read_csv, 'parquet': read_parquet, 'arrow': read_arrow}
+
+
+def read_upload(data, name=None, lean=LEAN_MEMORY):
+    """Parse an uploaded extract into a typed frame holding only the forecast columns."""
+    fmt = sniff_format(data, name)
+    if fmt in ('csv', 'parquet', 'arrow'):
+        return finalize_dtypes(READERS[fmt](data, lean=lean), lean)
+    return finalize_dtypes(READERS[fmt](data), lean)
+
+
+# Rows per chunk when reading a file in pieces (see ``iter_chunks``)
+CHUNK_ROWS = 250_000
+
+
+def iter_chunks(path, chunk_rows=CHUNK_ROWS, lean=LEAN_MEMORY):
+    """Yield the forecast columns of the extract at ``path`` as typed frames of at most ``chunk_rows`` rows.
+
+    Only one chunk is held in memory at a time: Parquet is read by row
+    group batches, CSV with a chunked reader, Arrow IPC by record batches and
+    .xlsx through openpyxl's read-only row stream. Legacy .xls can't be
+    streamed.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    fmt = sniff_format(head, path)
+    columns = REQUIRED_COLUMNS
+
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        source = pq.ParquetFile(path, read_dictionary=categorical_columns(lean))
+        check_columns(source.schema_arrow.names)
+        for batch in source.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield finalize_dtypes(batch.to_pandas(), lean)
+    elif fmt == 'csv':
+        check_columns(pd.read_csv(path, nrows=0).columns)
+        categorical = categorical_columns(lean)
+        text = {c: 'category' if c in categorical else str for c in columns if c not in NUMERIC_COLUMNS}
+        for chunk in pd.read_csv(path, usecols=columns, dtype=text, chunksize=chunk_rows, low_memory=False):
+            yield finalize_dtypes(chunk[columns], lean)
+    elif fmt == 'arrow':
+        import pyarrow as pa
+
+        with pa.memory_map(path) as source:
+            if head[:6] == _ARROW_FILE_MAGIC:
+                reader = pa.ipc.open_file(source)
+                batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+                names = reader.schema.names
+            else:
+                reader = pa.ipc.open_stream(source)
+                batches = reader
+                names = reader.schema.names
+            check_columns(names)
+            for batch in batches:
+                for start in range(0, batch.num_rows, chunk_rows):
+                    piece = batch.slice(start, chunk_rows).select(columns)
+                    yield finalize_dtypes(piece.to_pandas(), lean)
+    elif fmt == 'xlsx':
+        records = []
+        for record in _xlsx_records(path, columns):
+            records.append(record)
+            if len(records) == chunk_rows:
+                yield finalize_dtypes(pd.DataFrame.from_records(records, columns=columns), lean)
+                records = []
+        if records:
+            yield finalize_dtypes(pd.DataFrame.from_records(records, columns=columns), lean)
+    else:
+        raise ForecastError("Legacy .xls workbooks can't be read in chunks; save the extract as .xlsx, CSV or Parquet.")
@@ -0,0 +1,164 @@
+"""Lightweight per-stage timing and memory tracing.
+
+Wrap each stage in ``tracer.stage(name, rows_in)``; the tracer records
+wall time, rows in and out, and memory. The trace can be exported as plain
+JSON or in the Chrome trace format (open it in chrome://tracing or
+Perfetto).
+
+``NULL_TRACER`` does nothing and is the default everywhere, so tracing
+costs one no-op context manager per stage when it's switched off.
+
+tracemalloc is process-wide, while forecast jobs run on several threads.
+Only one tracer measures memory at a time; stages of other tracers that
+start meanwhile record ``peak_mb`` as None. The measured peak still counts
+what other threads allocate during the stage, so it's only a per-stage
+figure when one forecast is running.
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+# The Tracer whose stages tracemalloc is measuring, if any
+_memory_owner = None
+_memory_lock = threading.Lock()
+
+
+def count_rows(value):
+    """Rows in a frame/array (or the first element of a tuple), None if not tabular."""
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    shape = getattr(value, 'shape', None)
+    if shape:
+        return int(shape[0])
+    if hasattr(value, '__len__') and not isinstance(value, (str, bytes, dict)):
+        return len(value)
+    return None
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    return rss / 1024 ** 2 if os.uname().sysname == 'Darwin' else rss / 1024
+
+
+class _NullStage:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullTracer:
+    """A tracer that records nothing."""
+    enabled = False
+    events = ()
+
+    _stage = _NullStage()
+
+    def stage(self, name, rows_in=None):
+        return self._stage
+
+
+NULL_TRACER = NullTracer()
+
+
+class Tracer:
+    """Records one event per stage.
+
+    Every event has the stage name, start offset and duration in seconds,
+    ``rows_in``/``rows_out`` (set ``event['rows_out']`` inside the block),
+    the process's peak RSS after the stage and, with ``trace_memory=True``,
+    the peak Python/NumPy allocation during the stage from tracemalloc
+    (which slows the stages down noticeably, and is None when another
+    tracer was already measuring memory).
+
+    ``on_stage(event)`` is called as each stage starts and again when it
+    ends, for live progress displays.
+    """
+    enabled = True
+
+    def __init__(self, trace_memory=False, on_stage=None):
+        self.trace_memory = trace_memory
+        self.on_stage = on_stage
+        self.events = []
+        self._origin = time.perf_counter()
+        self._memory_depth = 0
+        self._stop_tracemalloc = False
+
+    def _start_memory(self):
+        """Reset tracemalloc's peak for a stage; False if another tracer is measuring."""
+        global _memory_owner
+        with _memory_lock:
+            if _memory_owner is None:
+                _memory_owner = self
+                self._stop_tracemalloc = not tracemalloc.is_tracing()
+                if self._stop_tracemalloc:
+                    tracemalloc.start()
+            elif _memory_owner is not self:
+                return False
+            self._memory_depth += 1
+            tracemalloc.reset_peak()
+            return True
+
+    def _stop_memory(self):
+        """Peak traced bytes since the matching ``_start_memory``."""
+        global _memory_owner
+        with _memory_lock:
+            peak = tracemalloc.get_traced_memory()[1]
+            self._memory_depth -= 1
+            if self._memory_depth == 0:
+                _memory_owner = None
+                if self._stop_tracemalloc:
+                    tracemalloc.stop()
+        return peak
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        event = {'name': name, 'rows_in': rows_in, 'rows_out': None, 'done': False}
+        self.events.append(event)
+        if self.on_stage:
+            self.on_stage(event)
+
+        measuring = self.trace_memory and self._start_memory()
+        started = time.perf_counter()
+        try:
+            yield event
+        finally:
+            event['start'] = round(started - self._origin, 6)
+            event['seconds'] = round(time.perf_counter() - started, 6)
+            if self.trace_memory:
+                event['peak_mb'] = round(self._stop_memory() / 1024 ** 2, 3) if measuring else None
+            event['max_rss_mb'] = _max_rss_mb()
+            event['done'] = True
+            if self.on_stage:
+                self.on_stage(event)
+
+    def summary(self):
+        """The finished events as a list of dicts (for display)."""
+        return [
+            {k: v for k, v in event.items() if k != 'done'}
+            for event in self.events if event['done']
+        ]
+
+    def to_json(self):
+        return json.dumps({'stages': self.summary()}, indent=2)
+
+    def to_chrome_trace(self):
+        """The trace in Chrome's trace-event JSON format."""
+        trace = []
+        for event in self.summary():
+            args = {k: v for k, v in event.items() if k not in ('name', 'start', 'seconds') and v is not None}
+            trace.append({
+                'name': event['name'], 'cat': 'forecast', 'ph': 'X', 'pid': 1, 'tid': 1,
+                'ts': event['start'] * 1e6, 'dur': event['seconds'] * 1e6, 'args': args,
+            })
+        return json.dumps({'traceEvents': trace, 'displayTimeUnit': 'ms'})
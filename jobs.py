@@ -0,0 +1,187 @@
+"""Background forecast jobs with progress and cancellation.
+
+A forecast used to run inside the button handler, tying up the script
+thread; any widget interaction restarted it. Jobs run on a small
+process-wide thread pool instead (NumPy and pandas release the GIL for the
+heavy work, and the stage graph and caches stay in this process). Every job
+has an id to keep in session state, and its stage events (from an
+``instrumentation.Tracer``) serve as progress.
+
+Cancellation is cooperative. It's checked as each stage starts, so the stage
+that is running when ``cancel()`` is called still finishes.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import Tracer
+
+
+MAX_JOB_WORKERS = int(os.environ.get('TOOLKIE_JOB_WORKERS', 2))
+# Finished jobs kept around for sessions that haven't picked up their result yet
+MAX_FINISHED_JOBS = 64
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+
+class JobCancelled(Exception):
+    """Raised inside a job at the next stage boundary after ``cancel()``."""
+
+
+class QueueFull(Exception):
+    """Raised by ``JobManager.submit`` when ``max_queued`` jobs are already waiting."""
+
+
+class Job:
+    """One call of ``func(tracer)`` on the job pool."""
+
+    def __init__(self, func, trace_memory=False):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.tracer = Tracer(trace_memory=trace_memory, on_stage=self._on_stage)
+        self._func = func
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+
+    def _on_stage(self, event):
+        if not event['done'] and self._cancel.is_set():
+            raise JobCancelled()
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Ask the job to stop at its next stage."""
+        self._cancel.set()
+
+    def current_stage(self):
+        """Name of the stage running now, or None."""
+        for event in reversed(self.tracer.events):
+            if not event['done']:
+                return event['name']
+        return None
+
+    def wait(self, timeout=None):
+        """Block until the job has finished; False if ``timeout`` seconds passed first."""
+        return self._finished.wait(timeout)
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def run(self):
+        if self._cancel.is_set():
+            self.status = CANCELLED
+            self._finished.set()
+            return
+        self.started = time.time()
+        self.status = RUNNING
+        try:
+            self.result = self._func(self.tracer)
+            self.status = DONE
+        except JobCancelled:
+            self.status = CANCELLED
+        except Exception as exc:
+            self.error = exc
+            self.status = FAILED
+        finally:
+            self.finished = time.time()
+            self._finished.set()
+
+
+class JobManager:
+    """Runs jobs on a bounded thread pool and keeps them by id."""
+
+    def __init__(self, max_workers=MAX_JOB_WORKERS, max_finished=MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='forecast-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._warmed = False
+
+    def submit(self, func, trace_memory=False, max_queued=None):
+        """Queue ``func(tracer)`` and return its Job.
+
+        With ``max_queued``, raises QueueFull instead if that many jobs are
+        already waiting; the check and the queueing happen under one lock.
+        """
+        job = Job(func, trace_memory)
+        with self._lock:
+            if max_queued is not None and self._queued() >= max_queued:
+                raise QueueFull(f"{max_queued} jobs are already waiting")
+            self._jobs[job.id] = job
+            self._prune()
+        self._pool.submit(job.run)
+        return job
+
+    def prewarm(self, func):
+        """Run ``func()`` on the pool once, ahead of the first job (see ``startup.warm_up``).
+
+        Best effort: it isn't a Job, and a failure only means the first
+        forecast pays for the warm-up itself.
+        """
+        with self._lock:
+            if self._warmed:
+                return
+            self._warmed = True
+        self._pool.submit(func)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id) if job_id else None
+
+    def queue_depth(self):
+        """Jobs submitted but not started yet."""
+        with self._lock:
+            return self._queued()
+
+    def _queued(self):
+        return sum(job.status == QUEUED for job in self._jobs.values())
+
+    def running(self):
+        with self._lock:
+            return sum(job.status == RUNNING for job in self._jobs.values())
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def job_manager():
+    """The process-wide JobManager, shared by every session."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
+
+
+def submit_job(func, trace_memory=False):
+    return job_manager().submit(func, trace_memory)
+
+
+def get_job(job_id):
+    return job_manager().get(job_id)
+
+
+def prewarm(func):
+    job_manager().prewarm(func)
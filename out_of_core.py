@@ -0,0 +1,209 @@
+"""Out-of-core forecast for extracts larger than memory.
+
+The extract is read in chunks (``ingest.iter_chunks``) and never held
+whole. Each chunk's rows are reduced to per-SKU running sums, so peak memory
+is set by the chunk size and the number of distinct SKUs, not by the size of
+the file.
+
+The #5.1 average-sales threshold needs every row of the historical horizon
+before any row can be tested against it, so there are two passes:
+
+1. Parse each chunk once. Accumulate the horizon sales sums and counts
+   (#5.1), the actual and expected intakes (#12), the weekly stock totals
+   that pick the latest completed week (#4) and the first row of each SKU
+   and product for the attributes. Spill the chunk's numeric columns to a
+   temporary directory.
+2. Once the averages and ``max_yearweek`` are known, read the spilled chunks
+   back (no re-parsing) for the OPP/GP/in-stock sums (#6-#10) and the
+   current stock (#13).
+
+Running sums are accumulated row by row in file order with ``np.add.at``,
+which adds in the same order as the in-memory ``np.bincount``, so the
+results are bit-identical to ``forecast_engine.run_forecast``.
+"""
+import dataclasses
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import forecast_engine as fe
+from ingest import CHUNK_ROWS, LEAN_MEMORY, iter_chunks
+from instrumentation import NULL_TRACER
+
+
+# SalesArrays fields spilled to disk between the passes
+SPILLED = ('codes', 'year_weeks', 'sales', 'eow_stock', 'margin', 'current_stock')
+
+
+class SkuCodes:
+    """Global SKU codes in order of first appearance across chunks."""
+
+    def __init__(self):
+        self._codes = {}
+        self.skus = []
+
+    def __len__(self):
+        return len(self.skus)
+
+    def encode(self, skus):
+        """Global code of each of ``skus`` (the unique SKUs of one chunk), adding new ones."""
+        codes = np.empty(len(skus), dtype='int64')
+        for i, sku in enumerate(skus):
+            code = self._codes.get(sku)
+            if code is None:
+                code = self._codes[sku] = len(self.skus)
+                self.skus.append(sku)
+            codes[i] = code
+        return codes
+
+
+class RunningSums:
+    """Named per-SKU float64 sums that grow as new SKUs turn up."""
+
+    def __init__(self, names):
+        self.sums = {name: np.zeros(0) for name in names}
+
+    def __getitem__(self, name):
+        return self.sums[name]
+
+    def add(self, name, codes, values, n_skus):
+        """Add ``values`` to the sums of their SKU ``codes``, row by row in order."""
+        self.resize(n_skus)
+        np.add.at(self.sums[name], codes, values)
+
+    def resize(self, n_skus):
+        for name, sums in self.sums.items():
+            if len(sums) < n_skus:
+                self.sums[name] = np.concatenate([sums, np.zeros(n_skus - len(sums))])
+
+
+class FirstRows:
+    """The first row of ``columns`` for each value of ``key``, gathered chunk by chunk."""
+
+    def __init__(self, key, columns):
+        self.key = key
+        self.columns = columns
+        self._seen = set()
+        self._frames = []
+
+    def add(self, chunk):
+        firsts = fe.first_rows(chunk, self.key, self.columns)
+        keys = firsts[self.key].astype(object).where(firsts[self.key].notna(), None)
+        new = ~keys.isin(self._seen).to_numpy()
+        if new.any():
+            self._seen.update(keys[new])
+            self._frames.append(firsts[new])
+
+    def frame(self):
+        if not self._frames:
+            return pd.DataFrame(columns=self.columns)
+        df = pd.concat(self._frames, ignore_index=True)
+        # Chunks with different categories concatenate to object; keep them categorical as in memory
+        for column, dtype in self._frames[0].dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype) and not isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype('category')
+        return df
+
+
+def _global_arrays(chunk, sku_codes):
+    """SalesArrays of ``chunk`` with codes into the SKUs of every chunk so far."""
+    arrays = fe.sales_arrays(chunk)
+    codes = sku_codes.encode(arrays.skus)[arrays.codes]
+    return dataclasses.replace(arrays, codes=codes, skus=None)
+
+
+def aggregate_file(path, params, chunk_rows=CHUNK_ROWS, lean=LEAN_MEMORY, tracer=NULL_TRACER):
+    """Steps #4 to #14 over the extract at ``path`` in chunks.
+
+    Returns ``(merged_df, sku_attributes, product_attributes)``: the per-SKU
+    measures (as ``forecast_engine.aggregate_skus`` gives them) and the first
+    row of every SKU and of every product, which stand in for the full frame
+    in steps #16-#18 and the product rollup.
+    """
+    sku_codes = SkuCodes()
+    sums = RunningSums(['hrn_sales', 'hrn_count', 'actual_intake', 'expected_intake'])
+    week_stock = pd.Series(dtype='float64')
+    sku_attributes = FirstRows('SKU ID', fe.ATTRIBUTE_COLUMNS)
+    product_attributes = FirstRows('Product ID', fe.PRODUCT_ATTRIBUTE_COLUMNS)
+
+    with tempfile.TemporaryDirectory(prefix='toolkie-chunks-') as spill_dir:
+        #1st pass: parse, accumulate what doesn't need the averages, spill the rest
+        n_chunks = 0
+        with tracer.stage('pass 1: parse and #5.1/#12 sums') as event:
+            rows = 0
+            for chunk in iter_chunks(path, chunk_rows, lean):
+                fe.validate_schema(chunk)
+                arrays = _global_arrays(chunk, sku_codes)
+                n_skus = len(sku_codes)
+                rows += len(chunk)
+                sku_attributes.add(chunk)
+                product_attributes.add(chunk)
+
+                #4 stock per week, summed over every chunk
+                stock = pd.Series(fe.numeric_column(chunk, 'Actual Current Stock Units')).groupby(fe.year_week(chunk)).sum()
+                week_stock = week_stock.add(stock, fill_value=0)
+
+                #5.1, #12
+                hrn = fe.hrn_mask(arrays, params)
+                has_sales = hrn & ~np.isnan(arrays.sales)
+                sums.add('hrn_sales', arrays.codes, fe.masked_values(has_sales, arrays.sales), n_skus)
+                sums.add('hrn_count', arrays.codes, has_sales.astype('float64'), n_skus)
+                sums.add('actual_intake', arrays.codes, fe.masked_values(hrn, arrays.actual_intake), n_skus)
+                expected = fe.expected_mask(arrays, params)
+                sums.add('expected_intake', arrays.codes, fe.masked_values(expected, arrays.expected_intake), n_skus)
+
+                np.savez(os.path.join(spill_dir, f'{n_chunks}.npz'),
+                         **{name: getattr(arrays, name) for name in SPILLED})
+                n_chunks += 1
+                del chunk, arrays
+            event['rows_out'] = rows
+
+        n_skus = len(sku_codes)
+        sums.resize(n_skus)
+        max_yearweek = week_stock.sort_index().idxmax() if len(week_stock) else np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            average_sales = sums['hrn_sales'] / sums['hrn_count']
+
+        #2nd pass: the masks that depend on the averages, from the spilled chunks
+        second = RunningSums(['in_stock_sales', 'in_stock_count', 'horizon_sales', 'horizon_count', 'current_stock'])
+        second.resize(n_skus)
+        with tracer.stage('pass 2: #6-#10/#13 sums', n_chunks):
+            for i in range(n_chunks):
+                with np.load(os.path.join(spill_dir, f'{i}.npz')) as spilled:
+                    arrays = fe.SalesArrays(
+                        skus=None, actual_intake=None, expected_intake=None,
+                        **{name: spilled[name] for name in SPILLED},
+                    )
+                _, horizon, opp = fe.horizon_masks(arrays, params, average_sales)
+                in_stock = fe.in_stock_mask(arrays, opp, params)
+                current = arrays.year_weeks == max_yearweek
+                second.add('in_stock_sales', arrays.codes, fe.masked_values(in_stock, arrays.sales), n_skus)
+                second.add('in_stock_count', arrays.codes, in_stock.astype('float64'), n_skus)
+                second.add('horizon_sales', arrays.codes, fe.masked_values(horizon, arrays.sales), n_skus)
+                second.add('horizon_count', arrays.codes, horizon.astype('float64'), n_skus)
+                second.add('current_stock', arrays.codes, fe.masked_values(current, arrays.current_stock), n_skus)
+
+    measures = np.column_stack([
+        second['in_stock_sales'], second['in_stock_count'],
+        second['horizon_sales'], second['horizon_count'],
+        sums['actual_intake'], sums['expected_intake'], second['current_stock'],
+    ])
+    skus = np.asarray(pd.Index(sku_codes.skus))
+    return fe.sku_frame(skus, measures), sku_attributes.frame(), product_attributes.frame()
+
+
+def run_forecast_file(path, params=None, chunk_rows=CHUNK_ROWS, lean=LEAN_MEMORY, tracer=NULL_TRACER):
+    """``(sku_df, product_df)`` for the extract at ``path``, read in chunks of ``chunk_rows`` rows."""
+    params = params or fe.ForecastParams()
+    merged_df, sku_attributes, product_attributes = aggregate_file(path, params, chunk_rows, lean, tracer)
+    with tracer.stage('#11/#15 intake maths', len(merged_df)):
+        merged_df = fe.forecast_intakes(merged_df, params)
+    with tracer.stage('#16-#18 attributes', len(sku_attributes)) as event:
+        sku_df = fe.attach_attributes(sku_attributes, merged_df)
+        event['rows_out'] = len(sku_df)
+    with tracer.stage('product rollup', len(sku_df)) as event:
+        product_df = fe.product_rollup(product_attributes, sku_df)
+        event['rows_out'] = len(product_df)
+    return sku_df, product_df
@@ -0,0 +1,144 @@
+"""Partitioned, multi-process version of the per-SKU aggregation.
+
+Steps #5 to #15 only ever combine rows of the same 'SKU ID', so the SKUs are
+split into contiguous ranges of roughly equal row counts and each range is
+aggregated on a worker process. The rows are reordered by partition with a
+stable sort, which keeps every SKU's rows in their original order. Each
+SKU's sums are therefore accumulated exactly as in the serial path and the
+result is bit-identical.
+
+The numeric columns are copied once into a shared-memory block that the
+workers attach to, so the frame is never pickled to every worker. Only the
+small ``[n_skus, 7]`` partial sums come back.
+
+``forecast_engine.run_forecast`` and the row path of ``stage_graph`` use it
+for uploads of ``forecast_engine.PARALLEL_MIN_ROWS`` rows or more, on
+``TOOLKIE_WORKERS`` processes (default: the CPU count).
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import forecast_engine as fe
+
+
+# Row-level float columns shipped to the workers, in block order
+FLOAT_COLUMNS = (
+    'year_weeks', 'sales', 'eow_stock', 'margin',
+    'actual_intake', 'expected_intake', 'current_stock',
+)
+
+# Pools are kept per worker count so repeated forecasts don't pay process start-up again.
+# A process that creates one must call ``shutdown_pools`` before it exits if it is
+# itself a pool worker (see ``batch_forecast.run_job``).
+_POOLS = {}
+_pools_lock = threading.Lock()
+
+
+def default_workers():
+    return int(os.environ.get('TOOLKIE_WORKERS', 0)) or os.cpu_count() or 1
+
+
+def get_pool(workers):
+    with _pools_lock:
+        pool = _POOLS.get(workers)
+        if pool is None:
+            pool = _POOLS[workers] = ProcessPoolExecutor(max_workers=workers)
+        return pool
+
+
+def discard_pool(workers, pool):
+    """Forget ``pool`` (e.g. after a worker died) so the next call starts a fresh one."""
+    with _pools_lock:
+        if _POOLS.get(workers) is pool:
+            del _POOLS[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pools():
+    with _pools_lock:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.shutdown(cancel_futures=True)
+
+
+def partition_bounds(codes, n_skus, n_parts):
+    """Split SKU codes ``0..n_skus`` into ``n_parts`` contiguous ranges of similar row counts.
+
+    Returns the ``n_parts + 1`` code boundaries.
+    """
+    rows_per_sku = np.bincount(codes, minlength=n_skus)
+    cumulative = np.cumsum(rows_per_sku)
+    targets = cumulative[-1] * np.arange(1, n_parts) / n_parts if n_skus else []
+    inner = np.searchsorted(cumulative, targets, side='right')
+    return np.unique(np.concatenate([[0], inner, [n_skus]]))
+
+
+def _aggregate_partition(block_name, codes_name, n_rows, row_lo, row_hi, code_lo, code_hi, params, max_yearweek):
+    block = shared_memory.SharedMemory(name=block_name)
+    codes_block = shared_memory.SharedMemory(name=codes_name)
+    try:
+        floats = np.ndarray((len(FLOAT_COLUMNS), n_rows), dtype='float64', buffer=block.buf)
+        codes = np.ndarray((n_rows,), dtype='int64', buffer=codes_block.buf)
+        arrays = fe.SalesArrays(
+            skus=np.arange(code_hi - code_lo),
+            codes=codes[row_lo:row_hi] - code_lo,
+            **{name: floats[i, row_lo:row_hi] for i, name in enumerate(FLOAT_COLUMNS)},
+        )
+        sums = fe.sku_sums(arrays, params, max_yearweek)
+        # Drop every view on the shared buffers before closing them
+        del arrays, floats, codes
+        return sums
+    finally:
+        block.close()
+        codes_block.close()
+
+
+def sku_sums(arrays, params, max_yearweek, workers=None):
+    """``forecast_engine.sku_sums`` computed over SKU partitions on ``workers`` processes."""
+    workers = workers or default_workers()
+    bounds = partition_bounds(arrays.codes, arrays.n_skus, workers)
+    if len(bounds) <= 2:
+        return fe.sku_sums(arrays, params, max_yearweek)
+
+    # Reorder rows by partition; stable, so each SKU keeps its row order
+    part_of_code = np.searchsorted(bounds, np.arange(arrays.n_skus), side='right') - 1
+    order = np.argsort(part_of_code[arrays.codes], kind='stable')
+    row_bounds = np.searchsorted(part_of_code[arrays.codes][order], np.arange(len(bounds)))
+    n_rows = len(order)
+
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(FLOAT_COLUMNS) * n_rows * 8))
+    codes_block = shared_memory.SharedMemory(create=True, size=max(1, n_rows * 8))
+    try:
+        floats = np.ndarray((len(FLOAT_COLUMNS), n_rows), dtype='float64', buffer=block.buf)
+        for i, name in enumerate(FLOAT_COLUMNS):
+            np.take(getattr(arrays, name), order, out=floats[i])
+        codes = np.ndarray((n_rows,), dtype='int64', buffer=codes_block.buf)
+        np.take(arrays.codes, order, out=codes)
+        del floats, codes
+
+        pool = get_pool(workers)
+        try:
+            futures = [
+                pool.submit(
+                    _aggregate_partition, block.name, codes_block.name, n_rows,
+                    int(row_bounds[i]), int(row_bounds[i + 1]), int(bounds[i]), int(bounds[i + 1]),
+                    params, max_yearweek,
+                )
+                for i in range(len(bounds) - 1)
+            ]
+            return np.concatenate([future.result() for future in futures])
+        except BrokenProcessPool:
+            # A broken pool refuses every later submit; don't hand it to the next forecast
+            discard_pool(workers, pool)
+            raise
+    finally:
+        block.close()
+        block.unlink()
+        codes_block.close()
+        codes_block.unlink()
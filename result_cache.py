@@ -0,0 +1,173 @@
+"""Process-wide cache of forecast results shared by every session.
+
+Planners often upload the same weekly extract and run it with the default
+parameters. Results are keyed by (content hash of the upload, parameters),
+so the second session asking for the same forecast gets it back without
+parsing or aggregating anything. The cache is an LRU bounded by both bytes
+and entry count. When several sessions ask for the same missing key at
+once, only one computes it and the others wait for its result.
+
+With ``TOOLKIE_RESULT_CACHE_DISK=1`` results are also written as Parquet
+under ``<cache dir>/results``, so they survive restarts and are shared
+between server processes.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from export import arrow_safe
+from upload_cache import CACHE_DIR, CACHE_VERSION, atomic_write, evict_lru
+
+
+MAX_RESULT_CACHE_BYTES = int(os.environ.get('TOOLKIE_RESULT_CACHE_BYTES', 1024 ** 3))
+MAX_RESULT_CACHE_ENTRIES = int(os.environ.get('TOOLKIE_RESULT_CACHE_ENTRIES', 32))
+MAX_RESULT_DISK_BYTES = int(os.environ.get('TOOLKIE_RESULT_DISK_BYTES', 2 * 1024 ** 3))
+DISK_CACHE = os.environ.get('TOOLKIE_RESULT_CACHE_DISK', '0') == '1'
+LEVELS = ('sku', 'product')
+
+
+def frames_nbytes(frames):
+    return int(sum(df.memory_usage(index=True, deep=True).sum() for df in frames))
+
+
+def disk_key(upload_key, params):
+    """File name stem for a (upload hash, ForecastParams) pair."""
+    payload = json.dumps([upload_key, params.as_dict(), CACHE_VERSION], sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """Thread-safe LRU of ``(sku_df, product_df)`` results, optionally backed by disk.
+
+    Cached frames are shared between sessions; callers must not modify them.
+    """
+
+    def __init__(self, max_bytes=MAX_RESULT_CACHE_BYTES, max_entries=MAX_RESULT_CACHE_ENTRIES,
+                 directory=None, disk=DISK_CACHE, max_disk_bytes=MAX_RESULT_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.directory = os.path.join(directory or CACHE_DIR, 'results') if disk else None
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (frames, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # key -> [lock held while that key is computed, callers using it]; kept until the last one leaves
+        self._computing = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key):
+        """The cached frames for ``key`` (counted as a hit), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        return None
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _store(self, key, frames):
+        nbytes = frames_nbytes(frames)
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (frames, nbytes)
+            self._bytes += nbytes
+            while len(self._entries) > 1 and (
+                self._bytes > self.max_bytes or len(self._entries) > self.max_entries
+            ):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def _paths(self, key):
+        stem = disk_key(*key)
+        return [os.path.join(self.directory, f'{stem}.{level}.parquet') for level in LEVELS]
+
+    def _read_disk(self, key):
+        if self.directory is None:
+            return None
+        paths = self._paths(key)
+        try:
+            frames = tuple(pd.read_parquet(path) for path in paths)
+        except (OSError, ValueError, ImportError):
+            return None
+        for path in paths:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return frames
+
+    def _write_disk(self, key, frames):
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for path, df in zip(self._paths(key), frames):
+            atomic_write(path, lambda tmp_path, df=df: arrow_safe(df).to_parquet(tmp_path, index=False, compression='zstd'))
+        evict_lru(self.directory, self.max_disk_bytes, '.parquet')
+
+    def get_or_compute(self, upload_key, params, compute):
+        """The results for ``(upload_key, params)``, calling ``compute()`` only if nobody has them."""
+        key = (upload_key, params)
+        frames = self._lookup(key)
+        if frames is not None:
+            return frames
+
+        with self._lock:
+            computing = self._computing.setdefault(key, [threading.Lock(), 0])
+            computing[1] += 1
+        try:
+            with computing[0]:
+                # Another session may have finished this key while we waited
+                frames = self._lookup(key)
+                if frames is not None:
+                    return frames
+                frames = self._read_disk(key)
+                if frames is None:
+                    self._count('misses')
+                    frames = tuple(compute())
+                    try:
+                        self._write_disk(key, frames)
+                    except (OSError, ValueError, TypeError, ImportError):
+                        # The in-memory copy is enough when the disk can't take it
+                        pass
+                else:
+                    self._count('hits')
+                self._store(key, frames)
+        finally:
+            # Dropping the lock while others still wait on it would let a newcomer compute alongside them
+            with self._lock:
+                computing[1] -= 1
+                if computing[1] == 0:
+                    del self._computing[key]
+        return frames
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+_cache = ResultCache()
+
+
+def cached_forecast(upload_key, params, compute):
+    """``compute()``'s ``(sku_df, product_df)`` through the shared, process-wide result cache."""
+    return _cache.get_or_compute(upload_key, params, compute)
+
+
+def cache_stats():
+    """Entry count and hit/miss counters of the shared result cache."""
+    with _cache._lock:
+        return {'entries': len(_cache), 'hits': _cache.hits, 'misses': _cache.misses}
@@ -0,0 +1,106 @@
+"""Search and facet index over a forecast results table.
+
+The old sidebar search joined every column of the table into one string per
+row on each keystroke. Here the table is indexed once per forecast result:
+
+* a token index maps every lower-case word of the Product, Brand, Product ID
+  and category text to the row positions containing it, and
+* facet maps take each Brand, Department and Category Level 1 value to its
+  row positions.
+
+A search is then a prefix lookup in the sorted vocabulary, filters are set
+unions/intersections of position arrays, and only the requested page of
+rows is ever copied out of the table.
+"""
+import re
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+
+SEARCH_COLUMNS = ['Product', 'Brand', 'Product ID', 'Department', 'Category Level 1', 'Category Level 2']
+FACET_COLUMNS = ['Brand', 'Department', 'Category Level 1']
+PAGE_SIZES = [50, 100, 500, 1000]
+
+_TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """The lower-case words of ``text``."""
+    return _TOKEN.findall(str(text).lower())
+
+
+def _value_positions(values):
+    """``(unique values, [row positions of each value])`` for one column, NaN skipped."""
+    codes, uniques = pd.factorize(values)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    return list(uniques), [order[bounds[i]:bounds[i + 1]] for i in range(len(uniques))]
+
+
+class ResultsIndex:
+    """Token and facet index over the rows of ``df`` (kept by reference, not copied)."""
+
+    def __init__(self, df, search_columns=SEARCH_COLUMNS, facet_columns=FACET_COLUMNS):
+        self.df = df
+        self.facets = {}
+        postings = {}
+        for column in search_columns:
+            if column not in df.columns:
+                continue
+            # Tokenize each distinct value once, however many rows repeat it
+            uniques, positions = _value_positions(df[column])
+            for value, rows in zip(uniques, positions):
+                for token in set(tokenize(value)):
+                    postings.setdefault(token, []).append(rows)
+        self.vocabulary = sorted(postings)
+        self.postings = [np.unique(np.concatenate(postings[token])) for token in self.vocabulary]
+
+        for column in facet_columns:
+            if column in df.columns:
+                uniques, positions = _value_positions(df[column])
+                self.facets[column] = dict(zip(uniques, positions))
+
+    def __len__(self):
+        return len(self.df)
+
+    def facet_options(self, column):
+        """``{value: row count}`` for a facet column, sorted by value."""
+        values = self.facets.get(column, {})
+        return {value: len(values[value]) for value in sorted(values, key=str)}
+
+    def search(self, text):
+        """Sorted row positions matching every word of ``text`` as a word prefix."""
+        result = None
+        for word in tokenize(text):
+            start = bisect_left(self.vocabulary, word)
+            stop = start
+            while stop < len(self.vocabulary) and self.vocabulary[stop].startswith(word):
+                stop += 1
+            if stop == start:
+                return np.empty(0, dtype='int64')
+            matches = np.unique(np.concatenate(self.postings[start:stop]))
+            result = matches if result is None else np.intersect1d(result, matches, assume_unique=True)
+        return np.arange(len(self.df)) if result is None else result
+
+    def filter(self, text='', facets=None):
+        """Sorted row positions matching the search ``text`` and every facet selection.
+
+        ``facets`` maps a facet column to the values to keep; values of one
+        column are OR-ed and the columns AND-ed, as the separate multiselects
+        always did. Empty selections don't filter.
+        """
+        result = self.search(text) if text else np.arange(len(self.df))
+        for column, selected in (facets or {}).items():
+            if not selected:
+                continue
+            values = self.facets[column]
+            rows = [values[value] for value in selected if value in values]
+            matches = np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype='int64')
+            result = np.intersect1d(result, matches, assume_unique=True)
+        return result
+
+    def page(self, positions, page, page_size):
+        """Rows ``positions[page * page_size:(page + 1) * page_size]`` of the table (``page`` from 0)."""
+        return self.df.iloc[positions[page * page_size:(page + 1) * page_size]]
@@ -0,0 +1,130 @@
+"""What-if scenarios over the forecast thresholds.
+
+Buyers compare many combinations of margin, confidence and clearance
+thresholds. Rather than running the forecast once per combination, the
+grid is evaluated in one batch:
+
+* the in-stock sums (#10.1-#10.3) for every distinct ``min_acceptable_margin``
+  come from a single grouped pass with one column per margin, and
+* steps #11 and #15 are broadcast over a ``[scenario, SKU]`` array.
+
+A 50-scenario sweep therefore costs about as much as a few single runs.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import forecast_engine as fe
+
+
+# ForecastParams fields that can vary between scenarios
+SCENARIO_PARAMS = (
+    'min_acceptable_margin',
+    'confidence',
+    'low_data_confidence',
+    'required_seaonal_clr_percent',
+    'required_quartery_clr_percent',
+    'required_8wks_clr_percent',
+    'long_horizon_diminishing_return',
+    'medium_horizon_diminishing_return',
+)
+SCENARIO_RESULT_COLUMNS = [
+    'Use_this_ave_sales_u',
+    'Total_Season_Sales', 'Total_Season_ideal_intakes',
+    'Total_Qtr_Sales', 'Total_Qtr_ideal_intakes',
+    'Total_9wks_Sales_once_off_repeat', 'Total_9wks_Sales_once_off_repeat_ideal_intakes',
+]
+
+
+def scenario_grid(base_params=None, **values):
+    """Every combination of the given parameter values, one row per scenario.
+
+    ``values`` maps SCENARIO_PARAMS names to lists; parameters not given keep
+    their value from ``base_params``.
+    """
+    if base_params is None:
+        base_params = fe.ForecastParams()
+    unknown = set(values) - set(SCENARIO_PARAMS)
+    if unknown:
+        raise ValueError(f"can't vary {', '.join(sorted(unknown))} in a scenario grid")
+    options = [list(values.get(name) or [getattr(base_params, name)]) for name in SCENARIO_PARAMS]
+    grid = pd.DataFrame(list(itertools.product(*options)), columns=list(SCENARIO_PARAMS))
+    grid.index.name = 'scenario'
+    return grid
+
+
+def run_scenarios(df, grid, base_params=None):
+    """Evaluate every scenario of ``grid`` (from ``scenario_grid``) on ``df``.
+
+    Returns ``(sku_table, totals)``: a tidy frame with one row per scenario
+    and SKU holding 'Use_this_ave_sales_u' and the Total_* columns, and the
+    grid with those columns summed per scenario. As in the single forecast,
+    a SKU only appears for a scenario when it has weeks meeting all three
+    policies at that scenario's margin.
+    """
+    if base_params is None:
+        base_params = fe.ForecastParams()
+    fe.validate_schema(df)
+
+    year_weeks = fe.year_week(df)
+    max_yearweek = fe.latest_completed_week(df, year_weeks)
+    arrays = fe.sales_arrays(df, year_weeks)
+    _, horizon, opp = fe.horizon_masks(arrays, base_params)
+
+    #8-#10.3 in-stock sums for every margin in one grouped pass
+    margins, margin_index = np.unique(grid['min_acceptable_margin'].to_numpy(), return_inverse=True)
+    rows = np.flatnonzero(opp)
+    gp = arrays.margin[rows, None] >= margins[None, :] * 0.9
+    sales = arrays.sales[rows, None]
+    in_stock_sums = fe.grouped_sums(
+        arrays.codes[rows], arrays.n_skus, np.hstack([np.where(gp, sales, 0.0), gp])
+    )
+    n_margins = len(margins)
+    in_stock_sales = in_stock_sums[:, :n_margins].T[margin_index]  # [scenario, SKU]
+    reviewed = in_stock_sums[:, n_margins:].T[margin_index]
+
+    #10.4-#10.6, #13 do not depend on the grid
+    current = arrays.year_weeks == max_yearweek
+    fixed = fe.grouped_sums(arrays.codes, arrays.n_skus, np.column_stack([
+        horizon, fe.masked_values(current, arrays.current_stock),
+    ]))
+    horizon_count, current_stock = fixed[:, 0], fixed[:, 1]
+
+    def column(name):
+        return grid[name].to_numpy(dtype='float64')[:, None]
+
+    #11 base average weekly sales, broadcast over scenarios
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average = in_stock_sales / reviewed
+        low_data = (
+            (reviewed <= base_params.Min_no_of_data_points)
+            | ((reviewed / horizon_count) <= base_params.data_reduction_threshold)
+        )
+    ave_sales = np.where(low_data, average * column('low_data_confidence'), average * column('confidence'))
+
+    #15
+    season = np.round(ave_sales * 26 * column('long_horizon_diminishing_return'))
+    qtr = np.round(ave_sales * 13 * column('medium_horizon_diminishing_return'))
+    nine_wks = np.round(ave_sales * 8 * column('medium_horizon_diminishing_return'))
+    results = {
+        'Use_this_ave_sales_u': ave_sales,
+        'Total_Season_Sales': season,
+        'Total_Season_ideal_intakes': np.round(season / column('required_seaonal_clr_percent')) - current_stock,
+        'Total_Qtr_Sales': qtr,
+        'Total_Qtr_ideal_intakes': np.round(qtr / column('required_quartery_clr_percent')) - current_stock,
+        'Total_9wks_Sales_once_off_repeat': nine_wks,
+        'Total_9wks_Sales_once_off_repeat_ideal_intakes': np.round(nine_wks / column('required_8wks_clr_percent')) - current_stock,
+    }
+
+    keep = reviewed > 0
+    scenario, sku = np.nonzero(keep)
+    sku_table = pd.DataFrame({'scenario': grid.index.to_numpy()[scenario], 'SKU ID': arrays.skus[sku]})
+    for name, values in results.items():
+        sku_table[name] = values[keep]
+
+    totals = grid.copy()
+    for name, values in results.items():
+        totals[name] = np.where(keep, values, 0.0).sum(axis=1)
+    totals['SKUs'] = keep.sum(axis=1)
+    return sku_table, totals
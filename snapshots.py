@@ -0,0 +1,273 @@
+"""Saved forecast runs and what changed between them.
+
+Every forecast run is kept as a snapshot: its SKU- and product-level results
+as zstd Parquet plus a JSON record of the parameters, the input hash and
+when it ran. Snapshots live under ``<cache dir>/snapshots`` (or
+``TOOLKIE_SNAPSHOT_DIR``), newest ``TOOLKIE_MAX_SNAPSHOTS`` kept. A run with
+the same input and parameters as an existing snapshot gives the same
+results, so it isn't stored twice.
+
+``diff_snapshots`` answers "what changed since last week's forecast?": it
+reads only the key and numeric columns of both runs, aligns them on
+'SKU ID' (or 'Product ID') in one outer join and computes every column's
+delta as one array subtraction. ``top_movers`` then ranks the rows by the
+change in an intake column.
+
+Usage::
+
+    python snapshots.py list
+    python snapshots.py diff OLD_ID NEW_ID [--level product] [--top 20] [--output diff.xlsx]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from export import arrow_safe
+from upload_cache import CACHE_DIR, atomic_write, write_json
+
+
+SNAPSHOT_DIR = os.environ.get('TOOLKIE_SNAPSHOT_DIR', os.path.join(CACHE_DIR, 'snapshots'))
+MAX_SNAPSHOTS = int(os.environ.get('TOOLKIE_MAX_SNAPSHOTS', 200))
+# Result level -> key column
+LEVEL_KEYS = {'sku': 'SKU ID', 'product': 'Product ID'}
+# Descriptive columns carried into a diff so rows can be read without a lookup
+LABEL_COLUMNS = {
+    'sku': ['Product ID', 'Brand', 'Department', 'Category Level 1', 'Product', 'Size'],
+    'product': ['Brand', 'Department', 'Category Level 1', 'Product'],
+}
+INTAKE_COLUMNS = [
+    'Total_Season_ideal_intakes', 'Total_Qtr_ideal_intakes', 'Total_9wks_Sales_once_off_repeat_ideal_intakes',
+]
+
+
+def run_digest(upload_key, params):
+    """Identifies the results of one (input hash, ForecastParams) pair."""
+    payload = json.dumps([upload_key, params.as_dict()], sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=8).hexdigest()
+
+
+class SnapshotStore:
+    """A directory of snapshots: ``<id>.sku.parquet``, ``<id>.product.parquet`` and ``<id>.json``.
+
+    The JSON record is written last, so a snapshot only shows up once its
+    results are complete.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR, max_snapshots=MAX_SNAPSHOTS):
+        self.directory = directory
+        self.max_snapshots = max_snapshots
+
+    def _path(self, snapshot_id, part):
+        return os.path.join(self.directory, f'{snapshot_id}.{part}')
+
+    def records(self):
+        """Every snapshot's record (id, created, upload_key, params, label, row counts), newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        records = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    records.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(records, key=lambda r: r['created'], reverse=True)
+
+    def find(self, upload_key, params):
+        """Id of the snapshot of this input and parameters, or None."""
+        digest = run_digest(upload_key, params)
+        for record in self.records():
+            if record['digest'] == digest:
+                return record['id']
+        return None
+
+    def save(self, sku_df, product_df, upload_key, params, label=''):
+        """Store a run's results and return its snapshot id (the existing one if already stored)."""
+        existing = self.find(upload_key, params)
+        if existing is not None:
+            return existing
+        os.makedirs(self.directory, exist_ok=True)
+        created = time.time()
+        digest = run_digest(upload_key, params)
+        snapshot_id = time.strftime('%Y%m%d-%H%M%S', time.localtime(created)) + f'-{digest}'
+        try:
+            for level, df in (('sku', sku_df), ('product', product_df)):
+                atomic_write(self._path(snapshot_id, f'{level}.parquet'),
+                             lambda path, df=df: arrow_safe(df).to_parquet(path, index=False, compression='zstd'))
+        except BaseException:
+            # Don't leave the SKU results of a snapshot whose product results failed
+            self.delete(snapshot_id)
+            raise
+        record = {
+            'id': snapshot_id,
+            'digest': digest,
+            'created': created,
+            'upload_key': upload_key,
+            'params': params.as_dict(),
+            'label': label,
+            'skus': len(sku_df),
+            'products': len(product_df),
+        }
+        write_json(self._path(snapshot_id, 'json'), record)
+        self._prune()
+        return snapshot_id
+
+    def _prune(self):
+        for record in self.records()[self.max_snapshots:]:
+            self.delete(record['id'])
+
+    def delete(self, snapshot_id):
+        # The record goes first so a half-deleted snapshot is never listed
+        for part in ('json', 'sku.parquet', 'product.parquet'):
+            try:
+                os.remove(self._path(snapshot_id, part))
+            except FileNotFoundError:
+                pass
+
+    def load(self, snapshot_id, level='sku', columns=None):
+        """A snapshot's results at ``level`` ('sku' or 'product'), optionally only some ``columns``."""
+        if level not in LEVEL_KEYS:
+            raise ValueError(f"level must be one of {', '.join(LEVEL_KEYS)}")
+        path = self._path(snapshot_id, f'{level}.parquet')
+        if not os.path.exists(path):
+            raise KeyError(f"no snapshot {snapshot_id!r}")
+        return pd.read_parquet(path, columns=columns)
+
+    def schema(self, snapshot_id, level):
+        """Arrow schema of a snapshot's results at ``level``, read without loading any rows."""
+        import pyarrow.parquet as pq
+
+        path = self._path(snapshot_id, f'{level}.parquet')
+        if not os.path.exists(path):
+            raise KeyError(f"no snapshot {snapshot_id!r}")
+        return pq.read_schema(path)
+
+    def diff(self, old_id, new_id, level='sku'):
+        """``diff_snapshots`` of two stored snapshots, reading only the columns it needs."""
+        import pyarrow.types as pat
+
+        key = LEVEL_KEYS[level]
+        old_names = set(self.schema(old_id, level).names)
+        new_schema = self.schema(new_id, level)
+        labels = [c for c in LABEL_COLUMNS[level] if c in new_schema.names]
+        measures = [
+            field.name for field in new_schema
+            if field.name != key and field.name not in labels and field.name in old_names
+            and (pat.is_integer(field.type) or pat.is_floating(field.type))
+        ]
+        old = self.load(old_id, level, [key] + [c for c in labels if c in old_names] + measures)
+        new = self.load(new_id, level, [key] + labels + measures)
+        return diff_snapshots(old, new, key, measures)
+
+
+def diff_snapshots(old, new, key, measures):
+    """Align two result tables on ``key`` and compute the change in every ``measures`` column.
+
+    Returns one row per key in either table with a 'change' of 'added',
+    'removed', 'changed' or 'unchanged', the other (label) columns of
+    ``new`` (from ``old`` for removed rows), and ``<column> old``,
+    ``<column> new`` and ``<column> delta`` per measure. A row missing from
+    one side counts as 0 there, so an added SKU's delta is its whole value.
+    Integer label columns come back as nullable ``Int64``.
+    """
+    labels = [c for c in new.columns if c != key and c not in measures]
+    old_labels = [c for c in labels if c in old.columns]
+    joined = old[[key] + old_labels + measures].merge(
+        new[[key] + labels + measures], on=key, how='outer', suffixes=(' old', ' new'), indicator=True, sort=False
+    )
+    old_values = joined[[f'{c} old' for c in measures]].to_numpy(dtype='float64', na_value=np.nan)
+    new_values = joined[[f'{c} new' for c in measures]].to_numpy(dtype='float64', na_value=np.nan)
+    delta = np.nan_to_num(new_values) - np.nan_to_num(old_values)
+
+    side = joined['_merge'].to_numpy()
+    changed = (delta != 0).any(axis=1)
+    change = np.where(side == 'left_only', 'removed', np.where(side == 'right_only', 'added',
+                      np.where(changed, 'changed', 'unchanged')))
+
+    result = {key: joined[key], 'change': change}
+    for column in labels:
+        if column in old_labels:
+            labels_new = joined[f'{column} new'].astype(object)
+            values = labels_new.where(side != 'left_only', joined[f'{column} old'].astype(object))
+        else:
+            values = joined[column]
+        # The outer join turns integer labels such as 'Product ID' into floats wherever a side is missing
+        result[column] = values.astype('Int64') if pd.api.types.is_integer_dtype(new[column].dtype) else values
+    for j, column in enumerate(measures):
+        result[f'{column} old'] = old_values[:, j]
+        result[f'{column} new'] = new_values[:, j]
+        result[f'{column} delta'] = delta[:, j]
+    return pd.DataFrame(result)
+
+
+def top_movers(diff, column='Total_Season_ideal_intakes', n=20):
+    """The ``n`` rows of ``diff`` whose ``column`` changed most, either way."""
+    delta = diff[f'{column} delta'].to_numpy()
+    n = min(n, len(delta))
+    if n == 0:
+        return diff.iloc[:0]
+    order = np.argpartition(-np.abs(delta), n - 1)[:n]
+    order = order[np.argsort(-np.abs(delta[order]), kind='stable')]
+    return diff.iloc[order].reset_index(drop=True)
+
+
+def diff_summary(diff, columns=INTAKE_COLUMNS):
+    """Row counts per kind of change and the total delta of each of ``columns``."""
+    summary = diff['change'].value_counts().reindex(['added', 'removed', 'changed', 'unchanged'], fill_value=0)
+    totals = {c: float(diff[f'{c} delta'].sum()) for c in columns if f'{c} delta' in diff}
+    return summary.to_dict(), totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List saved forecast runs or compare two of them.")
+    parser.add_argument('command', choices=('list', 'diff'))
+    parser.add_argument('ids', nargs='*', help="OLD_ID NEW_ID for 'diff'")
+    parser.add_argument('--level', choices=list(LEVEL_KEYS), default='sku')
+    parser.add_argument('--top', type=int, default=20, help="top movers to print per intake column")
+    parser.add_argument('--output', default=None, help="write the full diff to this .xlsx/.parquet/.csv file")
+    args = parser.parse_args(argv)
+    store = SnapshotStore()
+
+    if args.command == 'list':
+        for record in store.records():
+            created = time.strftime('%Y-%m-%d %H:%M', time.localtime(record['created']))
+            print(f"{record['id']}  {created}  {record['skus']} SKUs  {record['label']}")
+        return 0
+
+    if len(args.ids) != 2:
+        parser.error("diff needs OLD_ID and NEW_ID")
+    started = time.perf_counter()
+    diff = store.diff(*args.ids, level=args.level)
+    counts, totals = diff_summary(diff)
+    print(f"{len(diff)} rows compared in {time.perf_counter() - started:.2f}s: "
+          + ", ".join(f"{n} {kind}" for kind, n in counts.items()))
+    key = LEVEL_KEYS[args.level]
+    for column in INTAKE_COLUMNS:
+        if f'{column} delta' not in diff:
+            continue
+        print(f"\n{column}: total change {totals[column]:+,.0f}")
+        movers = top_movers(diff, column, args.top)
+        print(movers[[key, 'change', f'{column} old', f'{column} new', f'{column} delta']].to_string(index=False))
+    if args.output:
+        from export import write_xlsx
+
+        if args.output.lower().endswith('.xlsx'):
+            write_xlsx({'Diff': diff}, args.output)
+        elif args.output.lower().endswith('.parquet'):
+            arrow_safe(diff).to_parquet(args.output, index=False)
+        else:
+            diff.to_csv(args.output, index=False)
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
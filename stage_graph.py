@@ -0,0 +1,291 @@
+"""Incremental recompute of the forecast as a graph of cached stages.
+
+Each stage declares the stages it reads and the ``ForecastParams`` fields it
+depends on. A stage's cache key is built from those parameter values and the
+keys of its inputs, so after a parameter change only the stages downstream
+of that parameter run again. Changing ``expected_period_end`` only redoes
+the #12.1 sums; changing ``min_acceptable_margin`` redoes the GP mask and
+what follows it.
+
+The graph holds the last result of every stage, so keep one graph per
+session (e.g. in ``st.session_state``). ``run_forecast`` holds the graph's
+lock, so a background job still finishing its current stage and a new job
+for the same session never evaluate the graph at the same time.
+
+When the upload fits (one row per SKU-week, every week inside its fiscal
+year and at most ``TOOLKIE_MAX_CUBE_CELLS`` SKU-week cells) it is also laid
+out once as a ``week_cube.WeekCube``, and the #5-#13 stages take their
+window totals from its prefix sums and scan only the weeks inside the
+windows, which makes re-running them after a parameter change several times
+cheaper. A window total taken as the difference of two prefix sums is
+rounded differently from summing the rows, so with fractional units the
+results can differ from ``forecast_engine.run_forecast`` in the last few
+bits (around 1e-13); with whole units they are identical. Otherwise the
+stages work on the rows and match the engine exactly. Uploads of ``forecast_engine.PARALLEL_MIN_ROWS`` rows
+or more that don't fit the cube take every #5-#13 sum in one ``partitioned``
+stage on ``parallel_engine`` worker processes instead, at the cost of redoing
+all of them after any change to their parameters.
+"""
+import os
+import threading
+
+import numpy as np
+
+import forecast_engine as fe
+import week_cube
+from instrumentation import NULL_TRACER, count_rows
+
+
+# The cube holds about a dozen float64 arrays of this many cells; larger uploads aggregate from the rows
+MAX_CUBE_CELLS = int(os.environ.get('TOOLKIE_MAX_CUBE_CELLS', 5_000_000))
+
+
+HORIZON_PARAMS = ('historical_horizon_period_start', 'historical_horizon_period_end', 'stock_threshold')
+# Every parameter of the #5-#13 sums, for the partitioned stage that takes them all at once
+SUM_PARAMS = HORIZON_PARAMS + ('min_acceptable_margin', 'expected_period_start', 'expected_period_end')
+INTAKE_PARAMS = (
+    'required_seaonal_clr_percent', 'required_quartery_clr_percent', 'required_8wks_clr_percent',
+    'long_horizon_diminishing_return', 'medium_horizon_diminishing_return',
+    'confidence', 'low_data_confidence', 'Min_no_of_data_points', 'data_reduction_threshold',
+)
+
+
+class Stage:
+    def __init__(self, name, func, deps=(), params=(), label=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = tuple(params)
+        # How the stage shows up in traces
+        self.label = label or name
+
+
+class StageGraph:
+    """Stages evaluated on demand, each caching its most recent result.
+
+    Root inputs are set with ``set_input`` together with a key identifying
+    their content (e.g. the upload hash).
+    """
+
+    def __init__(self, stages=()):
+        self.stages = {}
+        self._inputs = {}
+        self._cache = {}
+        # Names of the stages computed by the latest ``get`` call
+        self.recomputed = []
+        self.tracer = NULL_TRACER
+        self.lock = threading.RLock()
+        for stage in stages:
+            self.add(stage)
+
+    def add(self, stage):
+        self.stages[stage.name] = stage
+
+    def set_input(self, name, key, value):
+        """Set root input ``name``; stages reading it are invalidated when ``key`` changes."""
+        self._inputs[name] = (key, value)
+
+    def input_key(self, name):
+        entry = self._inputs.get(name)
+        return None if entry is None else entry[0]
+
+    def key(self, name, params, _memo=None):
+        if _memo is None:
+            _memo = {}
+        if name not in _memo:
+            if name in self._inputs:
+                _memo[name] = self._inputs[name][0]
+            else:
+                stage = self.stages[name]
+                _memo[name] = (
+                    name,
+                    tuple(getattr(params, p) for p in stage.params),
+                    tuple(self.key(dep, params, _memo) for dep in stage.deps),
+                )
+        return _memo[name]
+
+    def get(self, name, params):
+        """Return the value of stage ``name``, recomputing only stale stages."""
+        return self.get_many([name], params)[0]
+
+    def get_many(self, names, params):
+        self.recomputed = []
+        memo = {}
+        return [self._evaluate(name, params, memo) for name in names]
+
+    def _evaluate(self, name, params, memo):
+        if name in self._inputs:
+            return self._inputs[name][1]
+        if name not in self.stages:
+            raise KeyError(f"no stage or input named {name!r}")
+
+        key = self.key(name, params, memo)
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        stage = self.stages[name]
+        values = [self._evaluate(dep, params, memo) for dep in stage.deps]
+        with self.tracer.stage(stage.label, count_rows(values[0]) if values else None) as event:
+            value = stage.func(params, *values)
+            event['rows_out'] = count_rows(value)
+        self._cache[name] = (key, value)
+        self.recomputed.append(name)
+        return value
+
+    def clear(self):
+        self._cache.clear()
+
+
+# Forecast stages. Each mirrors a numbered step of forecast_engine.
+
+def _arrays(params, df):
+    return fe.sales_arrays(df)
+
+
+def _max_yearweek(params, df):
+    #4 latest completed week
+    return fe.latest_completed_week(df)
+
+
+def _cube(params, arrays):
+    # None when the rows can't (duplicate SKU-weeks, weeks outside their year) or shouldn't
+    # (too large) be laid out on a cube
+    try:
+        if week_cube.cube_cells(arrays) > MAX_CUBE_CELLS:
+            return None
+        cube = week_cube.cube_from_arrays(arrays)
+    except fe.ForecastError:
+        return None
+    return cube if cube.exact else None
+
+
+def _workers(params, arrays, cube):
+    # Processes for the row path; the cube path is always in-process
+    return 1 if cube is not None else fe.resolve_workers(len(arrays.codes))
+
+
+def _partitioned(params, arrays, max_yearweek, workers):
+    #5-#13 every sum at once over SKU partitions, or None when the per-step stages take them
+    if workers <= 1:
+        return None
+    import parallel_engine
+
+    return parallel_engine.sku_sums(arrays, params, max_yearweek, workers)
+
+
+def _horizon(params, arrays, cube, workers):
+    #5-#7 plus the #10.4-#10.6 and #12.2 sums, which only need the horizon
+    if cube is not None:
+        return week_cube.horizon_sums(cube, params)
+    if workers > 1:
+        return None
+    hrn, horizon, opp = fe.horizon_masks(arrays, params)
+    sums = fe.grouped_sums(arrays.codes, arrays.n_skus, np.column_stack([
+        fe.masked_values(horizon, arrays.sales), horizon,
+        fe.masked_values(hrn, arrays.actual_intake),
+    ]))
+    return opp, sums
+
+
+def _in_stock(params, arrays, cube, horizon):
+    #8-#10.3
+    if horizon is None:
+        return None
+    opp, _ = horizon
+    if cube is not None:
+        return week_cube.in_stock_sums(cube, params, opp)
+    in_stock = fe.in_stock_mask(arrays, opp, params)
+    return fe.grouped_sums(arrays.codes, arrays.n_skus, np.column_stack([
+        fe.masked_values(in_stock, arrays.sales), in_stock,
+    ]))
+
+
+def _expected(params, arrays, cube, workers):
+    #12.1
+    if cube is not None:
+        return week_cube.expected_sums(cube, params)
+    if workers > 1:
+        return None
+    expected = fe.expected_mask(arrays, params)
+    return fe.grouped_sums(arrays.codes, arrays.n_skus, fe.masked_values(expected, arrays.expected_intake)[:, None])
+
+
+def _current_stock(params, arrays, cube, max_yearweek, workers):
+    #13
+    if cube is not None:
+        return week_cube.current_stock(cube, max_yearweek)
+    if workers > 1:
+        return None
+    current = arrays.year_weeks == max_yearweek
+    return fe.grouped_sums(arrays.codes, arrays.n_skus, fe.masked_values(current, arrays.current_stock)[:, None])
+
+
+def _merged(params, arrays, partitioned, horizon, in_stock, expected, current_stock):
+    #10.7, #14 in SKU_MEASURES order
+    if partitioned is not None:
+        return fe.sku_frame(arrays.skus, partitioned)
+    _, horizon_sums = horizon
+    sums = np.column_stack([in_stock, horizon_sums, expected, current_stock])
+    return fe.sku_frame(arrays.skus, sums)
+
+
+def _intakes(params, merged_df):
+    return fe.forecast_intakes(merged_df, params)
+
+
+def _sku_results(params, df, merged_df):
+    return fe.attach_attributes(df, merged_df)
+
+
+def _product_results(params, df, sku_df):
+    return fe.product_rollup(df, sku_df)
+
+
+def forecast_graph():
+    """A StageGraph computing the forecast from the root input ``'sales'``."""
+    return StageGraph([
+        Stage('arrays', _arrays, deps=['sales'], label='#4 numeric columns'),
+        Stage('max_yearweek', _max_yearweek, deps=['sales'], label='#4 latest completed week'),
+        Stage('cube', _cube, deps=['arrays'], label='#4 SKU x week cube'),
+        Stage('workers', _workers, deps=['arrays', 'cube'], label='#4 worker processes'),
+        Stage('partitioned', _partitioned, deps=['arrays', 'max_yearweek', 'workers'], params=SUM_PARAMS,
+              label='#5-#13 partitioned sums'),
+        Stage('horizon', _horizon, deps=['arrays', 'cube', 'workers'], params=HORIZON_PARAMS,
+              label='#5-#7 horizon and OPP'),
+        Stage('in_stock', _in_stock, deps=['arrays', 'cube', 'horizon'], params=['min_acceptable_margin'],
+              label='#8-#10 GP and in-stock sums'),
+        Stage('expected', _expected, deps=['arrays', 'cube', 'workers'], params=['expected_period_start', 'expected_period_end'],
+              label='#12 expected intakes'),
+        Stage('current_stock', _current_stock, deps=['arrays', 'cube', 'max_yearweek', 'workers'],
+              label='#13 current stock'),
+        Stage('merged', _merged, deps=['arrays', 'partitioned', 'horizon', 'in_stock', 'expected', 'current_stock'],
+              label='#10.7/#14 merged_df'),
+        Stage('intakes', _intakes, deps=['merged'], params=INTAKE_PARAMS, label='#11/#15 intake maths'),
+        Stage('sku_results', _sku_results, deps=['sales', 'intakes'], label='#16-#18 attributes'),
+        Stage('product_results', _product_results, deps=['sales', 'sku_results'], label='product rollup'),
+    ])
+
+
+def run_forecast(graph, key, load_sales, params, tracer=NULL_TRACER):
+    """Run the forecast through ``graph`` for the upload identified by ``key``.
+
+    ``load_sales()`` is only called when ``key`` differs from the upload the
+    graph last saw. Same result as ``forecast_engine.run_forecast``, to the
+    last few bits on the cube path (see above). ``graph.recomputed``
+    afterwards lists the stages that actually ran, and ``tracer`` records
+    the upload parse and each of them.
+    """
+    with graph.lock:
+        if graph.input_key('sales') != key:
+            with tracer.stage('upload parse') as event:
+                df = load_sales()
+                event['rows_out'] = len(df)
+            fe.validate_schema(df)
+            graph.set_input('sales', key, df)
+        graph.tracer = tracer
+        try:
+            sku_df, product_df = graph.get_many(['sku_results', 'product_results'], params)
+        finally:
+            graph.tracer = NULL_TRACER
+    return sku_df, product_df
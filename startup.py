@@ -0,0 +1,171 @@
+"""Cold-start budget for the Streamlit app.
+
+Streamlit runs ``toolkie.py`` top to bottom on every interaction, and a
+fresh container pays for every import before the first paint. The page
+therefore imports only the app's own modules (and pandas/NumPy through
+them) at the top. Optional libraries (``DEFERRED_MODULES``, e.g. openpyxl
+for .xlsx, requests/PIL for thumbnails, pyarrow's Parquet reader) are
+imported inside the function of the feature that needs them.
+
+The first forecast would still pay for those lazy imports and for pandas'
+own first-call setup (groupby, merge, categoricals). ``warm_up`` runs a
+tiny forecast through the whole pipeline, and the app hands it to the job
+pool once per process (``jobs.prewarm``) while the first page is drawn.
+
+Usage::
+
+    python startup.py profile [--top 25]   # import-time profile in a fresh interpreter
+    python startup.py check                # exit 1 when over budget or a deferred module loads eagerly
+
+The budget is ``TOOLKIE_IMPORT_BUDGET`` seconds (default 1.0) for the
+app's top-level imports, Streamlit itself excluded.
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_SCRIPT = os.path.join(APP_DIR, 'toolkie.py')
+IMPORT_BUDGET_SECONDS = float(os.environ.get('TOOLKIE_IMPORT_BUDGET', 1.0))
+# Imported by the framework, not budgeted
+FRAMEWORK_MODULES = ('streamlit',)
+# Must not be loaded by the page's top-level imports
+DEFERRED_MODULES = (
+    'matplotlib', 'openpyxl', 'xlrd', 'requests', 'PIL', 'dash', 'dash_bootstrap_components', 'flask',
+    'pyarrow.parquet',
+)
+# Best of this many fresh interpreters, to keep the check stable on a busy machine
+PROFILE_RUNS = 3
+
+
+def app_imports(path=APP_SCRIPT):
+    """Top-level modules the page script imports when it starts, framework excluded."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            if name.split('.')[0] not in FRAMEWORK_MODULES and name not in modules:
+                modules.append(name)
+    return modules
+
+
+def import_profile(modules):
+    """Import ``modules`` in a fresh interpreter with ``-X importtime``.
+
+    Returns ``(seconds, entries, loaded)``: the wall time of the imports,
+    ``(module, self_us, cumulative_us, depth)`` for every module imported
+    and the names in ``sys.modules`` afterwards.
+    """
+    code = (
+        'import sys, time\n'
+        't = time.perf_counter()\n'
+        + ''.join(f'import {name}\n' for name in modules)
+        + 'print(time.perf_counter() - t)\n'
+        'print("\\n".join(sys.modules))\n'
+    )
+    done = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], cwd=APP_DIR, capture_output=True, text=True,
+    )
+    if done.returncode != 0:
+        raise ImportError(done.stderr.strip().splitlines()[-1])
+    entries = []
+    for line in done.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    seconds, *loaded = done.stdout.splitlines()
+    return float(seconds), entries, set(loaded)
+
+
+def eager_deferred(loaded):
+    """The ``DEFERRED_MODULES`` that were imported anyway."""
+    return [name for name in DEFERRED_MODULES if name in loaded]
+
+
+def _warm_frame():
+    """A few weeks of two SKUs of one product inside the default horizon."""
+    import numpy as np
+    import pandas as pd
+
+    import forecast_engine as fe
+
+    year_weeks = np.tile(np.arange(202501, 202509), 2)
+    n = len(year_weeks)
+    df = pd.DataFrame({column: np.full(n, 1.0) for column in fe.REQUIRED_COLUMNS})
+    df['SKU ID'] = np.repeat([1, 2], n // 2)
+    df['Product ID'] = 1
+    df['Fin Year'], df['Week'] = np.divmod(year_weeks, 100)
+    df['Actual EOW Stock Units'] = 5.0
+    df['Actual Sales Margin %'] = 0.5
+    for column in ('Image 1 URL', 'product_url', 'Brand', 'Department', 'Category Level 1',
+                   'Category Level 2', 'Product', 'Size'):
+        df[column] = column
+    return df
+
+
+def warm_up():
+    """Load the forecast's lazy imports and run a tiny forecast, export and index once."""
+    import pyarrow.parquet  # noqa: F401  (Parquet uploads and caches)
+
+    import forecast_engine as fe
+    from export import to_bytes
+    from ingest import finalize_dtypes
+    from results_index import ResultsIndex
+
+    sku_df, product_df = fe.run_forecast(finalize_dtypes(_warm_frame()))
+    fe.hierarchy_rollups(sku_df)
+    ResultsIndex(product_df)
+    to_bytes({'SKU Forecast': sku_df}, 'xlsx')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile and check the app's cold-start import cost.")
+    parser.add_argument('command', choices=('profile', 'check'))
+    parser.add_argument('--top', type=int, default=25, help="modules to list in the profile")
+    args = parser.parse_args(argv)
+
+    modules = app_imports()
+    try:
+        runs = [import_profile(modules) for _ in range(PROFILE_RUNS if args.command == 'check' else 1)]
+    except ImportError as exc:
+        print(f"FAIL  the app's imports don't load: {exc}")
+        return 1
+    seconds, entries, loaded = min(runs, key=lambda run: run[0])
+
+    if args.command == 'profile':
+        print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for name, self_us, cumulative_us, depth in sorted(entries, key=lambda e: -e[2])[:args.top]:
+            print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {'  ' * depth}{name}")
+        started = time.perf_counter()
+        warm_up()
+        print(f"\nTop-level imports of {os.path.basename(APP_SCRIPT)}: {seconds:.3f}s "
+              f"(budget {IMPORT_BUDGET_SECONDS:.3f}s); warm-up in this process: {time.perf_counter() - started:.3f}s")
+        return 0
+
+    failures = []
+    if seconds > IMPORT_BUDGET_SECONDS:
+        failures.append(f"imports took {seconds:.3f}s, over the {IMPORT_BUDGET_SECONDS:.3f}s budget")
+    eager = eager_deferred(loaded)
+    if eager:
+        failures.append("imported at startup but should be deferred: " + ", ".join(eager))
+    for failure in failures:
+        print(f"FAIL  {failure}")
+    if not failures:
+        print(f"ok    imports took {seconds:.3f}s of the {IMPORT_BUDGET_SECONDS:.3f}s budget")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
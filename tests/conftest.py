@@ -0,0 +1,30 @@
+"""Shared fixtures. Run the suite from the repository root with ``python -m pytest``."""
+import os
+import sys
+import warnings
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest  # noqa: E402
+from benchmarks.synthetic import make_sales_frame  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _quiet_pandas():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        yield
+
+
+@pytest.fixture
+def raw_sales():
+    """A small synthetic extract as read from a workbook: object columns, "-" margins."""
+    return make_sales_frame(3000)
+
+
+@pytest.fixture
+def sales(raw_sales):
+    """``raw_sales`` with the dtypes ingestion gives it."""
+    return ingest.finalize_dtypes(raw_sales.copy())
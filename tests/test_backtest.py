@@ -0,0 +1,76 @@
+import dataclasses
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+import forecast_engine as fe
+import week_cube
+
+WINDOW_WEEKS = 8
+STEP = 6
+
+
+@pytest.fixture
+def errors(sales):
+    return backtest.backtest_errors(week_cube.build_cube(sales), fe.ForecastParams(),
+                                    window_weeks=WINDOW_WEEKS, step=STEP)
+
+
+def test_cutoffs_have_a_full_window_before_them(sales, errors):
+    cube = week_cube.build_cube(sales)
+    first, last = backtest.data_weeks(cube)
+    ordinals = cube.calendar.ordinal(np.sort(errors['cutoff'].unique()))
+    assert ordinals[0] >= first + WINDOW_WEEKS - 1
+    assert np.all(np.diff(ordinals) == STEP)
+    # The latest cut-off with 8 weeks after it is always included
+    assert ordinals[-1] == last - 8
+
+
+def test_matches_a_forecast_run_at_each_cutoff(sales, errors):
+    cube = week_cube.build_cube(sales)
+    calendar_weeks = cube.calendar.year_weeks()
+    year_weeks = fe.year_week(sales)
+    units = sales['Actual Sales Units'].astype('float64').fillna(0).to_numpy()
+    for cutoff, at_cutoff in errors.groupby('cutoff'):
+        c = int(cube.calendar.ordinal(cutoff))
+        params = dataclasses.replace(
+            fe.ForecastParams(),
+            historical_horizon_period_start=int(calendar_weeks[c - WINDOW_WEEKS + 1]),
+            historical_horizon_period_end=int(cutoff),
+        )
+        sku_df = fe.run_forecast(sales, params)[0].set_index('SKU ID')
+        for column, (weeks, _) in backtest.HORIZONS.items():
+            rows = at_cutoff[at_cutoff['horizon'] == column].set_index('SKU ID')
+            if c + weeks > backtest.data_weeks(cube)[1]:
+                assert rows.empty
+                continue
+            expected = sku_df.loc[sku_df['no_of_weeks_reviewed'] > 0, column]
+            assert not rows.empty
+            assert sorted(rows.index) == sorted(expected.index)
+            assert np.array_equal(rows['forecast'].to_numpy(), expected.loc[rows.index].to_numpy())
+
+            following = np.isin(year_weeks, calendar_weeks[c + 1:c + 1 + weeks])
+            actual = pd.Series(units[following]).groupby(sales['SKU ID'].to_numpy()[following]).sum()
+            assert rows['actual'].to_numpy() == pytest.approx(actual.reindex(rows.index, fill_value=0).to_numpy())
+
+
+def test_accuracy_tables(sales):
+    errors, by_sku, by_category = backtest.run_backtest(sales, window_weeks=WINDOW_WEEKS, step=STEP)
+    overall = backtest.accuracy(errors, [])
+    assert overall['n'].sum() == len(errors) == by_sku['n'].sum() == by_category['n'].sum()
+    assert overall['horizon_weeks'].tolist() == [8, 13, 26]
+    season = errors[errors['horizon'] == 'Total_Season_Sales']
+    row = overall.set_index('horizon').loc['Total_Season_Sales']
+    assert row['MAE'] == pytest.approx(season['error'].abs().mean())
+    assert row['bias'] == pytest.approx(season['error'].mean())
+    assert row['WAPE'] == pytest.approx(season['error'].abs().sum() / season['actual'].sum())
+
+
+def test_cutoffs_without_a_full_window_are_rejected(sales):
+    cube = week_cube.build_cube(sales)
+    first, _ = backtest.data_weeks(cube)
+    too_early = int(cube.calendar.year_weeks()[first + 2])
+    with pytest.raises(fe.ForecastError, match=str(too_early)):
+        backtest.backtest_errors(cube, fe.ForecastParams(), cutoffs=[too_early], window_weeks=WINDOW_WEEKS)
@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import forecast_engine as fe
+import ingest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def manifest(raw_sales, tmp_path):
+    raw_sales.to_csv(tmp_path / 'a.csv', index=False)
+    raw_sales.to_csv(tmp_path / 'b.csv', index=False)
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps({'jobs': [
+        {'input': 'a.csv'},
+        {'input': 'b.csv', 'name': 'tight', 'params': {'min_acceptable_margin': 0.4}},
+    ]}))
+    return path
+
+
+@pytest.mark.parametrize('options', [
+    ['--workers', '1'],
+    ['--workers', '2'],
+    ['--workers', '1', '--partitions', '2'],
+    ['--workers', '2', '--partitions', '2'],
+])
+def test_batch_exits_with_results(manifest, tmp_path, options):
+    env = dict(os.environ, TOOLKIE_CACHE_DIR=str(tmp_path / 'cache'))
+    completed = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'batch_forecast.py'), str(manifest), '--format', 'csv', *options],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=60,
+    )
+    assert completed.returncode == 0, completed.stderr
+    summary = json.loads((tmp_path / 'manifest_summary.json').read_text())
+    assert summary['failed'] == 0
+
+    sales = ingest.read_upload((tmp_path / 'a.csv').read_bytes(), 'a.csv')
+    for name, params in (('a', fe.ForecastParams()), ('b_tight', fe.ForecastParams(min_acceptable_margin=0.4))):
+        written = pd.read_csv(tmp_path / f'{name}_forecast.csv')
+        expected, _ = fe.run_forecast(sales, params)
+        assert written['SKU ID'].tolist() == expected['SKU ID'].tolist()
+        assert written['Total_Season_ideal_intakes'].tolist() == pytest.approx(
+            expected['Total_Season_ideal_intakes'].tolist(), nan_ok=True)
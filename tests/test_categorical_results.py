@@ -0,0 +1,53 @@
+"""Results with blank attributes must stay writable to Parquet and Arrow."""
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import forecast_engine as fe
+import ingest
+from export import arrow_safe, to_bytes
+
+
+@pytest.fixture(params=[True, False], ids=['lean', 'full'])
+def blank_brand_results(request, raw_sales):
+    raw_sales.loc[raw_sales['SKU ID'] % 7 == 0, 'Brand'] = None
+    return fe.run_forecast(ingest.finalize_dtypes(raw_sales, lean=request.param))
+
+
+def test_blank_categoricals_filled_with_text_zero(blank_brand_results):
+    sku_df, _ = blank_brand_results
+    assert isinstance(sku_df['Brand'].dtype, pd.CategoricalDtype)
+    assert (sku_df['Brand'] == '0').any()
+    assert all(isinstance(value, str) for value in sku_df['Brand'].cat.categories)
+
+
+def test_results_convert_to_arrow_and_parquet(blank_brand_results):
+    for df in blank_brand_results:
+        pa.Table.from_pandas(df, preserve_index=False)
+        roundtrip = pd.read_parquet(BytesIO(to_bytes({'Results': df}, 'parquet')))
+        assert len(roundtrip) == len(df)
+
+
+def test_fillna_zero_keeps_numeric_categories_numeric():
+    df = pd.DataFrame({'Size': pd.Series([10, None, 12], dtype='category')})
+    assert fe.fillna_zero(df)['Size'].tolist() == [10, 0, 12]
+
+
+def test_arrow_safe_mixed_categories():
+    df = pd.DataFrame({
+        'Size': pd.Series(['M', None, 10], dtype='category'),
+        'Brand': pd.Series(['Aster', None, 'Birch'], dtype='category'),
+        'margin': pd.Series([0.4, '-', None], dtype=object),
+    })
+    with pytest.raises((pa.ArrowTypeError, pa.ArrowInvalid)):
+        pa.Table.from_pandas(df)
+    safe = arrow_safe(df)
+    table = pa.Table.from_pandas(safe)
+    assert safe['Size'].cat.categories.tolist() == ['10', 'M']
+    assert safe['Size'].isna().tolist() == [False, True, False]
+    assert safe['Brand'].cat.categories.tolist() == ['Aster', 'Birch']
+    assert table.num_rows == 3
+    # The caller's frame is left alone
+    assert 10 in df['Size'].cat.categories
@@ -0,0 +1,117 @@
+import threading
+from io import BytesIO
+
+import pandas as pd
+import pytest
+
+import forecast_api
+import jobs
+import result_cache
+import upload_cache
+
+
+@pytest.fixture(autouse=True)
+def _isolated_caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(result_cache, '_cache', result_cache.ResultCache(disk=False))
+
+
+@pytest.fixture
+def client():
+    return forecast_api.create_app(workers=1).test_client()
+
+
+@pytest.fixture
+def csv_body(raw_sales):
+    raw_sales.loc[raw_sales['SKU ID'] % 7 == 0, 'Brand'] = None
+    raw_sales['Actual Sales Margin %'] = pd.to_numeric(raw_sales['Actual Sales Margin %'], errors='coerce')
+    return raw_sales.to_csv(index=False).encode()
+
+
+def test_blank_attributes_forecast(client, csv_body):
+    response = client.post('/forecast?level=product', data=csv_body)
+    assert response.status_code == 200, response.get_json()
+    df = pd.read_parquet(BytesIO(response.data))
+    assert len(df) == int(response.headers['X-Forecast-Rows'])
+
+    response = client.post('/forecast?format=arrow', data=csv_body)
+    assert response.status_code == 200, response.get_json()
+
+
+@pytest.mark.parametrize('query, body, status', [
+    ('', b'', 400),
+    ('?level=style', b'a\n1\n', 400),
+    ('?format=xlsx', b'a\n1\n', 400),
+    ('?confidence=high', b'a\n1\n', 400),
+    ('', b'\x00\x01garbage,,,\n"', 400),
+    ('', b'a,b\n1,2\n', 422),
+])
+def test_bad_requests(client, query, body, status):
+    response = client.post(f'/forecast{query}', data=body)
+    assert response.status_code == status
+    assert response.get_json()['error']
+
+
+def test_unexpected_failure_is_500(client, monkeypatch):
+    def broken(data, key=None):
+        raise RuntimeError("disk on fire")
+
+    monkeypatch.setattr(forecast_api, 'load_upload', broken)
+    response = client.post('/forecast', data=b'a\n1\n')
+    assert response.status_code == 500
+    assert client.get('/health').get_json()['requests']['server_error'] == 1
+
+
+def test_full_queue_is_503(raw_sales):
+    client = forecast_api.create_app(max_queue=0).test_client()
+    response = client.post('/forecast', data=raw_sales.to_csv(index=False).encode())
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+    assert client.get('/health').get_json()['requests']['rejected'] == 1
+
+
+def test_timeout_cancels_the_job(csv_body, monkeypatch):
+    submitted = []
+    release = threading.Event()
+
+    class RecordingJobManager(jobs.JobManager):
+        def submit(self, func, trace_memory=False, max_queued=None):
+            job = super().submit(func, trace_memory, max_queued)
+            submitted.append(job)
+            return job
+
+    def slow_load(data, key=None):
+        release.wait(5)
+        return upload_cache.load_upload(data, key=key)
+
+    monkeypatch.setattr(forecast_api, 'JobManager', RecordingJobManager)
+    monkeypatch.setattr(forecast_api, 'load_upload', slow_load)
+    client = forecast_api.create_app(workers=1, timeout=0.05).test_client()
+    response = client.post('/forecast', data=csv_body)
+    assert response.status_code == 504
+
+    (job,) = submitted
+    assert job.cancel_requested
+    release.set()
+    assert job.wait(5)
+    # Stopped at the first engine stage after the upload was parsed
+    assert job.status == jobs.CANCELLED
+    assert [event['name'] for event in job.tracer.events] == ['upload parse', '#4 latest completed week']
+
+
+def test_submit_refuses_past_max_queued():
+    manager = jobs.JobManager(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def block(tracer):
+        started.set()
+        release.wait(5)
+
+    running = manager.submit(block)
+    assert started.wait(5)
+    waiting = manager.submit(lambda tracer: None, max_queued=1)
+    with pytest.raises(jobs.QueueFull):
+        manager.submit(lambda tracer: None, max_queued=1)
+    release.set()
+    assert running.wait(5) and waiting.wait(5)
+    assert manager.queue_depth() == 0
@@ -0,0 +1,50 @@
+import dataclasses
+import tempfile
+
+import pandas as pd
+import pytest
+
+import forecast_engine as fe
+import ingest
+import out_of_core
+
+
+@pytest.fixture(params=['parquet', 'csv'])
+def extract(request, raw_sales, tmp_path):
+    """The synthetic extract written to a file of each chunked format."""
+    path = tmp_path / f'extract.{request.param}'
+    if request.param == 'parquet':
+        raw_sales['Actual Sales Margin %'] = pd.to_numeric(raw_sales['Actual Sales Margin %'], errors='coerce')
+        raw_sales.to_parquet(path, index=False)
+    else:
+        raw_sales.to_csv(path, index=False)
+    return path
+
+
+def in_memory(path, params=None):
+    return fe.run_forecast(ingest.read_upload(path.read_bytes(), path.name), params)
+
+
+@pytest.mark.parametrize('chunk_rows', [50, 500, 100_000])
+def test_matches_in_memory_forecast(extract, chunk_rows):
+    sku_df, product_df = out_of_core.run_forecast_file(str(extract), chunk_rows=chunk_rows)
+    expected_sku, expected_product = in_memory(extract)
+    assert sku_df.equals(expected_sku)
+    assert product_df.equals(expected_product)
+
+
+def test_params_match_in_memory_forecast(extract):
+    params = dataclasses.replace(fe.ForecastParams(), historical_horizon_period_start=202445,
+                                 min_acceptable_margin=0.3)
+    sku_df, product_df = out_of_core.run_forecast_file(str(extract), params, chunk_rows=500)
+    expected_sku, expected_product = in_memory(extract, params)
+    assert sku_df.equals(expected_sku)
+    assert product_df.equals(expected_product)
+
+
+def test_spill_directory_removed(extract, tmp_path, monkeypatch):
+    spill = tmp_path / 'spill'
+    spill.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(spill))
+    out_of_core.run_forecast_file(str(extract), chunk_rows=500)
+    assert list(spill.iterdir()) == []
@@ -0,0 +1,90 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+
+import forecast_engine as fe
+import parallel_engine
+
+
+@pytest.fixture(scope='module', autouse=True)
+def _pools():
+    yield
+    parallel_engine.shutdown_pools()
+
+
+@pytest.fixture
+def fractional_sales(sales):
+    # Non-integer values, so a different summation order would show up in the last bits
+    rng = np.random.default_rng(1)
+    sales = sales.copy()
+    for column in ('Actual Sales Units', 'Actual EOW Stock Units', 'Actual Intake Units'):
+        sales[column] = sales[column].astype('float64') * rng.uniform(0.9, 1.1, len(sales))
+    return sales
+
+
+def test_partitions_cover_every_sku_once():
+    codes = np.repeat(np.arange(10), [5, 1, 1, 1, 20, 1, 1, 1, 1, 8])
+    bounds = parallel_engine.partition_bounds(codes, 10, 3)
+    assert bounds[0] == 0 and bounds[-1] == 10
+    assert np.all(np.diff(bounds) > 0)
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_sku_sums_bit_identical(fractional_sales, workers):
+    params = fe.ForecastParams()
+    year_weeks = fe.year_week(fractional_sales)
+    max_yearweek = fe.latest_completed_week(fractional_sales, year_weeks)
+    arrays = fe.sales_arrays(fractional_sales, year_weeks)
+    serial = fe.sku_sums(arrays, params, max_yearweek)
+    parallel = parallel_engine.sku_sums(arrays, params, max_yearweek, workers)
+    assert serial.dtype == parallel.dtype
+    assert np.array_equal(serial, parallel, equal_nan=True)
+
+
+def test_run_forecast_with_workers_matches_serial(fractional_sales):
+    serial = fe.run_forecast(fractional_sales)
+    parallel = fe.run_forecast(fractional_sales, workers=2)
+    assert serial[0].equals(parallel[0])
+    assert serial[1].equals(parallel[1])
+
+
+def test_broken_pool_is_replaced(fractional_sales):
+    params = fe.ForecastParams()
+    year_weeks = fe.year_week(fractional_sales)
+    max_yearweek = fe.latest_completed_week(fractional_sales, year_weeks)
+    arrays = fe.sales_arrays(fractional_sales, year_weeks)
+
+    broken = parallel_engine.get_pool(2)
+    with pytest.raises(BrokenProcessPool):
+        broken.submit(os._exit, 1).result()
+    with pytest.raises(BrokenProcessPool):
+        parallel_engine.sku_sums(arrays, params, max_yearweek, 2)
+
+    assert parallel_engine.get_pool(2) is not broken
+    parallel = parallel_engine.sku_sums(arrays, params, max_yearweek, 2)
+    assert np.array_equal(parallel, fe.sku_sums(arrays, params, max_yearweek), equal_nan=True)
+
+
+def test_run_forecast_goes_parallel_above_threshold(sales, monkeypatch):
+    calls = []
+    serial_sums = parallel_engine.sku_sums
+
+    def recording(arrays, params, max_yearweek, workers=None):
+        calls.append(workers)
+        return serial_sums(arrays, params, max_yearweek, workers)
+
+    monkeypatch.setattr(parallel_engine, 'sku_sums', recording)
+    monkeypatch.setenv('TOOLKIE_WORKERS', '2')
+    expected = fe.run_forecast(sales, workers=1)
+    assert calls == []
+
+    monkeypatch.setattr(fe, 'PARALLEL_MIN_ROWS', len(sales) + 1)
+    fe.run_forecast(sales)
+    assert calls == []
+
+    monkeypatch.setattr(fe, 'PARALLEL_MIN_ROWS', len(sales))
+    sku_df, product_df = fe.run_forecast(sales)
+    assert calls == [2]
+    assert sku_df.equals(expected[0]) and product_df.equals(expected[1])
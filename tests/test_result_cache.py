@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import forecast_engine as fe
+from result_cache import ResultCache
+
+FRAMES = (pd.DataFrame({'SKU ID': [1, 2]}), pd.DataFrame({'Product ID': [1]}))
+
+
+def test_concurrent_callers_compute_once():
+    cache = ResultCache(disk=False)
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return FRAMES
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_compute('upload', fe.ForecastParams(), compute)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+    assert (cache.hits, cache.misses) == (7, 1)
+
+
+def test_newcomer_waits_for_a_retry_after_a_failure():
+    cache = ResultCache(disk=False)
+    params = fe.ForecastParams()
+    calls = []
+    retrying, finish_retry = threading.Event(), threading.Event()
+    first_failing = threading.Event()
+
+    def compute():
+        calls.append(1)
+        if len(calls) == 1:
+            first_failing.wait(5)
+            raise RuntimeError("first attempt fails")
+        retrying.set()
+        finish_retry.wait(5)
+        return FRAMES
+
+    errors, results = [], []
+
+    def call():
+        try:
+            results.append(cache.get_or_compute('upload', params, compute))
+        except RuntimeError as exc:
+            errors.append(exc)
+
+    first = threading.Thread(target=call)
+    first.start()
+    while not calls:
+        time.sleep(0.01)
+    # Queued behind the first caller's lock when that caller fails
+    waiter = threading.Thread(target=call)
+    waiter.start()
+    time.sleep(0.1)
+    first_failing.set()
+    assert retrying.wait(5)
+
+    # Arrives while the waiter retries, after the failed caller has left
+    newcomer = threading.Thread(target=call)
+    newcomer.start()
+    newcomer.join(0.2)
+    finish_retry.set()
+    for thread in (first, waiter, newcomer):
+        thread.join(5)
+
+    assert len(calls) == 2
+    assert len(errors) == 1 and len(results) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache._computing == {}
+
+
+def test_failed_compute_is_not_cached():
+    cache = ResultCache(disk=False)
+
+    def fail():
+        raise ValueError("bad upload")
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute('upload', fe.ForecastParams(), fail)
+    assert cache.get_or_compute('upload', fe.ForecastParams(), lambda: FRAMES)[0].equals(FRAMES[0])
+    assert len(cache) == 1
@@ -0,0 +1,40 @@
+import dataclasses
+
+import numpy as np
+import pytest
+
+import forecast_engine as fe
+import scenarios
+
+
+@pytest.fixture
+def grid():
+    return scenarios.scenario_grid(
+        min_acceptable_margin=[0.3, 0.45],
+        confidence=[0.8, 0.9],
+        required_seaonal_clr_percent=[0.7, 0.9],
+    )
+
+
+def test_grid_is_every_combination(grid):
+    assert len(grid) == 8
+    assert not grid.duplicated().any()
+    assert (grid['low_data_confidence'] == fe.ForecastParams().low_data_confidence).all()
+    with pytest.raises(ValueError, match='fin_year'):
+        scenarios.scenario_grid(fin_year=[2024])
+
+
+def test_matches_a_forecast_per_scenario(sales, grid):
+    sku_table, totals = scenarios.run_scenarios(sales, grid)
+    for scenario, values in grid.iterrows():
+        params = dataclasses.replace(fe.ForecastParams(), **{k: float(v) for k, v in values.items()})
+        sku_df = fe.run_forecast(sales, params)[0]
+        expected = sku_df[sku_df['no_of_weeks_reviewed'] > 0].set_index('SKU ID')
+        rows = sku_table[sku_table['scenario'] == scenario].set_index('SKU ID')
+        assert sorted(rows.index) == sorted(expected.index)
+        for column in scenarios.SCENARIO_RESULT_COLUMNS:
+            assert np.array_equal(rows[column].to_numpy(), expected.loc[rows.index, column].to_numpy(),
+                                  equal_nan=True), (scenario, column)
+        assert totals.loc[scenario, 'SKUs'] == len(expected)
+        assert totals.loc[scenario, 'Total_Season_ideal_intakes'] == pytest.approx(
+            expected['Total_Season_ideal_intakes'].sum())
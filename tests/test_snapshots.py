@@ -0,0 +1,111 @@
+import dataclasses
+import time
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import forecast_engine as fe
+import snapshots
+
+INTAKE = 'Total_Season_ideal_intakes'
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Snapshot creation times a minute apart, so their order doesn't depend on the machine's speed."""
+    ticks = iter(range(1_700_000_000, 1_800_000_000, 60))
+    fake = types.SimpleNamespace(time=lambda: next(ticks), strftime=time.strftime,
+                                 localtime=time.localtime, perf_counter=time.perf_counter)
+    monkeypatch.setattr(snapshots, 'time', fake)
+
+
+@pytest.fixture
+def results(sales):
+    return fe.run_forecast(sales)
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return snapshots.SnapshotStore(str(tmp_path), max_snapshots=3)
+
+
+def test_same_run_is_stored_once(store, results):
+    params = fe.ForecastParams()
+    first = store.save(*results, 'upload', params)
+    assert store.save(*results, 'upload', params) == first
+    assert store.find('upload', params) == first
+    assert [r['id'] for r in store.records()] == [first]
+
+    other = store.save(*results, 'upload', dataclasses.replace(params, confidence=0.8))
+    assert other != first
+    assert store.find('other upload', params) is None
+    assert store.load(first).equals(store.load(other))
+
+
+def test_prunes_to_max_snapshots(store, results, tmp_path):
+    ids = [store.save(*results, f'upload {i}', fe.ForecastParams()) for i in range(5)]
+    assert [r['id'] for r in store.records()] == ids[:1:-1]
+    for old_id in ids[:2]:
+        with pytest.raises(KeyError):
+            store.load(old_id)
+    assert len(list(tmp_path.iterdir())) == 3 * 3
+
+
+@pytest.fixture
+def diff(store, results):
+    """The diff between a run and a copy with 3 SKUs removed, 2 added and 4 changed."""
+    old_sku, product_df = results
+    new_sku = old_sku.iloc[3:].copy()
+    added = old_sku.iloc[:2].copy()
+    added['SKU ID'] = [1, 2]
+    new_sku = pd.concat([new_sku, added], ignore_index=True)
+    new_sku.loc[:3, INTAKE] = new_sku.loc[:3, INTAKE] + [10.0, -40.0, 25.0, 5.0]
+
+    old_id = store.save(old_sku, product_df, 'old', fe.ForecastParams())
+    new_id = store.save(new_sku, product_df, 'new', fe.ForecastParams())
+    return old_sku, new_sku, store.diff(old_id, new_id)
+
+
+def test_diff_counts(diff):
+    old_sku, _, diff = diff
+    counts, totals = snapshots.diff_summary(diff)
+    assert counts == {'added': 2, 'removed': 3, 'changed': 4, 'unchanged': len(old_sku) - 3 - 4}
+    removed_total = old_sku[INTAKE].iloc[:3].sum()
+    added_total = old_sku[INTAKE].iloc[:2].sum()
+    assert totals[INTAKE] == pytest.approx(10 - 40 + 25 + 5 - removed_total + added_total)
+
+
+def test_diff_labels(diff):
+    old_sku, new_sku, diff = diff
+    assert diff['Product ID'].dtype == 'Int64'
+    removed = diff[diff['change'] == 'removed'].set_index('SKU ID')
+    expected = old_sku.iloc[:3].set_index('SKU ID')
+    assert removed['Product ID'].tolist() == expected['Product ID'].tolist()
+    assert removed['Brand'].tolist() == expected['Brand'].astype(object).tolist()
+    assert (removed[f'{INTAKE} new'].isna()).all()
+
+    added = diff[diff['change'] == 'added'].set_index('SKU ID')
+    assert added.index.tolist() == [1, 2]
+    assert added['Product ID'].tolist() == old_sku['Product ID'].iloc[:2].tolist()
+
+
+def test_top_movers_order(diff):
+    _, _, diff = diff
+    movers = snapshots.top_movers(diff, INTAKE, n=4)
+    deltas = movers[f'{INTAKE} delta'].abs().to_numpy()
+    assert len(movers) == 4
+    assert np.all(deltas[:-1] >= deltas[1:])
+    assert deltas[0] == diff[f'{INTAKE} delta'].abs().max()
+    assert snapshots.top_movers(diff.iloc[:0], INTAKE).empty
+
+
+def test_top_movers_on_known_deltas():
+    old = pd.DataFrame({'SKU ID': [1, 2, 3, 4], INTAKE: [10.0, 10.0, 10.0, 10.0]})
+    new = pd.DataFrame({'SKU ID': [1, 2, 3, 5], INTAKE: [12.0, 3.0, 10.0, 6.0]})
+    diff = snapshots.diff_snapshots(old, new, 'SKU ID', [INTAKE])
+    movers = snapshots.top_movers(diff, INTAKE, n=3)
+    assert movers['SKU ID'].tolist() == [4, 2, 5]
+    assert movers['change'].tolist() == ['removed', 'changed', 'added']
+    assert movers[f'{INTAKE} delta'].tolist() == [-10.0, -7.0, 6.0]
@@ -0,0 +1,122 @@
+import dataclasses
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import forecast_engine as fe
+import parallel_engine
+import stage_graph
+
+
+def run(graph, sales, params, key='upload'):
+    return stage_graph.run_forecast(graph, key, lambda: sales, params)
+
+
+@pytest.fixture(scope='module', autouse=True)
+def _pools():
+    yield
+    parallel_engine.shutdown_pools()
+
+
+@pytest.fixture(params=['cube', 'rows', 'partitioned'])
+def graph(request, monkeypatch):
+    if request.param != 'cube':
+        monkeypatch.setattr(stage_graph, 'MAX_CUBE_CELLS', 0)
+    if request.param == 'partitioned':
+        monkeypatch.setattr(fe, 'PARALLEL_MIN_ROWS', 0)
+        monkeypatch.setenv('TOOLKIE_WORKERS', '2')
+    return stage_graph.forecast_graph()
+
+
+def test_matches_engine(graph, sales):
+    params = fe.ForecastParams()
+    sku_df, product_df = run(graph, sales, params)
+    expected_sku, expected_product = fe.run_forecast(sales, params)
+    assert sku_df.equals(expected_sku)
+    assert product_df.equals(expected_product)
+
+
+def test_unchanged_params_recompute_nothing(graph, sales):
+    params = fe.ForecastParams()
+    run(graph, sales, params)
+    run(graph, sales, params)
+    assert graph.recomputed == []
+
+
+@pytest.mark.parametrize('change, recomputed', [
+    ({'expected_period_end': 202530}, ['expected', 'partitioned', 'merged', 'intakes', 'sku_results', 'product_results']),
+    ({'min_acceptable_margin': 0.3}, ['in_stock', 'partitioned', 'merged', 'intakes', 'sku_results', 'product_results']),
+    ({'historical_horizon_period_start': 202445},
+     ['horizon', 'in_stock', 'partitioned', 'merged', 'intakes', 'sku_results', 'product_results']),
+    ({'confidence': 0.8}, ['intakes', 'sku_results', 'product_results']),
+])
+def test_param_change_recomputes_downstream_only(graph, sales, change, recomputed):
+    params = fe.ForecastParams()
+    run(graph, sales, params)
+    changed = dataclasses.replace(params, **change)
+    sku_df, product_df = run(graph, sales, changed)
+    assert sorted(graph.recomputed) == sorted(recomputed)
+    expected_sku, expected_product = fe.run_forecast(sales, changed)
+    assert sku_df.equals(expected_sku)
+    assert product_df.equals(expected_product)
+
+
+def test_new_upload_recomputes_everything(graph, sales):
+    params = fe.ForecastParams()
+    run(graph, sales, params)
+    loads = []
+    run(graph, sales.iloc[:2000], params, key='other')
+    assert set(graph.recomputed) == set(graph.stages)
+
+    # The loader is only called when the upload key changes
+    stage_graph.run_forecast(graph, 'other', lambda: loads.append(1), params)
+    assert loads == []
+
+
+def test_duplicate_sku_weeks_fall_back_to_rows(sales):
+    doubled = sales.iloc[list(range(len(sales))) + [0]].reset_index(drop=True)
+    graph = stage_graph.forecast_graph()
+    sku_df, _ = run(graph, doubled, fe.ForecastParams())
+    assert graph.get('cube', fe.ForecastParams()) is None
+    assert sku_df.equals(fe.run_forecast(doubled)[0])
+
+
+def test_large_uploads_use_the_partitioned_stage(sales, monkeypatch):
+    monkeypatch.setattr(stage_graph, 'MAX_CUBE_CELLS', 0)
+    monkeypatch.setattr(fe, 'PARALLEL_MIN_ROWS', 0)
+    monkeypatch.setenv('TOOLKIE_WORKERS', '2')
+    graph = stage_graph.forecast_graph()
+    params = fe.ForecastParams()
+    run(graph, sales, params)
+    assert graph.get('workers', params) == 2
+    assert graph.get('partitioned', params) is not None
+    assert graph.get('horizon', params) is None
+
+    monkeypatch.setattr(fe, 'PARALLEL_MIN_ROWS', len(sales) + 1)
+    graph = stage_graph.forecast_graph()
+    run(graph, sales, params)
+    assert graph.get('workers', params) == 1
+    assert graph.get('partitioned', params) is None
+
+
+def test_cube_matches_engine_closely_with_fractional_units(sales):
+    # Prefix-sum differences round differently from row sums, so this is close, not bit-identical
+    rng = np.random.default_rng(1)
+    sales = sales.copy()
+    sales['Actual Sales Units'] = sales['Actual Sales Units'].astype('float64') * rng.uniform(0.9, 1.1, len(sales))
+    graph = stage_graph.forecast_graph()
+    sku_df, product_df = run(graph, sales, fe.ForecastParams())
+    assert graph.get('cube', fe.ForecastParams()) is not None
+    expected_sku, expected_product = fe.run_forecast(sales)
+    pd.testing.assert_frame_equal(sku_df, expected_sku, check_exact=False, rtol=1e-9)
+    pd.testing.assert_frame_equal(product_df, expected_product, check_exact=False, rtol=1e-9)
+
+
+def test_weeks_outside_their_year_fall_back_to_rows(sales):
+    sales = sales.copy()
+    sales.loc[0, 'Week'] = 0
+    graph = stage_graph.forecast_graph()
+    sku_df, _ = run(graph, sales, fe.ForecastParams())
+    assert graph.get('cube', fe.ForecastParams()) is None
+    assert sku_df.equals(fe.run_forecast(sales)[0])
@@ -0,0 +1,20 @@
+import startup
+
+
+def test_app_imports_within_budget():
+    modules = startup.app_imports()
+    assert 'forecast_engine' in modules
+    # Best of a few fresh interpreters, as ``startup.py check`` does
+    runs = [startup.import_profile(modules) for _ in range(startup.PROFILE_RUNS)]
+    seconds, _, loaded = min(runs, key=lambda run: run[0])
+    assert startup.eager_deferred(loaded) == []
+    assert seconds <= startup.IMPORT_BUDGET_SECONDS
+
+
+def test_eager_deferred_import_is_caught():
+    _, _, loaded = startup.import_profile(['openpyxl'])
+    assert 'openpyxl' in startup.eager_deferred(loaded)
+
+
+def test_warm_up_runs():
+    startup.warm_up()
@@ -0,0 +1,122 @@
+import base64
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import thumbnails
+
+
+def png(width, height, noise=False):
+    pixels = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8) if noise else None
+    image = Image.fromarray(pixels) if noise else Image.new('RGB', (width, height), 'red')
+    out = BytesIO()
+    image.save(out, format='PNG')
+    return out.getvalue()
+
+
+ROUTES = {
+    '/ok.png': ('image/png', png(400, 200)),
+    '/page.html': ('text/html', b'<html>no image here</html>'),
+    '/heavy.png': ('image/png', png(200, 200, noise=True)),
+    '/wide.png': ('image/png', png(3000, 2000)),
+}
+
+
+@pytest.fixture
+def server():
+    """A local stand-in for the image host: ``(base URL, hits per path)``."""
+    hits = Counter()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits[self.path] += 1
+            if self.path == '/stream':
+                # No Content-Length: the body only ends when the connection closes
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.end_headers()
+                body = ROUTES['/heavy.png'][1]
+                try:
+                    for start in range(0, len(body), 4096):
+                        self.wfile.write(body[start:start + 4096])
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading at its byte limit
+                    pass
+                return
+            if self.path not in ROUTES:
+                self.send_error(404)
+                return
+            content_type, body = ROUTES[self.path]
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}', hits
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def local_cache(directory, **limits):
+    session = thumbnails.make_session()
+    # Don't send requests for 127.0.0.1 through a proxy from the environment
+    session.trust_env = False
+    return thumbnails.ThumbnailCache(directory=str(directory), session=session, **limits)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return local_cache(tmp_path, max_image_bytes=20_000, max_pixels=1_000_000)
+
+
+def test_image_becomes_data_uri(server, cache):
+    base, hits = server
+    url = f'{base}/ok.png'
+    (uri,) = cache.inline([url], timeout=10)
+    assert uri.startswith('data:image/jpeg;base64,')
+    with Image.open(BytesIO(base64.b64decode(uri.split(',', 1)[1]))) as image:
+        assert image.size == (96, 48)
+
+    # Served from the disk cache afterwards
+    assert cache.inline([url], timeout=10) == [uri]
+    assert hits['/ok.png'] == 1
+
+
+@pytest.mark.parametrize('path', ['/missing.png', '/page.html', '/heavy.png', '/wide.png', '/stream'])
+def test_unusable_urls_keep_their_value_and_are_remembered(server, cache, path):
+    base, hits = server
+    url = f'{base}{path}'
+    assert cache.inline([url, 'not a url'], timeout=10) == [url, 'not a url']
+    assert cache.failed_recently(url)
+
+    assert cache.inline([url], timeout=10) == [url]
+    assert hits[path] == 1
+
+
+def test_failures_are_retried_after_their_ttl(server, cache):
+    base, hits = server
+    url = f'{base}/missing.png'
+    cache.failure_ttl = 0
+    cache.inline([url], timeout=10)
+    assert not cache.failed_recently(url)
+    cache.inline([url], timeout=10)
+    assert hits['/missing.png'] == 2
+
+
+@pytest.mark.parametrize('path', ['/heavy.png', '/wide.png', '/stream'])
+def test_limits_only_refuse_what_is_over_them(server, tmp_path, path):
+    base, _ = server
+    (uri,) = local_cache(tmp_path).inline([f'{base}{path}'], timeout=10)
+    assert uri.startswith('data:image/jpeg;base64,')
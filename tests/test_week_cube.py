@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+import forecast_engine as fe
+from week_cube import FiscalCalendar
+
+
+def test_ordinals_are_contiguous_across_years():
+    calendar = FiscalCalendar.from_year_weeks([202401, 202453, 202501, 202552])
+    assert calendar.weeks_per_year.tolist() == [53, 52]
+    assert calendar.ordinal([202401, 202453, 202501, 202552]).tolist() == [0, 52, 53, 104]
+    assert calendar.year_weeks()[[52, 53]].tolist() == [202453, 202501]
+
+
+@pytest.mark.parametrize('year_weeks', [[202500, 202510], [202554], [202599]])
+def test_calendar_rejects_weeks_outside_a_year(year_weeks):
+    with pytest.raises(fe.ForecastError, match=str(year_weeks[0])):
+        FiscalCalendar.from_year_weeks(year_weeks)
+
+
+@pytest.mark.parametrize('year_week', [202500, 202553, 202600])
+def test_ordinal_rejects_weeks_outside_their_year(year_week):
+    calendar = FiscalCalendar.from_year_weeks([202501, 202552])
+    with pytest.raises(fe.ForecastError):
+        calendar.ordinal(year_week)
+    with pytest.raises(fe.ForecastError):
+        calendar.ordinal(np.array([202501, year_week]))
@@ -0,0 +1,66 @@
+import dataclasses
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import forecast_engine as fe
+from weekly_update import WeeklyState
+
+
+def sorted_by(df, key):
+    return df.sort_values(key, kind='stable').reset_index(drop=True)
+
+
+def assert_same_results(actual, expected):
+    # SKUs and products come out in order of first appearance across the uploads
+    pd.testing.assert_frame_equal(sorted_by(actual[0], 'SKU ID'), sorted_by(expected[0], 'SKU ID'))
+    pd.testing.assert_frame_equal(sorted_by(actual[1], 'Product ID'), sorted_by(expected[1], 'Product ID'))
+
+
+@pytest.fixture
+def weekly(sales):
+    """The full history, and a state built from all but its last three weeks then appended to."""
+    year_weeks = fe.year_week(sales)
+    weeks = np.unique(year_weeks[~np.isnan(year_weeks)])
+    state = WeeklyState.from_frame(sales[year_weeks < weeks[-3]].reset_index(drop=True), 'history')
+    for week in weeks[-3:]:
+        state.append(sales[year_weeks == week].reset_index(drop=True), f'week {week}')
+    return sales, state
+
+
+def test_appended_weeks_match_full_history(weekly):
+    sales, state = weekly
+    assert_same_results(state.forecast(), fe.run_forecast(sales))
+
+
+@pytest.mark.parametrize('change', [
+    {'historical_horizon_period_start': 202445},
+    {'min_acceptable_margin': 0.3},
+    {'confidence': 0.8},
+])
+def test_params_match_full_history(weekly, change):
+    sales, state = weekly
+    params = dataclasses.replace(fe.ForecastParams(), **change)
+    assert_same_results(state.forecast(params), fe.run_forecast(sales, params))
+
+
+def test_save_and_load_round_trip(weekly, tmp_path):
+    _, state = weekly
+    state.save(tmp_path)
+    loaded = WeeklyState.load(tmp_path)
+    assert loaded.revision == state.revision
+    assert_same_results(loaded.forecast(), state.forecast())
+    assert not [name for name in tmp_path.iterdir() if name.suffix == '.tmp']
+
+
+def test_revision_depends_on_every_upload(sales):
+    first = WeeklyState.from_frame(sales, 'a').append(sales.iloc[:10], 'b')
+    second = WeeklyState.from_frame(sales, 'a').append(sales.iloc[:10], 'c')
+    assert first.revision != second.revision
+
+
+def test_duplicate_sku_weeks_rejected(sales):
+    doubled = pd.concat([sales, sales.iloc[:1]], ignore_index=True)
+    with pytest.raises(fe.ForecastError):
+        WeeklyState.from_frame(doubled)
@@ -0,0 +1,233 @@
+"""Server-side product image thumbnails.
+
+The results table used to hand raw 'Image 1 URL' values to the browser, so
+every viewer downloaded full-size retailer images. Here the unique URLs are
+fetched concurrently over one pooled HTTP session, shrunk with Pillow and
+kept in a size-bounded on-disk LRU keyed by URL. The table then gets small
+inline ``data:`` URIs.
+
+Any URL that can't be fetched or decoded keeps its original value, so the
+table never loses an image it could show before. The URLs come from
+uploaded data, so a download stops at ``MAX_IMAGE_BYTES`` and an image
+larger than ``MAX_IMAGE_PIXELS`` isn't decoded. Failed URLs aren't tried
+again for ``TOOLKIE_THUMBNAIL_RETRY_SECONDS``, and a caller waits at most
+``timeout`` seconds for downloads: the ones still running carry on in the
+background and are served from the cache next time.
+"""
+import base64
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from io import BytesIO
+
+from upload_cache import CACHE_DIR, atomic_write, evict_lru
+
+
+THUMBNAIL_SIZE = (96, 96)
+MAX_CACHE_BYTES = int(os.environ.get('TOOLKIE_THUMBNAIL_CACHE_BYTES', 256 * 1024 ** 2))
+FETCH_WORKERS = 16
+FETCH_TIMEOUT = 5
+# Larger downloads and images count as failures
+MAX_IMAGE_BYTES = 10 * 1024 ** 2
+MAX_IMAGE_PIXELS = 40_000_000
+# Seconds a URL that failed to download or decode is skipped for
+FAILURE_TTL = int(os.environ.get('TOOLKIE_THUMBNAIL_RETRY_SECONDS', 3600))
+# Seconds ``inline`` waits for missing thumbnails before using the URLs instead
+INLINE_TIMEOUT = 3
+# Inline at most this many thumbnails per table; the rest keep their URL
+MAX_INLINE_THUMBNAILS = 2000
+
+
+def make_session(pool_size=FETCH_WORKERS):
+    """A requests session whose connection pool matches the fetch concurrency."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=1)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def read_body(response, max_bytes=MAX_IMAGE_BYTES):
+    """The body of a streamed response; ValueError as soon as it is over ``max_bytes``."""
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > max_bytes:
+        raise ValueError(f"image of {length} bytes is over the {max_bytes} byte limit")
+    chunks = []
+    received = 0
+    for chunk in response.iter_content(64 * 1024):
+        received += len(chunk)
+        if received > max_bytes:
+            raise ValueError(f"image is over the {max_bytes} byte limit")
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def shrink(image_bytes, size=THUMBNAIL_SIZE, max_pixels=MAX_IMAGE_PIXELS):
+    """JPEG bytes of ``image_bytes`` scaled down to fit ``size``.
+
+    Raises ValueError for images over ``max_pixels``, before decoding them.
+    """
+    from PIL import Image
+
+    with Image.open(BytesIO(image_bytes)) as image:
+        # Opening only reads the header; refuse decompression bombs before the pixels are decoded
+        if image.width * image.height > max_pixels:
+            raise ValueError(f"image of {image.width}x{image.height} pixels is too large")
+        image.thumbnail(size)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        out = BytesIO()
+        image.save(out, format='JPEG', quality=80, optimize=True)
+    return out.getvalue()
+
+
+def data_uri(jpeg_bytes):
+    return 'data:image/jpeg;base64,' + base64.b64encode(jpeg_bytes).decode('ascii')
+
+
+class ThumbnailCache:
+    """On-disk LRU of thumbnails keyed by image URL."""
+
+    def __init__(self, directory=None, max_bytes=MAX_CACHE_BYTES, size=THUMBNAIL_SIZE,
+                 workers=FETCH_WORKERS, timeout=FETCH_TIMEOUT, session=None, failure_ttl=FAILURE_TTL,
+                 max_image_bytes=MAX_IMAGE_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+        self.directory = os.path.join(directory or CACHE_DIR, 'thumbnails')
+        self.max_bytes = max_bytes
+        self.size = size
+        self.workers = workers
+        self.timeout = timeout
+        self.failure_ttl = failure_ttl
+        self.max_image_bytes = max_image_bytes
+        self.max_pixels = max_pixels
+        self._session = session
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        self._pending = {}  # url -> Future of a download in progress
+        self._failed = {}  # url -> time of its last failed download
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = make_session(self.workers)
+        return self._session
+
+    def path_for(self, url):
+        key = hashlib.sha1(f'{url}|{self.size}'.encode()).hexdigest()
+        return os.path.join(self.directory, f'{key}.jpg')
+
+    def get(self, url):
+        path = self.path_for(url)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, url, jpeg_bytes):
+        os.makedirs(self.directory, exist_ok=True)
+
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(jpeg_bytes)
+
+        atomic_write(self.path_for(url), write)
+
+    def failed_recently(self, url):
+        """True if ``url`` failed within the last ``failure_ttl`` seconds."""
+        with self._lock:
+            failed_at = self._failed.get(url)
+            if failed_at is not None and time.time() - failed_at >= self.failure_ttl:
+                del self._failed[url]
+                failed_at = None
+        return failed_at is not None
+
+    def fetch(self, url):
+        """Download and shrink one image; None on any failure, which is remembered for ``failure_ttl``."""
+        try:
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                body = read_body(response, self.max_image_bytes)
+            thumbnail = shrink(body, self.size, self.max_pixels)
+        except Exception:
+            with self._lock:
+                self._failed[url] = time.time()
+            return None
+        try:
+            self.put(url, thumbnail)
+        except OSError:
+            pass
+        return thumbnail
+
+    def _download(self, url):
+        try:
+            return self.fetch(url)
+        finally:
+            with self._lock:
+                self._pending.pop(url, None)
+
+    def _submit(self, url):
+        """The download of ``url``, started unless one is already running."""
+        with self._lock:
+            future = self._pending.get(url)
+            if future is None:
+                future = self._pending[url] = self._pool.submit(self._download, url)
+        return future
+
+    def thumbnails(self, urls, timeout=None):
+        """Map the unique usable URLs in ``urls`` to thumbnail JPEG bytes (None if unavailable).
+
+        Cached thumbnails are read from disk and the rest fetched
+        concurrently, skipping URLs that failed recently. URLs whose
+        download hasn't finished after ``timeout`` seconds are left out;
+        the download carries on and fills the cache.
+        """
+        unique = [u for u in dict.fromkeys(urls) if isinstance(u, str) and u.startswith(('http://', 'https://'))]
+        result = {}
+        downloads = {}
+        for url in unique:
+            cached = self.get(url)
+            if cached is not None:
+                result[url] = cached
+            elif self.failed_recently(url):
+                result[url] = None
+            else:
+                downloads[url] = self._submit(url)
+        if downloads:
+            done, _ = wait(downloads.values(), timeout=timeout)
+            result.update((url, future.result()) for url, future in downloads.items() if future in done)
+            if os.path.isdir(self.directory):
+                evict_lru(self.directory, self.max_bytes, '.jpg')
+        return result
+
+    def inline(self, urls, limit=MAX_INLINE_THUMBNAILS, timeout=INLINE_TIMEOUT):
+        """``urls`` with each of the first ``limit`` unique ones replaced by a thumbnail data URI.
+
+        Waits at most ``timeout`` seconds for thumbnails that aren't cached yet.
+        """
+        urls = list(urls)
+        wanted = list(dict.fromkeys(urls))[:limit] if limit else list(dict.fromkeys(urls))
+        uris = {url: data_uri(jpeg) for url, jpeg in self.thumbnails(wanted, timeout).items() if jpeg is not None}
+        return [uris.get(url, url) for url in urls]
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def inline_thumbnails(urls, limit=MAX_INLINE_THUMBNAILS, timeout=INLINE_TIMEOUT):
+    """Thumbnail data URIs for ``urls`` through a shared, process-wide cache."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ThumbnailCache()
+    return _default.inline(urls, limit, timeout)
@@ -1,28 +1,30 @@
 import streamlit as st
 # Core imports
-import os
-import string
+import time
 import datetime as dt
-from io import BytesIO
+import logging
 
 # Data processing
-import numpy as np
 import pandas as pd
-from pandas.io.formats.style import Styler
 
-# File handling
-import openpyxl
-import requests
+# Heavy optional libraries (openpyxl, requests, PIL, pyarrow.parquet) are
+# imported by the feature that uses them, so reruns and cold starts don't
+# pay for them; ``python startup.py check`` enforces this.
 
-# Visualization
-import matplotlib.pyplot as plt
-from PIL import Image
-
-# Web framework
-import streamlit as st
-from dash import Dash, dash_table, html
-import dash_bootstrap_components as dbc
-from flask import Flask
+# Forecast logic
+from export import EXPORT_FORMATS, export_results
+from forecast_engine import HIERARCHY_LEVELS, ForecastError, ForecastParams, hierarchy_rollups
+from instrumentation import NULL_TRACER
+from jobs import DONE, FAILED, QUEUED, get_job, prewarm, submit_job
+from result_cache import cached_forecast
+from results_index import PAGE_SIZES, ResultsIndex
+from scenarios import run_scenarios, scenario_grid
+from snapshots import INTAKE_COLUMNS, LEVEL_KEYS, SnapshotStore, diff_summary, top_movers
+from stage_graph import forecast_graph, run_forecast as run_staged_forecast
+from startup import warm_up
+from thumbnails import inline_thumbnails
+from upload_cache import content_hash, load_upload
+from weekly_update import WeeklyState, state_lock, state_path as weekly_state_path
 
 
 
@@ -33,6 +35,12 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+logger = logging.getLogger(__name__)
+
+# Once per server process: warm a job worker (lazy imports, pandas' first-call
+# setup) while this first page is drawn, so the first forecast doesn't wait
+prewarm(warm_up)
+
 # Hide the menu header
 hide_streamlit_style = """
     <style>
@@ -149,8 +157,8 @@ with tab1:
     with col1:
         st.markdown("### Upload Data")
         uploaded_file = st.file_uploader(
-            "Upload Excel file",
-            type=["xlsx", "xls"],
+            "Upload Excel, CSV or Parquet file",
+            type=["xlsx", "xls", "csv", "parquet"],
             help="Maximum file size: 200MB"
         )
     
@@ -198,389 +206,408 @@ with tab1:
 
 # Add the rest of your calculation logic here 
 #   
+params = ForecastParams(
+    historical_horizon_period_start=historical_horizon_period_start,
+    historical_horizon_period_end=historical_horizon_period_end,
+    min_acceptable_margin=min_acceptable_margin,
+    expected_period_start=expected_period_start,
+    expected_period_end=expected_period_end,
+    fin_year=fin_year,
+)
+
 # Forecast Button
 st.markdown('<div style="text-align: center; margin-top: 30px;">', unsafe_allow_html=True)
+export_format = st.radio(
+    "Download format",
+    options=list(EXPORT_FORMATS),
+    format_func=lambda fmt: EXPORT_FORMATS[fmt][0],
+    horizontal=True
+)
+rollup_levels = st.multiselect(
+    "Add hierarchy totals to the download",
+    options=HIERARCHY_LEVELS,
+    help="Forecast totals per Category Level 2, Category Level 1, Department or Brand"
+)
+
+# How often the page refreshes while a forecast job is running
+JOB_POLL_SECONDS = 1
+
+# Sidebar facet filters: label -> (results column, widget key)
+FACET_FILTERS = {
+    "Filter by Brand": ('Brand', 'brand_filter'),
+    "Filter by Department": ('Department', 'dept_filter'),
+    "Filter by Category": ('Category Level 1', 'cat_filter'),
+}
+
+# Weekly refresh: keep the history as saved per-SKU, per-week state and
+# upload only the new week(s) after that
+UPLOAD_MODES = {
+    'full': "Full history",
+    'baseline': "Full history, saved as the weekly baseline",
+    'append': "New week(s) for the saved baseline",
+}
+upload_mode = st.radio(
+    "This upload is",
+    options=list(UPLOAD_MODES),
+    format_func=UPLOAD_MODES.get,
+    horizontal=True
+)
+baseline_name = 'default'
+if upload_mode != 'full':
+    baseline_name = st.text_input("Baseline name", value='default', help="One saved history per brand or extract")
+
+# Optional trace of every stage (time, rows, memory) in the sidebar
+st.sidebar.markdown("### Performance")
+show_trace = st.sidebar.checkbox("Trace forecast stages", value=False)
+trace_memory = st.sidebar.checkbox(
+    "Include memory (slower)", value=False, disabled=not show_trace,
+    help="Memory is measured for the whole server process, so it's only accurate while no other forecast is running."
+)
+
+def prepare_interactive_table(df):
+    # 'Image 1 URL' stays: thumbnails are added per page when it's shown
+    return df.drop(['product_url'], axis=1)
+
+# Forecasts run as background jobs (see jobs.py): widget reruns don't restart
+# them, progress shows stage by stage and a running forecast can be cancelled.
+# The job id lives in session state and its result is picked up on the first
+# rerun after it finishes.
 if st.button("Generate Forecast 🚀"):
     if uploaded_file is not None:
-        # Show a spinner while processing
-        with st.spinner('Generating forecast... Please wait...'):
-            # Read the uploaded Excel file into a DataFrame
-            sales_data_df = pd.read_excel(uploaded_file)
-            
-            # --- Original Code Logic Integration Starts Here ---
-            
-            sales_data_df['YearWeek'] = sales_data_df['Fin Year'] * 100 + sales_data_df['Week']
-            # The code expects 'Fin Year' and 'Week' columns to create YearWeek.
-            # If your data schema differs, adjust accordingly.
-            if 'Fin Year' not in sales_data_df.columns or 'Week' not in sales_data_df.columns:
-                st.error("The uploaded data must contain 'Fin Year' and 'Week' columns.")
-                st.stop()
-            
-            sales_data_df['YearWeek'] = sales_data_df['Fin Year'] * 100 + sales_data_df['Week']
-            
-            # Get the latest completed week (based on max stock units)
-            weeksumsales = []
-            weeksumsales = sales_data_df.groupby('YearWeek')['Actual Current Stock Units'].sum().reset_index()
-            max_stock_row = weeksumsales.loc[weeksumsales['Actual Current Stock Units'].idxmax()]
-            max_yearweek = max_stock_row['YearWeek']
-            lasted_completed_week = int(max_yearweek)
-
-            # Global thresholds
-            required_seaonal_clr_percent = 0.9
-            required_quartery_clr_percent = 0.8
-            required_8wks_clr_percent = 0.7
-            long_horizon_diminishing_return = 0.95
-            medium_horizon_diminishing_return = 0.98
-            min_availability = 40 
-            stock_threshold = 1
-            confidence = 0.85
-            low_data_confidence = 0.7
-            Min_no_of_data_points = 4
-            data_reduction_threshold = 0.5
-            
-            latest_completed_year_week = fin_year*100 + lasted_completed_week
-            year_week = fin_year*100 + lasted_completed_week
-            
-            # Ensure margin is numeric
-            if 'Actual Sales Margin %' not in sales_data_df.columns:
-                st.error("The uploaded data must contain 'Actual Sales Margin %' column.")
-                st.stop()
-            
-            #4 Convert 'Actual Sales Margin %' to numeric
-            sales_data_static_v1_df = sales_data_df #this is a df whic is storing the original sales data
-            sales_data_df['Actual Sales Margin %'] = pd.to_numeric(sales_data_df['Actual Sales Margin %'], errors='coerce')
-            sales_data_df['YearWeek'] = pd.to_numeric(sales_data_df['YearWeek'], errors='coerce')
-            #sales_data_df.to_parquet('sales_data_df.parquet', index=False)
-            # Step 1: Drop rows where 'Fin Year' is "-"
-            sales_data_dfere = sales_data_df[sales_data_df['Fin Year'] != "-"] #this does nothing because sales_data_dfere isn't being used anywhere else
+        # --- Original Code Logic Integration Starts Here ---
+        # The forecast itself (steps #4 to #18) lives in forecast_engine.py
+        # The stage graph keeps every step's last result for this session, so
+        # changing a parameter only recomputes the steps that depend on it.
+        # The upload is only parsed (or read from its cached Parquet copy,
+        # keyed by the hash of its bytes) when the file itself changes.
+        if 'forecast_graph' not in st.session_state:
+            st.session_state.forecast_graph = forecast_graph()
+        graph = st.session_state.forecast_graph
+        upload_bytes = uploaded_file.getvalue()
+        upload_key = content_hash(upload_bytes)
+
+        def forecast(tracer, upload_key=upload_key, params=params, upload_mode=upload_mode,
+                     state_dir=weekly_state_path(baseline_name), file_name=uploaded_file.name):
+            if upload_mode == 'full':
+                # Results are shared between sessions through a process-wide cache
+                # keyed by (upload hash, parameters): a forecast someone else has
+                # already run comes back without parsing or aggregating anything.
+                df_reordered, df_reordered_2 = cached_forecast(
+                    upload_key,
+                    params,
+                    lambda: run_staged_forecast(
+                        graph,
+                        upload_key,
+                        lambda: load_upload(upload_bytes, key=upload_key),
+                        params,
+                        tracer,
+                    ),
+                )
+            else:
+                # Weekly refresh: the saved per-SKU, per-week state takes the
+                # place of the full history (see weekly_update.py)
+                with state_lock(state_dir):
+                    if upload_mode == 'append':
+                        try:
+                            state = WeeklyState.load(state_dir)
+                        except FileNotFoundError:
+                            raise ForecastError(
+                                "There is no saved weekly baseline with this name yet; "
+                                "upload the full history as the baseline first."
+                            )
+                    with tracer.stage('upload parse') as event:
+                        df = load_upload(upload_bytes, key=upload_key)
+                        event['rows_out'] = len(df)
+                    with tracer.stage('weekly state update', len(df)):
+                        if upload_mode == 'append':
+                            state.append(df, upload_key)
+                        else:
+                            state = WeeklyState.from_frame(df, upload_key)
+                        state.save(state_dir)
+                upload_key = state.revision
+                df_reordered, df_reordered_2 = cached_forecast(
+                    upload_key, params, lambda: state.forecast(params, tracer)
+                )
+            # Every run is kept as a snapshot so later runs can be compared with
+            # it. The forecast doesn't depend on it: a snapshot that can't be
+            # written (full disk, a column Parquet can't hold) is only logged.
+            with tracer.stage('snapshot', len(df_reordered)):
+                try:
+                    snapshot_id = SnapshotStore().save(df_reordered, df_reordered_2, upload_key, params, file_name)
+                except Exception:
+                    logger.warning("Could not save the forecast snapshot", exc_info=True)
+                    snapshot_id = None
+            display_df = prepare_interactive_table(df_reordered_2)
+            # Index the results once per forecast so the sidebar search and
+            # filters below are lookups instead of scans of the whole table
+            with tracer.stage('search index', len(display_df)) as event:
+                results_index = ResultsIndex(display_df)
+                event['rows_out'] = len(results_index.vocabulary)
+            return (upload_key, params), df_reordered, df_reordered_2, results_index, snapshot_id
+
+        # A new forecast replaces the one this session still has running
+        previous_job = get_job(st.session_state.get('forecast_job'))
+        if previous_job is not None and previous_job.active:
+            previous_job.cancel()
+        st.session_state.forecast_job = submit_job(forecast, trace_memory=show_trace and trace_memory).id
+    else:
+        st.error('⚠️ Please upload a file before generating the forecast.')
 
+forecast_job = get_job(st.session_state.get('forecast_job'))
+if forecast_job is not None:
+    if forecast_job.active:
+        if forecast_job.status == QUEUED:
+            st.info('⏳ Forecast queued, waiting for a free worker...')
+        else:
+            stage = forecast_job.current_stage() or 'starting'
+            st.info(f"⏳ Generating forecast... {stage} ({forecast_job.elapsed():.0f}s)")
+        finished_stages = [
+            f"✅ {event['name']} — {event['seconds']:.2f}s" for event in forecast_job.tracer.summary()
+        ]
+        if finished_stages:
+            st.caption("  \n".join(finished_stages))
+        if st.button("Cancel forecast", disabled=forecast_job.cancel_requested):
+            forecast_job.cancel()
+    else:
+        del st.session_state.forecast_job
+        if forecast_job.status == DONE:
+            export_key, df_reordered, df_reordered_2, results_index, snapshot_id = forecast_job.result
+            st.session_state.forecast_results = {
+                'export_key': export_key,
+                'sku': df_reordered,
+                'product': df_reordered_2,
+                'snapshot_id': snapshot_id,
+                'tracer': forecast_job.tracer,
+                'new': True,
+            }
+            st.session_state.results_index = results_index
+            for column, key in FACET_FILTERS.values():
+                st.session_state.pop(key, None)
+            st.session_state.results_page = 1
+        elif forecast_job.status == FAILED:
+            if isinstance(forecast_job.error, ForecastError):
+                st.error(str(forecast_job.error))
+            else:
+                st.exception(forecast_job.error)
+        else:
+            st.warning('Forecast cancelled.')
+
+forecast_results = st.session_state.get('forecast_results')
+if forecast_results is not None:
+    df_reordered = forecast_results['sku']
+    df_reordered_2 = forecast_results['product']
+    # Exports are traced the first time round; after that they come from the cache
+    tracer = forecast_results['tracer'] if forecast_results.pop('new', False) else NULL_TRACER
+
+    # Hierarchy totals are rolled up from the SKU results once, the first
+    # time any level is asked for
+    rollups = {}
+    if rollup_levels:
+        if 'rollups' not in forecast_results:
+            with tracer.stage('hierarchy rollups', len(df_reordered)):
+                forecast_results['rollups'] = hierarchy_rollups(df_reordered)
+        rollups = {level: forecast_results['rollups'][level] for level in rollup_levels}
+
+    # Build only the download format that was picked. Excel is streamed
+    # with the SKU, product and any hierarchy sheets; Parquet/CSV get one
+    # file per level. Downloads are cached per (upload, parameters) so
+    # reruns reuse them.
+    st.success('✅ Forecast generated successfully!')
+    export_key = forecast_results['export_key']
+    label, file_name, mime = EXPORT_FORMATS[export_format]
+    if export_format == 'xlsx':
+        sheets = {'SKU Forecast': df_reordered, 'Product Forecast': df_reordered_2}
+        sheets.update((f'{level} Totals', df) for level, df in rollups.items())
+        downloads = [("📥 Download Results", file_name, sheets)]
+    else:
+        stem, ext = file_name.rsplit('.', 1)
+        downloads = [
+            ("📥 Download SKU Results", f"{stem}.{ext}", {'SKU Forecast': df_reordered}),
+            ("📥 Download Product Results", f"{stem}_products.{ext}", {'Product Forecast': df_reordered_2}),
+        ]
+        downloads.extend(
+            (f"📥 Download {level} Totals", f"{stem}_{level.lower().replace(' ', '_')}.{ext}", {f'{level} Totals': df})
+            for level, df in rollups.items()
+        )
+    for button_label, download_name, sheets in downloads:
+        with tracer.stage(f'export {export_format}', sum(len(df) for df in sheets.values())):
+            export_data = export_results(export_key, sheets, export_format)
+        st.download_button(
+            label=f"{button_label} ({label})",
+            data=export_data,
+            file_name=download_name,
+            mime=mime
+        )
 
-            #5 Calculation 1: Average Sales
-            
-            #5.1 Calculate the average sales for each product ID I use this to determine "enough" stock, where stock is less than this its deemed that the week didn't have enough stock
-            average_sales1 = sales_data_df[
-                (sales_data_df['YearWeek'] >= historical_horizon_period_start)&
-                (sales_data_df['YearWeek'] <= historical_horizon_period_end)
-            ].groupby('SKU ID')['Actual Sales Units'].mean().reset_index()
-            average_sales1.columns = ['SKU ID', 'Average Sales']
-            
-            #5.2 Merge the average sales back to the filtered DataFrame
-            sales_data_df2 = []
-            sales_data_df2 = sales_data_df.merge(average_sales1, on='SKU ID')
-
-            #6 creates a column that limits the data to the historical horizon chosen "HRN" stands for Sales Horizon
-            sales_data_df2['HRN'] = np.where(
-                (sales_data_df2['YearWeek'] >= historical_horizon_period_start) & 
-                (sales_data_df2['YearWeek'] <= historical_horizon_period_end), 
-                1, 
-                0
+    # What changed since an earlier run: both runs are read back from the
+    # snapshot store and aligned in one join (see snapshots.py)
+    snapshot_store = SnapshotStore()
+    earlier = [r for r in snapshot_store.records() if r['id'] != forecast_results['snapshot_id']]
+    if forecast_results['snapshot_id'] and earlier:
+        with st.expander("🔍 Compare with an earlier forecast"):
+            snapshot_labels = {
+                r['id']: f"{dt.datetime.fromtimestamp(r['created']):%Y-%m-%d %H:%M} · {r['label']} · {r['skus']:,} SKUs"
+                for r in earlier
+            }
+            compare_id = st.selectbox("Earlier forecast", options=list(snapshot_labels), format_func=snapshot_labels.get)
+            compare_level = st.radio(
+                "Compare", options=list(LEVEL_KEYS), format_func={'sku': "SKUs", 'product': "Products"}.get,
+                horizontal=True
             )
-            
-            #7 creating a column that returns 1 where the stock threshold is met i.e (opening_stock)''OPP'' > (average_sales*stock_threshold) - this will be used to exclude weeks in which we didn't have enough stock
-            sales_data_df2['OPP'] = np.where(
-                ((sales_data_df2['Actual EOW Stock Units']+sales_data_df2['Actual Sales Units']) >= sales_data_df2['Average Sales'] * stock_threshold) & 
-                ((sales_data_df2['Actual EOW Stock Units']+sales_data_df2['Actual Sales Units']) >= 2)&
-                (sales_data_df2['HRN'] == 1), 
-                1, 
-                0
-            )
-            
-            #8 creates a column that returns 1 where margin% is above the required threshold, this is used to exclude high anomoly weeks with very low margin
-            #ths only downside with this approach is that it completly excludes the weeks below, instead of using elasticity to normalize those sales.
-            #Actually I think this is a good idea to completly exclude
-            sales_data_df2['GP'] = np.where(
-                ((sales_data_df2['Actual Sales Margin %'] >= (min_acceptable_margin * 0.9)) | 
-                (((sales_data_df2['Actual Sales Margin %'] == "" ) & (sales_data_df2['OPP'] == 1))) &
-                (sales_data_df2['HRN'] == 1)), 
-                1, 
-                0
+            diff_key = (compare_id, forecast_results['snapshot_id'], compare_level)
+            if forecast_results.get('diff_key') != diff_key:
+                with st.spinner("Comparing forecasts..."):
+                    forecast_results['diff'] = snapshot_store.diff(*diff_key)
+                forecast_results['diff_key'] = diff_key
+            diff = forecast_results['diff']
+
+            counts, totals = diff_summary(diff)
+            for column, (change, count) in zip(st.columns(len(counts)), counts.items()):
+                column.metric(change.capitalize(), f"{count:,}")
+            mover_column = st.selectbox("Top movers by", options=INTAKE_COLUMNS)
+            st.caption(f"Total change in {mover_column}: {totals[mover_column]:+,.0f}")
+            key_column = LEVEL_KEYS[compare_level]
+            st.dataframe(
+                top_movers(diff, mover_column)[
+                    [key_column, 'change'] + [f'{mover_column} {part}' for part in ('old', 'new', 'delta')]
+                ],
+                hide_index=True
             )
-            
-            #9
-            #This is to create a column that sumns the three and if its equal to 3 then that week meets all the 3 criteria
-
-            sales_data_df2['OPP_GP'] = sales_data_df2['OPP'] + sales_data_df2['GP'] + sales_data_df2['HRN']
-            
-            #10 Final Calculations
-            #10.1 Average sales where all three conditions are met
-            average_sales_units = sales_data_df2[sales_data_df2['OPP_GP'] == 3].groupby('SKU ID')['Actual Sales Units'].mean().reset_index()
-            average_sales_units.columns = ['SKU ID', 'Av Sales U when in stock']
-            
-            #10.2 Sum of the sales where all three policies are met
-            sales_units_reviewed = sales_data_df2[sales_data_df2['OPP_GP'] == 3].groupby('SKU ID')['Actual Sales Units'].sum().reset_index()
-            sales_units_reviewed.columns = ['SKU ID', 'Tot Sales U when in stock']
-            
-            #10.3 Count the data points where all three policies are met
-            sales_units_reviewed_count = sales_data_df2[sales_data_df2['OPP_GP'] == 3].groupby('SKU ID')['Actual Sales Units'].count().reset_index()
-            sales_units_reviewed_count.columns = ['SKU ID', 'no_of_weeks_reviewed']
-            
-            #10.4 Sum of the sales for the entire historical horizon chosen
-            sales_units_total = sales_data_df2[(sales_data_df2['HRN'] == 1) & ((sales_data_df2['Actual EOW Stock Units']+sales_data_df2['Actual Sales Units']) >= 2)].groupby('SKU ID')['Actual Sales Units'].sum().reset_index()
-            sales_units_total.columns = ['SKU ID', 'Tot Sales U in horizon']
-
-            #10.5 average of the sales for the entire historical horizon chosen
-            tot_average_sales_units = sales_data_df2[(sales_data_df2['HRN'] == 1) & ((sales_data_df2['Actual EOW Stock Units']+sales_data_df2['Actual Sales Units']) >= 2)].groupby('SKU ID')['Actual Sales Units'].mean().reset_index()
-            tot_average_sales_units.columns = ['SKU ID', 'Tot Ave Sales U in horizon']
-
-            #10.6 Count the data points for the entire historical horizon chosen
-            sales_units_total_count = sales_data_df2[(sales_data_df2['HRN'] == 1) & ((sales_data_df2['Actual EOW Stock Units']+sales_data_df2['Actual Sales Units']) >= 2)].groupby('SKU ID')['Actual Sales Units'].count().reset_index()
-            sales_units_total_count.columns = ['SKU ID', 'count of horizon data point']
-
-            #10.7 Merge the DataFrames
-            merged_df = []
-            unique_skus_df = sales_data_static_v1_df[['SKU ID']].drop_duplicates().reset_index(drop=True) #this gives me the original sku ids with no duplicates
-            merged_df = unique_skus_df.merge(sales_units_total, on='SKU ID')
-            merged_df = merged_df.merge(sales_units_total_count, on='SKU ID')
-            merged_df = merged_df.merge(tot_average_sales_units, on='SKU ID')
-            merged_df = merged_df.merge(sales_units_reviewed, on='SKU ID')
-            merged_df = merged_df.merge(average_sales_units, on='SKU ID')
-            merged_df = merged_df.merge(sales_units_reviewed_count, on='SKU ID')
-
-            #10.7 Display the merged DataFrame
-            merged_df_x = merged_df #saving in case of an error later on so I reboot from this point
-
-            #11 Derives the base average weekly sales to be used in forecasting
-            merged_df['Use_this_ave_sales_u'] = np.where(
-                (merged_df['no_of_weeks_reviewed'] <= Min_no_of_data_points) | 
-                ((merged_df['no_of_weeks_reviewed']/merged_df['count of horizon data point']) <= data_reduction_threshold), 
-                merged_df['Av Sales U when in stock']*low_data_confidence, 
-                merged_df['Av Sales U when in stock']*confidence
+            label, file_name, mime = EXPORT_FORMATS[export_format]
+            stem, ext = file_name.rsplit('.', 1)
+            st.download_button(
+                label=f"📥 Download comparison ({label})",
+                data=export_results(diff_key, {'Changes': diff}, export_format),
+                file_name=f"{stem}_changes.{ext}",
+                mime=mime
             )
-            merged_df.head()
-
-            #12 Gets expected intakes and actual and merges them into the final df
-            #12.1 Sum of expected Intakes
-            expected_filtered_df = sales_data_static_v1_df[
-                (sales_data_static_v1_df['YearWeek'] >= expected_period_start) &
-                (sales_data_static_v1_df['YearWeek'] <= expected_period_end)
-            ]
-            expected_intakes = expected_filtered_df.groupby('SKU ID')['Expected Intake Units'].sum().reset_index()
-            expected_intakes.columns = ['SKU ID', 'Expected Intake Units']
-
-            #12.2  Sum of actual Intakes within the selected horizon
-            actual_intakes = sales_data_df2[(sales_data_df2['HRN'] == 1)].groupby('SKU ID')['Actual Intake Units'].sum().reset_index()
-            actual_intakes.columns = ['SKU ID', 'Actual Intake Units']
-
-
-            #13
-            #CurrentStock
-            current_stock1 = []
-            current_stock = []
-            current_stock1 = sales_data_static_v1_df[sales_data_static_v1_df['YearWeek']==max_yearweek] #filters on the last week, because in our business current stock is in the current week
-            current_stock = current_stock1.groupby('SKU ID')['Actual Current Stock Units'].sum().reset_index()
-            current_stock.columns = ['SKU ID', 'Actual Current Stock Units']
-
-            #14
-            # Merge the average sales back to the filtered DataFrame
-            merged_df = pd.merge(merged_df, actual_intakes, on='SKU ID',how='left')
-            merged_df['Actual Intake Units'].fillna(0, inplace=True)
-            merged_df = pd.merge(merged_df,expected_intakes, on='SKU ID',how='left') #the limitation here is that for styles that have not gone live they will be excluded
-            merged_df['Expected Intake Units'].fillna(0, inplace=True)
-            merged_df = pd.merge(merged_df, current_stock, on='SKU ID',how='left')
-            merged_df['Actual Current Stock Units'].fillna(0, inplace=True)
-            
 
+    if show_trace:
+        trace = forecast_results['tracer']
+        st.sidebar.dataframe(pd.DataFrame(trace.summary()), hide_index=True)
+        st.sidebar.download_button(
+            "Download trace (JSON)", trace.to_json(), file_name="forecast_trace.json", mime="application/json"
+        )
+        st.sidebar.download_button(
+            "Download Chrome trace", trace.to_chrome_trace(), file_name="forecast_trace.chrome.json",
+            mime="application/json"
+        )
 
-            #15
-            merged_df['Total_Season_Sales'] = round(merged_df["Use_this_ave_sales_u"]*26*long_horizon_diminishing_return)
-            merged_df['Total_Season_ideal_intakes'] = round(merged_df["Total_Season_Sales"]/required_seaonal_clr_percent)- merged_df['Actual Current Stock Units']
-            merged_df['Total_Qtr_Sales'] = round(merged_df["Use_this_ave_sales_u"]*13*medium_horizon_diminishing_return)
-            merged_df['Total_Qtr_ideal_intakes'] = round(merged_df["Total_Qtr_Sales"]/required_quartery_clr_percent)- merged_df['Actual Current Stock Units']
-            merged_df['Total_9wks_Sales_once_off_repeat'] = round(merged_df["Use_this_ave_sales_u"]*8*medium_horizon_diminishing_return)
-            merged_df['Total_9wks_Sales_once_off_repeat_ideal_intakes'] = round(merged_df["Total_9wks_Sales_once_off_repeat"]/required_8wks_clr_percent)- merged_df['Actual Current Stock Units']
-            
-            #16
-            # Select only the necessary columns from sales_data_df
-            selected_columns_df = sales_data_df[['SKU ID', 'Product ID','Current RSP (incl VAT)','Image 1 URL', 'product_url','Brand','Department','Category Level 1','Category Level 2','Product','Size']].drop_duplicates(subset='SKU ID')
-
-            #17
-            # Merge with average_sales_final
-            selected_columns_df2 = selected_columns_df.merge(merged_df, on='SKU ID')
-
-            # Replace NA with 0
-            selected_columns_df2.fillna(0,inplace=True)
-            #selected_columns_df2 ['Ideal_Summer_Intake'] = selected_columns_df2['Ideal_Intakes'] - selected_columns_df2['Actual Current Stock Units']
-
-            #18
-            df_reordered = selected_columns_df2[['Brand', 'Department', 'Category Level 1', 'Category Level 2', 'SKU ID','Product ID','Product','Size','Current RSP (incl VAT)','Actual Intake Units','Actual Current Stock Units','Expected Intake Units','Tot Ave Sales U in horizon', 'count of horizon data point', 'Tot Sales U when in stock', 'Av Sales U when in stock', 'no_of_weeks_reviewed', 'Use_this_ave_sales_u',   'Total_Season_Sales', 'Total_Season_ideal_intakes', 'Total_Qtr_Sales', 'Total_Qtr_ideal_intakes', 'Total_9wks_Sales_once_off_repeat', 'Total_9wks_Sales_once_off_repeat_ideal_intakes','Image 1 URL', 'product_url']]
-            # First, get the sum of Total_Season_Sales by Product ID
-            #season_sales_sum = df_reordered.groupby('Product ID')['Total_Season_Sales'].sum().reset_index()
-            # Get unique product information with max RSP
-           # product_info = df_reordered[['Brand', 'Department', 'Category Level 1', 'Category Level 2', 
-            #                            'Product ID', 'Product', 'Current RSP (incl VAT)','Image 1 URL', 'product_url']].copy()
-
-            # Get max RSP for each Product ID
-            #product_info['Max Current RSP (incl VAT)'] = product_info.groupby('Product ID')['Current RSP (incl VAT)'].transform('max')
-
-            # Drop duplicates to get unique Product IDs with their info
-            #product_info = product_info.drop('Current RSP (incl VAT)', axis=1).drop_duplicates(subset='Product ID')
-
-            # Merge the summary with product info
-            #summary_df = product_info.merge(season_sales_sum, on='Product ID', how='left')
-
-            # Sort by Total_Season_Sales in descending order
-            #summary_df = summary_df.sort_values('Total_Season_Sales', ascending=False)
-
-            # Add this after your calculations but before displaying the results
-            df_summed = []
-            df_summed = df_reordered.groupby('Product ID').agg({
-                'Current RSP (incl VAT)':'mean',
-                'Actual Intake Units': 'sum',
-                'Actual Current Stock Units': 'sum',
-                'Expected Intake Units': 'sum',
-                'Tot Ave Sales U in horizon': 'sum',
-                'count of horizon data point': 'max', 
-                'Tot Sales U when in stock': 'sum',
-                'Av Sales U when in stock': 'sum',
-                'no_of_weeks_reviewed': 'max',
-                'Use_this_ave_sales_u': 'sum',
-                'Total_Season_Sales': 'sum',
-                'Total_Season_ideal_intakes': 'sum',
-                'Total_Qtr_Sales': 'sum',
-                'Total_Qtr_ideal_intakes': 'sum',
-                'Total_9wks_Sales_once_off_repeat': 'sum',
-                'Total_9wks_Sales_once_off_repeat_ideal_intakes': 'sum'
-            }).reset_index()
-
-            # Select only the necessary columns from sales_data_df
-            selected_columns_df_3 = []
-            selected_columns_df_3 = sales_data_static_v1_df[['Product ID','Image 1 URL', 'product_url','Brand','Department','Category Level 1','Category Level 2','Product']].drop_duplicates(subset='Product ID')
-            selected_columns_df_3.fillna(0,inplace=True)
-            selected_columns_df_4 = selected_columns_df_3.merge(df_summed, on='Product ID')
-            selected_columns_df_4.fillna(0,inplace=True)
-            df_reordered_2 = selected_columns_df_4[['Image 1 URL','Brand', 'Department', 'Category Level 1', 'Category Level 2', 'Product ID','Product','Current RSP (incl VAT)','Actual Intake Units','Actual Current Stock Units','Expected Intake Units','Tot Ave Sales U in horizon', 'count of horizon data point', 'Tot Sales U when in stock', 'Av Sales U when in stock', 'no_of_weeks_reviewed', 'Use_this_ave_sales_u',   'Total_Season_Sales', 'Total_Season_ideal_intakes', 'Total_Qtr_Sales', 'Total_Qtr_ideal_intakes', 'Total_9wks_Sales_once_off_repeat', 'Total_9wks_Sales_once_off_repeat_ideal_intakes', 'product_url']]
-            
-            def prepare_interactive_table(df):
-                display_df = df.copy()
-                display_df['Image'] = display_df['Image 1 URL']
-                display_df = display_df.drop(['Image 1 URL', 'product_url'], axis=1)
-                return display_df
-            # Prepare initial data
-            display_df = prepare_interactive_table(df_reordered_2)
+st.markdown('</div>', unsafe_allow_html=True)
 
-            # Initialize session state
-            if 'display_df' not in st.session_state:
-                st.session_state.display_df = prepare_interactive_table(df_reordered_2)
-                st.session_state.filtered_df = st.session_state.display_df.copy()
-
-            # # Debug: Print initial row count
-            # st.sidebar.write(f"Total rows before filtering: {len(st.session_state.display_df)}")
-
-            # # Add filters in sidebar
-            # st.sidebar.markdown("### Data Filters")
-
-            # # Add search box with debug
-            # search_term = st.sidebar.text_input("Search Products", key='search')
-
-            # # Add dropdown filters with counts
-            # brand_filter = st.sidebar.multiselect(
-            #     "Filter by Brand",
-            #     options=sorted(st.session_state.display_df["Brand"].unique()),
-            #     default=[],
-            #     key='brand_filter'
-            # )
-
-            # dept_filter = st.sidebar.multiselect(
-            #     "Filter by Department",
-            #     options=sorted(st.session_state.display_df["Department"].unique()),
-            #     default=[],
-            #     key='dept_filter'
-            # )
-
-            # cat_filter = st.sidebar.multiselect(
-            #     "Filter by Category",
-            #     options=sorted(st.session_state.display_df["Category Level 1"].unique()),
-            #     default=[],
-            #     key='cat_filter'
-            # )
-
-            # # Apply filters
-            filtered_df = st.session_state.display_df.copy()
-
-            # if search_term:
-            #     mask = filtered_df.astype(str).agg(' '.join, axis=1).str.contains(search_term, case=False)
-            #     filtered_df = filtered_df[mask]
-
-            # if brand_filter:
-            #     filtered_df = filtered_df[filtered_df["Brand"].isin(brand_filter)]
-
-            # if dept_filter:
-            #     filtered_df = filtered_df[filtered_df["Department"].isin(dept_filter)]
-
-            # if cat_filter:
-            #     filtered_df = filtered_df[filtered_df["Category Level 1"].isin(cat_filter)]
-
-            # # Update filtered dataframe in session state
-            # st.session_state.filtered_df = filtered_df
-            #             # Display filtered dataframe
-            
-            with tab2:
-                st.subheader("Forecast Results")
-                st.dataframe(
-                    filtered_df,
-                    column_config={
-                        "Image": st.column_config.ImageColumn(
-                            "Product Image",
-                            help="Product image",
-                            width="medium",
-                        ),
-                        "Brand": st.column_config.TextColumn("Brand", width="medium"),
-                        "Department": st.column_config.TextColumn("Department", width="medium"),
-                        "Current RSP (incl VAT)": st.column_config.NumberColumn(
-                            "Price",
-                            format="R%.2f"
-                        )
-                    },
-                    use_container_width=True,
-                    hide_index=True,
-                    column_order=["Image", "Brand", "Department", "Category Level 1", "Category Level 2", 
-                                "Product ID","Product","Current RSP (incl VAT)",
-                                "Actual Intake Units","Actual Current Stock Units","Expected Intake Units",
-                                "Tot Ave Sales U in horizon", "no_of_weeks_reviewed",  
-                                "Av Sales U when in stock", "Use_this_ave_sales_u",   
-                                "Total_Season_Sales", "Total_Season_ideal_intakes", "Total_Qtr_Sales", "Total_Qtr_ideal_intakes", 
-                                "Total_9wks_Sales_once_off_repeat", "Total_9wks_Sales_once_off_repeat_ideal_intakes", "product_url"]
+# Search, filter and page through the latest results. This runs on every
+# rerun, so changing a filter doesn't need the forecast to be generated again,
+# and only the visible page of rows is sent to the browser.
+results_index = st.session_state.get('results_index')
+if results_index is not None:
+    st.sidebar.markdown("### Data Filters")
+    search_term = st.sidebar.text_input("Search Products", key='search')
+    facet_filters = {}
+    for label, (column, key) in FACET_FILTERS.items():
+        counts = results_index.facet_options(column)
+        facet_filters[column] = st.sidebar.multiselect(
+            label,
+            options=list(counts),
+            format_func=lambda value, counts=counts: f"{value} ({counts[value]:,})",
+            default=[],
+            key=key
+        )
+    positions = results_index.filter(search_term, facet_filters)
+
+    page_size = st.sidebar.selectbox("Rows per page", PAGE_SIZES, index=1)
+    n_pages = max(1, -(-len(positions) // page_size))
+    st.session_state.results_page = min(st.session_state.get('results_page', 1), n_pages)
+    page = st.sidebar.number_input("Page", min_value=1, max_value=n_pages, key='results_page')
+
+    with tab2:
+        st.subheader("Forecast Results")
+        st.caption(f"{len(positions):,} of {len(results_index):,} products · page {page} of {n_pages}")
+        page_df = results_index.page(positions, page - 1, page_size)
+        # Small thumbnails fetched and cached on the server instead of every
+        # browser downloading the full-size retailer images. Only the visible
+        # page is looked up, waiting a few seconds at most: images still
+        # downloading show from their URL and come from the cache next time.
+        page_df = page_df.assign(Image=inline_thumbnails(page_df['Image 1 URL'])).drop(columns=['Image 1 URL'])
+        st.dataframe(
+            page_df,
+            column_config={
+                "Image": st.column_config.ImageColumn(
+                    "Product Image",
+                    help="Product image",
+                    width="medium",
+                ),
+                "Brand": st.column_config.TextColumn("Brand", width="medium"),
+                "Department": st.column_config.TextColumn("Department", width="medium"),
+                "Current RSP (incl VAT)": st.column_config.NumberColumn(
+                    "Price",
+                    format="R%.2f"
                 )
+            },
+            use_container_width=True,
+            hide_index=True,
+            column_order=["Image", "Brand", "Department", "Category Level 1", "Category Level 2", 
+                        "Product ID","Product","Current RSP (incl VAT)",
+                        "Actual Intake Units","Actual Current Stock Units","Expected Intake Units",
+                        "Tot Ave Sales U in horizon", "no_of_weeks_reviewed",  
+                        "Av Sales U when in stock", "Use_this_ave_sales_u",   
+                        "Total_Season_Sales", "Total_Season_ideal_intakes", "Total_Qtr_Sales", "Total_Qtr_ideal_intakes", 
+                        "Total_9wks_Sales_once_off_repeat", "Total_9wks_Sales_once_off_repeat_ideal_intakes", "product_url"]
+        )
 
-            #def render_images(df):
-            #    return df.to_html(escape=False, formatters=dict(**{
-            #        'Image 1 URL': lambda x: f'<img src="{x}" width="100" />' if pd.notnull(x) else ''
-            #    }))
-
-            # Assuming df_reordered is your DataFrame
-            #html_table = render_images(df_reordered_2)
-
-            # Display the merged DataFrame with images in Streamlit
-            #st.markdown(html_table, unsafe_allow_html=True)
-
-           
-            # --- Original Code Logic Ends Here ---
-            # Before creating the Excel file for download:
-            #st.markdown("### Preview of Results with Images")
-            #html = render_dataframe_with_images(summary_df) I would have loved to have rendered the preview table
-            #st.markdown(html, unsafe_allow_html=True)
-            # Convert the result to an Excel file for download
-            towrite = BytesIO()
-            df_reordered.to_excel(towrite, index=False)
-            towrite.seek(0)
-
-            # Success message and download button
-            st.success('✅ Forecast generated successfully!')
-            st.download_button(
-                label="📥 Download Results",
-                data=towrite,
-                file_name="forecast_results.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-
-    else:
-        st.error('⚠️ Please upload a file before generating the forecast.')
-
-st.markdown('</div>', unsafe_allow_html=True)
+# What-if scenarios: every combination of the values below in one batched run
+SCENARIO_LABELS = {
+    'min_acceptable_margin': "Minimum Margin",
+    'confidence': "Confidence",
+    'low_data_confidence': "Low Data Confidence",
+    'required_seaonal_clr_percent': "Seasonal Clearance %",
+    'required_quartery_clr_percent': "Quarterly Clearance %",
+    'required_8wks_clr_percent': "8 Week Clearance %",
+    'long_horizon_diminishing_return': "Long Horizon Diminishing Return",
+    'medium_horizon_diminishing_return': "Medium Horizon Diminishing Return",
+}
+with tab1:
+    with st.expander("What-if Scenarios"):
+        st.caption("Enter comma-separated values to compare (e.g. 0.3, 0.35, 0.4). Blank keeps the current setting.")
+        scenario_values = {}
+        scenario_cols = st.columns(2)
+        for i, (name, label) in enumerate(SCENARIO_LABELS.items()):
+            with scenario_cols[i % 2]:
+                text = st.text_input(label, key=f"scenario_{name}", placeholder=str(getattr(params, name)))
+            if text.strip():
+                try:
+                    scenario_values[name] = [float(v) for v in text.split(',') if v.strip()]
+                except ValueError:
+                    st.error(f"'{label}' must be a list of numbers.")
+                    st.stop()
+
+        if st.button("Run Scenarios"):
+            if uploaded_file is None:
+                st.error('⚠️ Please upload a file before running scenarios.')
+            else:
+                with st.spinner('Running scenarios...'):
+                    grid = scenario_grid(params, **scenario_values)
+                    try:
+                        scenario_skus, scenario_totals = run_scenarios(load_upload(uploaded_file.getvalue()), grid, params)
+                    except ForecastError as exc:
+                        st.error(str(exc))
+                        st.stop()
+                st.markdown(f"#### {len(grid)} scenarios")
+                st.dataframe(scenario_totals, use_container_width=True)
+                st.download_button(
+                    label="📥 Download Scenario Results (CSV)",
+                    data=scenario_skus.to_csv(index=False).encode(),
+                    file_name="scenario_results.csv",
+                    mime="text/csv"
+                )
 
 # Add footer
 st.markdown("""
 <div style='text-align: center; color: #668; padding: 20px;'>
     Developed by F.Flow
 </div>
-""", unsafe_allow_html=True)            
+""", unsafe_allow_html=True)
+
+# Poll a running forecast so its progress and result show up without a click
+if forecast_job is not None and forecast_job.active:
+    time.sleep(JOB_POLL_SECONDS)
+    st.rerun()            
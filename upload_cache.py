@@ -0,0 +1,141 @@
+"""On-disk cache of parsed uploads.
+
+Parsing a large workbook with openpyxl takes far longer than the forecast
+itself, so the parsed frame is saved as a compressed Parquet sidecar keyed by
+a hash of the uploaded bytes. Re-running with new parameters, or uploading
+the same file again, reads the sidecar instead of the workbook. The cache
+directory is bounded in size and evicts the least recently used sidecars.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import pandas as pd
+
+from export import arrow_safe
+from ingest import LEAN_MEMORY, read_upload
+
+
+CACHE_DIR = os.environ.get(
+    'TOOLKIE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'toolkie')
+)
+MAX_CACHE_BYTES = int(os.environ.get('TOOLKIE_UPLOAD_CACHE_BYTES', 2 * 1024 ** 3))
+
+# Bump when the way uploads are parsed changes, so old sidecars are not reused
+CACHE_VERSION = 3
+
+
+def content_hash(data):
+    """Hex digest identifying the uploaded bytes."""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def atomic_write(path, write):
+    """Create ``path`` with ``write(tmp_path)`` through a temp file, so readers never see half of it."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_json(path, value):
+    """Write ``value`` as JSON to ``path`` atomically."""
+    def dump(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+
+    atomic_write(path, dump)
+
+
+def evict_lru(directory, max_bytes, suffix, keep=None):
+    """Delete the oldest-mtime ``*suffix`` files in ``directory`` until they total ``max_bytes``.
+
+    ``keep`` (a path) is never deleted.
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+class UploadCache:
+    """Size-bounded LRU directory of Parquet sidecars keyed by content hash."""
+
+    def __init__(self, directory=None, max_bytes=MAX_CACHE_BYTES):
+        self.directory = os.path.join(directory or CACHE_DIR, 'uploads')
+        self.max_bytes = max_bytes
+
+    def path_for(self, key):
+        mode = '.lean' if LEAN_MEMORY else ''
+        return os.path.join(self.directory, f'{key}.v{CACHE_VERSION}{mode}.parquet')
+
+    def get(self, key):
+        """Return the cached frame for ``key``, or None."""
+        path = self.path_for(key)
+        try:
+            df = pd.read_parquet(path)
+        except (OSError, ValueError, ImportError):
+            return None
+        # mtime doubles as the LRU clock
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return df
+
+    def put(self, key, df):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(key)
+        # Concurrent sessions never see half a sidecar
+        atomic_write(path, lambda tmp_path: arrow_safe(df).to_parquet(tmp_path, index=False, compression='zstd'))
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Delete the least recently used sidecars until under ``max_bytes``."""
+        evict_lru(self.directory, self.max_bytes, '.parquet', keep)
+
+    def load(self, data, reader=read_upload, key=None):
+        """Return the parsed frame for ``data``, parsing with ``reader`` only on a miss.
+
+        Pass ``key`` when the content hash of ``data`` is already known.
+        """
+        if key is None:
+            key = content_hash(data)
+        df = self.get(key)
+        if df is None:
+            df = reader(data)
+            try:
+                self.put(key, df)
+            except (OSError, ValueError, TypeError, ImportError):
+                # A full disk or a column Parquet can't hold shouldn't stop the forecast
+                pass
+        return df
+
+
+def load_upload(data, reader=read_upload, key=None):
+    """Parse uploaded bytes through the default upload cache."""
+    return UploadCache().load(data, reader, key)
@@ -0,0 +1,344 @@
+"""Dense SKU x fiscal-week arrays with prefix sums.
+
+The forecast windows are FINYWW ranges. Instead of rebuilding a boolean mask
+over every row for each window, the sales extract is laid out once as
+``[n_skus, n_weeks]`` arrays over a contiguous fiscal-week axis, with
+cumulative sums along the week axis. Window totals are then two lookups per
+SKU, and the per-week policy masks only look at the weeks inside the window.
+
+Fiscal years are not all the same length, so FINYWW values are mapped to
+contiguous ordinals through a ``FiscalCalendar`` built from the weeks in the
+data (e.g. 202452 is followed by 202501, or by 202453 in a 53-week year).
+
+Memory is roughly ``n_skus * n_weeks * 8`` bytes per measure, about 80 MB
+per measure for 100k SKUs over two years.
+"""
+import numpy as np
+import pandas as pd
+
+import forecast_engine as fe
+
+
+# Per-row measures laid out on the cube (SalesArrays attribute names)
+CELL_MEASURES = ('sales', 'eow_stock', 'margin', 'actual_intake', 'expected_intake', 'current_stock')
+# Measures that get prefix sums for O(1) window totals
+PREFIX_MEASURES = ('sales', 'sales_count', 'actual_intake', 'expected_intake')
+
+WEEKS_PER_YEAR = 52
+MAX_WEEK = 53
+
+
+def _check_weeks(year_weeks, valid):
+    if not np.all(valid):
+        bad = np.unique(year_weeks[~valid])[:5]
+        raise fe.ForecastError(
+            "Fin Year and Week give weeks outside their fiscal year: " + ", ".join(str(int(w)) for w in bad)
+        )
+
+
+class FiscalCalendar:
+    """Maps FINYWW values to contiguous week ordinals and back.
+
+    Years run from ``first_year`` with ``weeks_per_year[i]`` weeks each.
+    Years outside that range are assumed to have 52 weeks. A week that isn't
+    in its year (week 0, or 53 of a 52-week year) raises ForecastError
+    rather than landing in a neighbouring year's cell.
+    """
+
+    def __init__(self, first_year, weeks_per_year):
+        self.first_year = int(first_year)
+        self.weeks_per_year = np.asarray(weeks_per_year, dtype='int64')
+        self.offsets = np.concatenate([[0], np.cumsum(self.weeks_per_year)])
+
+    @classmethod
+    def from_year_weeks(cls, year_weeks):
+        """Calendar covering every FINYWW in ``year_weeks`` (NaN ignored)."""
+        year_weeks = np.asarray(year_weeks, dtype='float64')
+        year_weeks = year_weeks[~np.isnan(year_weeks)].astype('int64')
+        if len(year_weeks) == 0:
+            return cls(0, [])
+        years, weeks = np.divmod(year_weeks, 100)
+        _check_weeks(year_weeks, (weeks >= 1) & (weeks <= MAX_WEEK))
+        first_year = years.min()
+        last_week = np.zeros(years.max() - first_year + 1, dtype='int64')
+        np.maximum.at(last_week, years - first_year, weeks)
+        return cls(first_year, np.maximum(last_week, WEEKS_PER_YEAR))
+
+    @property
+    def n_weeks(self):
+        return int(self.offsets[-1])
+
+    def _year_start(self, years):
+        """Ordinal of week 1 of each year, extrapolating 52-week years outside the range."""
+        i = years - self.first_year
+        inside = np.clip(i, 0, len(self.weeks_per_year))
+        return self.offsets[inside] + (i - inside) * WEEKS_PER_YEAR
+
+    def _year_length(self, years):
+        i = years - self.first_year
+        inside = (i >= 0) & (i < len(self.weeks_per_year))
+        lengths = np.full(np.shape(i), WEEKS_PER_YEAR, dtype='int64')
+        lengths[inside] = self.weeks_per_year[i[inside]]
+        return lengths
+
+    def ordinal(self, year_weeks):
+        """Ordinal of each FINYWW (week 1 of ``first_year`` is 0)."""
+        year_weeks = np.asarray(year_weeks, dtype='int64')
+        years, weeks = np.divmod(year_weeks, 100)
+        _check_weeks(year_weeks, (weeks >= 1) & (weeks <= self._year_length(years)))
+        return self._year_start(years) + weeks - 1
+
+    def start_ordinal(self, year_week):
+        """First ordinal with FINYWW >= ``year_week``."""
+        years, weeks = divmod(int(year_week), 100)
+        years = np.asarray(years)
+        weeks = min(max(weeks, 1), int(self._year_length(years)) + 1)
+        return int(self._year_start(years)) + weeks - 1
+
+    def end_ordinal(self, year_week):
+        """Last ordinal with FINYWW <= ``year_week``."""
+        years, weeks = divmod(int(year_week), 100)
+        years = np.asarray(years)
+        weeks = min(weeks, int(self._year_length(years)))
+        return int(self._year_start(years)) + weeks - 1
+
+    def year_weeks(self):
+        """FINYWW of every ordinal in the calendar."""
+        years = np.repeat(np.arange(len(self.weeks_per_year)) + self.first_year, self.weeks_per_year)
+        weeks = np.arange(self.n_weeks) - self.offsets[years - self.first_year] + 1
+        return years * 100 + weeks
+
+
+class WeekCube:
+    """Sales measures as ``[n_skus, n_weeks]`` arrays.
+
+    ``cells[m]`` holds each SKU-week's value (NaN where there is no row or
+    the value is missing) and ``prefix[m]`` the cumulative sums along the
+    week axis with a leading zero column, so the total over ordinals
+    ``[a, b]`` is ``prefix[m][:, b + 1] - prefix[m][:, a]``.
+
+    ``exact`` is False when some SKU-week has more than one row. Cells then
+    hold summed values and the per-week policy masks no longer match the
+    row-level forecast.
+    """
+
+    def __init__(self, skus, calendar, cells, exact=True):
+        self.skus = skus
+        self.calendar = calendar
+        self.cells = cells
+        self.exact = exact
+        self.prefix = {
+            measure: np.zeros((len(skus), calendar.n_weeks + 1)) for measure in PREFIX_MEASURES
+        }
+        self.refresh_prefix()
+
+    def refresh_prefix(self, start=0):
+        """Recompute the prefix sums from week ordinal ``start`` on (earlier columns are unchanged)."""
+        for measure in PREFIX_MEASURES:
+            values = self.cells[measure][:, start:]
+            if measure != 'sales_count':
+                values = np.nan_to_num(values)
+            prefix = self.prefix[measure]
+            # Carry on from column ``start`` so the sums match a full recompute exactly
+            running = np.column_stack([prefix[:, start], values])
+            prefix[:, start + 1:] = np.cumsum(running, axis=1)[:, 1:]
+
+    @property
+    def n_skus(self):
+        return len(self.skus)
+
+    def bounds(self, start, end):
+        """Ordinal slice ``[a, b)`` of the FINYWW range ``[start, end]``, clipped to the cube."""
+        n_weeks = self.calendar.n_weeks
+        a = min(max(self.calendar.start_ordinal(start), 0), n_weeks)
+        b = min(max(self.calendar.end_ordinal(end) + 1, a), n_weeks)
+        return a, max(a, b)
+
+    def total(self, measure, start, end):
+        """Per-SKU total of a prefix measure over FINYWW ``[start, end]``."""
+        a, b = self.bounds(start, end)
+        prefix = self.prefix[measure]
+        return prefix[:, b] - prefix[:, a]
+
+    def window(self, measure, start, end):
+        """View of the cells of ``measure`` inside FINYWW ``[start, end]``."""
+        a, b = self.bounds(start, end)
+        return self.cells[measure][:, a:b]
+
+    def week_totals(self, measure):
+        return np.nansum(self.cells[measure], axis=0)
+
+
+def build_cube(df, year_weeks=None):
+    """Lay out the sales rows of ``df`` on a WeekCube."""
+    return cube_from_arrays(fe.sales_arrays(df, year_weeks))
+
+
+def cube_cells(arrays):
+    """SKU-week cells per measure of the cube of ``arrays``, without building it."""
+    return arrays.n_skus * FiscalCalendar.from_year_weeks(arrays.year_weeks).n_weeks
+
+
+def cube_from_arrays(arrays):
+    """Lay out ``fe.SalesArrays`` on a WeekCube."""
+    dated = ~np.isnan(arrays.year_weeks)
+    calendar = FiscalCalendar.from_year_weeks(arrays.year_weeks[dated])
+    n_skus, n_weeks = arrays.n_skus, calendar.n_weeks
+
+    cell = arrays.codes[dated] * n_weeks + calendar.ordinal(arrays.year_weeks[dated])
+    rows = np.bincount(cell, minlength=n_skus * n_weeks)
+    exact = rows.max(initial=0) <= 1
+
+    cells = {}
+    for measure in CELL_MEASURES:
+        values = getattr(arrays, measure)[dated]
+        if exact:
+            grid = np.full(n_skus * n_weeks, np.nan)
+            grid[cell] = values
+        else:
+            grid = np.bincount(cell, weights=np.nan_to_num(values), minlength=n_skus * n_weeks)
+            grid[rows == 0] = np.nan
+        cells[measure] = grid.reshape(n_skus, n_weeks)
+    has_sales = (~np.isnan(arrays.sales[dated])).astype('float64')
+    cells['sales_count'] = np.bincount(cell, weights=has_sales, minlength=n_skus * n_weeks).reshape(n_skus, n_weeks)
+    return WeekCube(arrays.skus, calendar, cells, exact)
+
+
+def _relayout(cube, skus, calendar):
+    """``cube``'s cells moved onto ``skus`` (a superset, old SKUs first) and ``calendar``."""
+    columns = calendar.ordinal(cube.calendar.year_weeks())
+    cells = {}
+    for measure, values in cube.cells.items():
+        fill = 0.0 if measure == 'sales_count' else np.nan
+        grid = np.full((len(skus), calendar.n_weeks), fill)
+        grid[:cube.n_skus, columns] = values
+        cells[measure] = grid
+    return WeekCube(skus, calendar, cells, cube.exact)
+
+
+def update_cube(cube, df, year_weeks=None):
+    """Write the weeks present in ``df`` into ``cube``, replacing those weeks entirely.
+
+    Used for weekly refreshes: only the rows of the new week(s) are read.
+    SKUs not seen before are appended in order of first appearance, as
+    they would be in a full-history upload. Returns the updated cube, which
+    is a new object when the SKUs or the calendar had to grow (a new SKU,
+    a new fiscal year or a 53rd week) and ``cube`` itself otherwise.
+    """
+    if year_weeks is None:
+        year_weeks = fe.year_week(df)
+    new = build_cube(df, year_weeks)
+    if not (cube.exact and new.exact):
+        raise fe.ForecastError("Weekly updates need one row per SKU and week; some SKU-weeks have several rows.")
+    if new.calendar.n_weeks == 0:
+        return cube
+
+    known = pd.Index(cube.skus)
+    rows = known.get_indexer(new.skus)
+    added = rows < 0
+    rows[added] = cube.n_skus + np.arange(added.sum())
+    skus = np.concatenate([cube.skus, new.skus[added]]) if added.any() else cube.skus
+
+    # Weeks the upload has any row for
+    dated = ~np.isnan(year_weeks) & pd.notna(df['SKU ID']).to_numpy()
+    new_year_weeks = np.unique(year_weeks[dated]).astype('int64')
+    new_columns = new.calendar.ordinal(new_year_weeks)
+
+    calendar = FiscalCalendar.from_year_weeks(np.concatenate([cube.calendar.year_weeks(), new_year_weeks]))
+    same_calendar = (
+        calendar.first_year == cube.calendar.first_year
+        and np.array_equal(calendar.weeks_per_year, cube.calendar.weeks_per_year)
+    )
+    if added.any() or not same_calendar:
+        cube = _relayout(cube, skus, calendar)
+
+    columns = cube.calendar.ordinal(new_year_weeks)
+    for measure, values in cube.cells.items():
+        fill = 0.0 if measure == 'sales_count' else np.nan
+        values[:, columns] = fill
+        values[np.ix_(rows, columns)] = new.cells[measure][:, new_columns]
+    cube.refresh_prefix(int(columns.min()))
+    return cube
+
+
+def trim_cube(cube, year_week):
+    """Drop the fiscal years that end before FINYWW ``year_week`` (to bound the state's size).
+
+    Only whole years are dropped, so every remaining week keeps its place in
+    the calendar.
+    """
+    year = int(year_week) // 100
+    drop = min(max(year - cube.calendar.first_year, 0), len(cube.calendar.weeks_per_year))
+    if drop == 0:
+        return cube
+    start = int(cube.calendar.offsets[drop])
+    calendar = FiscalCalendar(cube.calendar.first_year + drop, cube.calendar.weeks_per_year[drop:])
+    cells = {measure: values[:, start:].copy() for measure, values in cube.cells.items()}
+    return WeekCube(cube.skus, calendar, cells, cube.exact)
+
+
+def latest_completed_week(cube):
+    """FINYWW of the week with the most 'Actual Current Stock Units' (step #4)."""
+    return cube.calendar.year_weeks()[np.argmax(cube.week_totals('current_stock'))]
+
+
+def horizon_sums(cube, params):
+    """Steps #5-#7 and #10.4-#10.6/#12.2 over the historical horizon.
+
+    Returns ``(opp, sums)``: the OPP mask of the horizon's cells (see
+    ``window``) and per-SKU ``[horizon sales, horizon weeks, actual intakes]``.
+    """
+    start, end = params.historical_horizon_period_start, params.historical_horizon_period_end
+
+    #5.1 average sales over the historical horizon from the prefix sums
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average_sales = cube.total('sales', start, end) / cube.total('sales_count', start, end)
+
+    #6, #7 policy masks, only over the weeks inside the horizon
+    sales = cube.window('sales', start, end)
+    opening_stock = cube.window('eow_stock', start, end) + sales
+    horizon = opening_stock >= 2
+    opp = horizon & (opening_stock >= average_sales[:, None] * params.stock_threshold)
+    sums = np.column_stack([
+        np.where(horizon, sales, 0.0).sum(axis=1), horizon.sum(axis=1),
+        cube.total('actual_intake', start, end),
+    ])
+    return opp, sums
+
+
+def in_stock_sums(cube, params, opp):
+    """Steps #8-#10.3 given the horizon's ``opp`` mask: per-SKU ``[in-stock sales, in-stock weeks]``."""
+    start, end = params.historical_horizon_period_start, params.historical_horizon_period_end
+    in_stock = opp & (cube.window('margin', start, end) >= params.min_acceptable_margin * 0.9)
+    return np.column_stack([np.where(in_stock, cube.window('sales', start, end), 0.0).sum(axis=1), in_stock.sum(axis=1)])
+
+
+def expected_sums(cube, params):
+    """Step #12.1: per-SKU expected intakes as an ``[n_skus, 1]`` array."""
+    return cube.total('expected_intake', params.expected_period_start, params.expected_period_end)[:, None]
+
+
+def current_stock(cube, max_yearweek):
+    """Step #13: per-SKU stock in week ``max_yearweek`` as an ``[n_skus, 1]`` array (a single column)."""
+    current = np.zeros(cube.n_skus)
+    ordinal = cube.calendar.ordinal(int(max_yearweek))
+    if 0 <= ordinal < cube.calendar.n_weeks:
+        current = np.nan_to_num(cube.cells['current_stock'][:, ordinal])
+    return current[:, None]
+
+
+def aggregate_skus(cube, params, max_yearweek=None):
+    """Steps #5 to #14 from the cube; ``forecast_engine.aggregate_skus``'s ``merged_df`` to the last few bits.
+
+    Requires ``cube.exact``.
+    """
+    if not cube.exact:
+        raise ValueError("the cube has several rows for some SKU-weeks; use forecast_engine.aggregate_skus")
+    if max_yearweek is None:
+        max_yearweek = latest_completed_week(cube)
+    opp, horizon = horizon_sums(cube, params)
+    #10.7, #14 in SKU_MEASURES order
+    sums = np.column_stack([
+        in_stock_sums(cube, params, opp), horizon, expected_sums(cube, params), current_stock(cube, max_yearweek),
+    ])
+    return fe.sku_frame(cube.skus, sums)
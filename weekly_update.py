@@ -0,0 +1,211 @@
+"""Weekly refreshes from saved per-SKU, per-week state.
+
+Every week the full history used to be uploaded again to add one week. All
+the step #10 inputs combine week by week, so the state kept here is the
+``week_cube.WeekCube`` of per-SKU, per-week values plus the product
+attributes of every SKU. An "append week" upload only parses its own rows,
+writes those weeks into the cube and updates the prefix sums from the first
+changed week on.
+
+The #5.1 average-sales threshold depends on the historical window, so the
+OPP/GP week counts can't be kept as running per-SKU totals. The window's
+average comes from the prefix sums, and the OPP/GP masks are recomputed over
+the window's columns of the cube, which is ``n_skus * window weeks`` array
+work with no parsing or grouping of history rows. The window itself moves
+with the FINYWW parameters, so a new week drops the oldest one just by
+moving the dates forward. ``trim`` drops whole fiscal years that no
+window needs any more, to keep the saved state small.
+
+Usage::
+
+    python weekly_update.py init  STATE_DIR full_history.xlsx
+    python weekly_update.py append STATE_DIR week_34.xlsx [--trim-before 202440]
+    python weekly_update.py forecast STATE_DIR results.xlsx [--param name=value ...]
+
+Results match a forecast run on the full history as one upload (to the
+last few bits with fractional units, see ``stage_graph``), except for the
+order of the SKU rows: SKUs are kept in order of first appearance across
+the uploads, which is the full history's order only when that is sorted by
+week.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+import forecast_engine as fe
+import week_cube
+from export import arrow_safe
+from instrumentation import NULL_TRACER
+from upload_cache import CACHE_DIR, atomic_write, content_hash, write_json
+
+
+STATE_DIR = os.path.join(CACHE_DIR, 'weekly')
+STATE_VERSION = 1
+
+
+def sku_attributes(df):
+    """First row of ``ATTRIBUTE_COLUMNS`` for each SKU, in order of first appearance."""
+    return fe.first_rows(df[df['SKU ID'].notna()], 'SKU ID', fe.ATTRIBUTE_COLUMNS).reset_index(drop=True)
+
+
+class WeeklyState:
+    """The cube and SKU attributes of a sales history, updated a week at a time.
+
+    ``revision`` identifies the data that went in (a hash chained over every
+    upload), so it can key result caches.
+    """
+
+    def __init__(self, cube, attributes, revision):
+        self.cube = cube
+        self.attributes = attributes
+        self.revision = revision
+
+    @classmethod
+    def from_frame(cls, df, upload_key=''):
+        """State for a full-history frame."""
+        fe.validate_schema(df)
+        cube = week_cube.build_cube(df)
+        if not cube.exact:
+            raise fe.ForecastError("Weekly updates need one row per SKU and week; some SKU-weeks have several rows.")
+        return cls(cube, sku_attributes(df), _chain('', upload_key))
+
+    @property
+    def year_weeks(self):
+        """FINYWW of the weeks holding any data."""
+        has_data = ~np.isnan(self.cube.cells['sales']).all(axis=0) | (self.cube.week_totals('current_stock') != 0)
+        return self.cube.calendar.year_weeks()[has_data]
+
+    def append(self, df, upload_key=''):
+        """Add the weeks in ``df`` (replacing any already held) and the attributes of new SKUs."""
+        fe.validate_schema(df)
+        self.cube = week_cube.update_cube(self.cube, df)
+        attributes = sku_attributes(df)
+        new = ~attributes['SKU ID'].isin(self.attributes['SKU ID'])
+        if new.any():
+            self.attributes = pd.concat([self.attributes, attributes[new]], ignore_index=True)
+        self.revision = _chain(self.revision, upload_key)
+        return self
+
+    def trim(self, year_week):
+        """Drop the fiscal years that end before FINYWW ``year_week``."""
+        self.cube = week_cube.trim_cube(self.cube, year_week)
+        return self
+
+    def forecast(self, params=None, tracer=NULL_TRACER):
+        """``(sku_df, product_df)`` as ``forecast_engine.run_forecast`` gives for the full history."""
+        params = params or fe.ForecastParams()
+        with tracer.stage('#4 latest completed week', self.cube.n_skus):
+            max_yearweek = week_cube.latest_completed_week(self.cube)
+        with tracer.stage('#5-#14 per-SKU aggregation', self.cube.n_skus) as event:
+            merged_df = week_cube.aggregate_skus(self.cube, params, max_yearweek)
+            event['rows_out'] = len(merged_df)
+        with tracer.stage('#11/#15 intake maths', len(merged_df)):
+            merged_df = fe.forecast_intakes(merged_df, params)
+        with tracer.stage('#16-#18 attributes', len(self.attributes)) as event:
+            sku_df = fe.attach_attributes(self.attributes, merged_df)
+            event['rows_out'] = len(sku_df)
+        with tracer.stage('product rollup', len(sku_df)) as event:
+            product_df = fe.product_rollup(self.attributes, sku_df)
+            event['rows_out'] = len(product_df)
+        return sku_df, product_df
+
+    def save(self, directory):
+        """Write the state to ``directory`` (created if needed)."""
+        os.makedirs(directory, exist_ok=True)
+        cube = self.cube
+        arrays = {f'cell_{measure}': values for measure, values in cube.cells.items()}
+
+        def write_cube(path):
+            # Through a file object, as np.savez would add '.npz' to the temp file's name
+            with open(path, 'wb') as f:
+                np.savez(f, skus=cube.skus, weeks_per_year=cube.calendar.weeks_per_year, **arrays)
+
+        atomic_write(os.path.join(directory, 'cube.npz'), write_cube)
+        atomic_write(os.path.join(directory, 'attributes.parquet'),
+                     lambda path: arrow_safe(self.attributes).to_parquet(path, index=False, compression='zstd'))
+        meta = {'version': STATE_VERSION, 'revision': self.revision, 'first_year': cube.calendar.first_year}
+        write_json(os.path.join(directory, 'state.json'), meta)
+
+    @classmethod
+    def load(cls, directory):
+        """The state saved in ``directory``; FileNotFoundError if there is none."""
+        with open(os.path.join(directory, 'state.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != STATE_VERSION:
+            raise fe.ForecastError("The saved weekly state is from an older version; upload the full history again.")
+        with np.load(os.path.join(directory, 'cube.npz'), allow_pickle=True) as saved:
+            skus = saved['skus']
+            calendar = week_cube.FiscalCalendar(meta['first_year'], saved['weeks_per_year'])
+            cells = {name[len('cell_'):]: saved[name] for name in saved.files if name.startswith('cell_')}
+        attributes = pd.read_parquet(os.path.join(directory, 'attributes.parquet'))
+        # Keep the IDs exactly as the cube has them, so the attribute join matches
+        ids = dict(zip(pd.Index(skus).astype(str), skus))
+        attributes['SKU ID'] = attributes['SKU ID'].astype(str).map(ids)
+        return cls(week_cube.WeekCube(skus, calendar, cells, exact=True), attributes, meta['revision'])
+
+
+def _chain(revision, upload_key):
+    return hashlib.blake2b(f'{revision}|{upload_key}'.encode(), digest_size=20).hexdigest()
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def state_lock(directory):
+    """Lock to hold while loading, updating and saving the state in ``directory``."""
+    with _locks_guard:
+        return _locks.setdefault(os.path.abspath(directory), threading.Lock())
+
+
+def state_path(name):
+    """Directory of the named state under the Toolkie cache directory."""
+    return os.path.join(STATE_DIR, hashlib.sha1(name.encode()).hexdigest()[:16])
+
+
+def main(argv=None):
+    from batch_forecast import make_params, write_results
+    from ingest import read_upload
+
+    parser = argparse.ArgumentParser(description="Keep a saved sales history up to date one week at a time.")
+    parser.add_argument('command', choices=('init', 'append', 'forecast'))
+    parser.add_argument('state', help="directory holding the saved state")
+    parser.add_argument('path', help="extract to read (init/append) or results file to write (forecast)")
+    parser.add_argument('--trim-before', type=int, default=None,
+                        help="after appending, drop the fiscal years that end before this FINYWW")
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help="ForecastParams override for 'forecast' (repeatable)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'forecast':
+        overrides = dict(item.split('=', 1) for item in args.param)
+        state = WeeklyState.load(args.state)
+        sku_df, product_df = state.forecast(make_params(overrides))
+        for path in write_results(sku_df, product_df, args.path):
+            print(f"Wrote {path}")
+        return 0
+
+    with open(args.path, 'rb') as f:
+        data = f.read()
+    df = read_upload(data, args.path)
+    upload_key = content_hash(data)
+    if args.command == 'init':
+        state = WeeklyState.from_frame(df, upload_key)
+    else:
+        state = WeeklyState.load(args.state).append(df, upload_key)
+    if args.trim_before:
+        state.trim(args.trim_before)
+    state.save(args.state)
+    weeks = state.year_weeks
+    print(f"{state.cube.n_skus} SKUs, weeks {weeks.min() if len(weeks) else '-'} to {weeks.max() if len(weeks) else '-'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())